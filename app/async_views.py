@@ -0,0 +1,138 @@
+"""
+Async versions of the prediction API for ASGI deployments.
+
+Request parsing and validation run on the event loop; the model call is
+CPU-bound and blocks, so it is handed to a bounded thread pool of
+``ML_INFERENCE_THREADS`` workers. NumPy and sklearn release the GIL for
+most of the work, and the event loop stays free to accept and parse
+other requests meanwhile. Responses are identical to the sync views.
+
+Django 3.2's ``csrf_exempt`` and ``require_http_methods`` wrap views in
+sync functions, so both are done by hand here.
+"""
+
+import asyncio
+import contextvars
+import json
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.http import HttpResponse, HttpResponseNotAllowed, JsonResponse
+
+from .latency import stage, timed_view
+from .prediction import InvalidInput, parse_batch, parse_sample, parse_top_k, predict_batch, predict_sample
+from .response_encoding import get_encoder, parse_response_format
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_executor():
+    """Return this process's inference thread pool."""
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(max_workers=settings.ML_INFERENCE_THREADS,
+                                               thread_name_prefix='inference')
+    return _executor
+
+
+async def run_inference(func, *args):
+    """Run a blocking model call on the inference pool without blocking the event loop."""
+    # Copy the context so stages timed in the pool count towards this request.
+    context = contextvars.copy_context()
+    return await asyncio.get_running_loop().run_in_executor(get_executor(), context.run, func, *args)
+
+
+def async_api_view(view):
+    """Accept only POST and skip CSRF checks, like the sync API views."""
+    async def wrapper(request, *args, **kwargs):
+        if request.method != 'POST':
+            return HttpResponseNotAllowed(['POST'])
+        return await view(request, *args, **kwargs)
+    wrapper.__name__ = view.__name__
+    wrapper.__doc__ = view.__doc__
+    wrapper.csrf_exempt = True
+    return wrapper
+
+
+#<-----Async API Endpoint for Crop Prediction----->#
+@async_api_view
+@timed_view
+async def predict_crop_api_async(request):
+    """Async counterpart of ``views.predict_crop_api``."""
+    try:
+        with stage('parse'):
+            data = json.loads(request.body)
+        try:
+            with stage('validate'):
+                input_data = parse_sample(data)
+                top_k = parse_top_k(request.GET.get('top_k'))
+                response_format = parse_response_format(request.GET.get('format'))
+        except InvalidInput as e:
+            return JsonResponse({
+                'error': str(e)
+            }, status=400)
+
+        try:
+            with stage('predict'):
+                bundle, predicted_crop, probabilities = await run_inference(predict_sample, input_data)
+        except FileNotFoundError:
+            return JsonResponse({
+                'error': 'Model files not found. Please contact administrator.'
+            }, status=500)
+
+        with stage('serialize'):
+            body = get_encoder(bundle).sample(input_data, predicted_crop, probabilities, top_k, response_format)
+            return HttpResponse(body, content_type='application/json')
+
+    except json.JSONDecodeError:
+        return JsonResponse({
+            'error': 'Invalid JSON format'
+        }, status=400)
+    except Exception as e:
+        return JsonResponse({
+            'error': f'Internal server error: {str(e)}'
+        }, status=500)
+
+
+#<-----Async API Endpoint for Batch Crop Prediction----->#
+@async_api_view
+@timed_view
+async def predict_crop_batch_api_async(request):
+    """Async counterpart of ``views.predict_crop_batch_api``."""
+    try:
+        with stage('parse'):
+            data = json.loads(request.body)
+        try:
+            with stage('validate'):
+                matrix, valid, errors = parse_batch(data)
+                top_k = parse_top_k(request.GET.get('top_k'))
+                response_format = parse_response_format(request.GET.get('format'))
+        except InvalidInput as e:
+            return JsonResponse({
+                'error': str(e)
+            }, status=400)
+
+        try:
+            with stage('predict'):
+                bundle, rows, labels, probabilities = await run_inference(predict_batch, matrix, valid)
+        except FileNotFoundError:
+            return JsonResponse({
+                'error': 'Model files not found. Please contact administrator.'
+            }, status=500)
+
+        with stage('serialize'):
+            body = get_encoder(bundle).batch(len(matrix), errors, rows, labels, probabilities, top_k, response_format)
+            return HttpResponse(body, content_type='application/json')
+
+    except json.JSONDecodeError:
+        return JsonResponse({
+            'error': 'Invalid JSON format'
+        }, status=400)
+    except Exception as e:
+        return JsonResponse({
+            'error': f'Internal server error: {str(e)}'
+        }, status=500)
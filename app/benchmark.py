@@ -0,0 +1,123 @@
+"""
+Micro-benchmarks for the inference engines.
+
+Each engine is a callable taking raw FEATURES-ordered rows and returning
+class probabilities. ``bench_batch`` times repeated calls on one batch
+and measures the peak memory of a single call with tracemalloc (which
+NumPy reports its buffers to); ``bench_concurrent`` has several threads
+predict single rows at once. ``compare`` checks a set of results against
+a stored baseline.
+"""
+
+import threading
+import time
+import tracemalloc
+
+import numpy as np
+
+BATCH_SIZES = (1, 32, 1000, 100000)
+# Metrics where a larger value is a regression.
+COMPARED_METRICS = ('p50_ms', 'peak_bytes')
+
+
+def time_calls(func, X, min_time=0.5, min_calls=5, max_calls=2000):
+    """Call ``func(X)`` at least ``min_calls`` times and for at least ``min_time`` seconds."""
+    func(X)  # warm-up
+    latencies = []
+    started = time.perf_counter()
+    while len(latencies) < min_calls or (time.perf_counter() - started < min_time and len(latencies) < max_calls):
+        call_started = time.perf_counter()
+        func(X)
+        latencies.append(time.perf_counter() - call_started)
+    return np.array(latencies)
+
+
+def peak_memory(func, X):
+    """Peak bytes allocated during one ``func(X)`` call."""
+    tracemalloc.start()
+    try:
+        func(X)
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def summarize(latencies, rows_per_call, wall_seconds=None):
+    ms = latencies * 1000
+    if wall_seconds is None:
+        wall_seconds = latencies.sum()
+    return {
+        'calls': len(latencies),
+        'rows': rows_per_call,
+        'mean_ms': float(ms.mean()),
+        'p50_ms': float(np.percentile(ms, 50)),
+        'p90_ms': float(np.percentile(ms, 90)),
+        'p99_ms': float(np.percentile(ms, 99)),
+        'rows_per_second': rows_per_call * len(latencies) / wall_seconds,
+    }
+
+
+def bench_batch(func, X, min_time=0.5):
+    result = summarize(time_calls(func, X, min_time=min_time), len(X))
+    result['peak_bytes'] = peak_memory(func, X)
+    return result
+
+
+def bench_concurrent(func, rows, threads, calls_per_thread):
+    """``threads`` threads each predict ``calls_per_thread`` single rows as fast as they can."""
+    latencies = [[] for _ in range(threads)]
+    barrier = threading.Barrier(threads + 1)
+
+    def worker(index):
+        samples = rows[index::threads]
+        barrier.wait()
+        for i in range(calls_per_thread):
+            row = samples[i % len(samples)][np.newaxis]
+            started = time.perf_counter()
+            func(row)
+            latencies[index].append(time.perf_counter() - started)
+
+    func(rows[:1])  # warm-up
+    pool = [threading.Thread(target=worker, args=(i,)) for i in range(threads)]
+    for thread in pool:
+        thread.start()
+    barrier.wait()
+    started = time.perf_counter()
+    for thread in pool:
+        thread.join()
+    result = summarize(np.concatenate(latencies), 1, time.perf_counter() - started)
+    result['threads'] = threads
+    return result
+
+
+def run_suite(engines, dataset, sizes=BATCH_SIZES, threads=8, calls_per_thread=200, min_time=0.5, seed=0,
+              log=None):
+    """Benchmark every engine; returns ``{case name: metrics}``."""
+    rng = np.random.default_rng(seed)
+    batches = {size: dataset[rng.integers(0, len(dataset), size)] for size in sizes}
+    cases = {}
+    for name, func in engines.items():
+        for size in sizes:
+            cases[f'{name}/{size}'] = bench_batch(func, batches[size], min_time=min_time)
+            if log:
+                log(f'{name}/{size}', cases[f'{name}/{size}'])
+        if threads:
+            case = f'{name}/concurrent-{threads}'
+            cases[case] = bench_concurrent(func, dataset[rng.permutation(len(dataset))], threads, calls_per_thread)
+            if log:
+                log(case, cases[case])
+    return cases
+
+
+def compare(cases, baseline_cases, tolerance):
+    """Return a message for every metric worse than the baseline by more than ``tolerance``."""
+    regressions = []
+    for name, case in cases.items():
+        base = baseline_cases.get(name)
+        if base is None:
+            continue
+        for metric in COMPARED_METRICS:
+            if metric in case and base.get(metric) and case[metric] > base[metric] * (1 + tolerance):
+                regressions.append(f'{name} {metric}: {case[metric]:.4g} vs baseline {base[metric]:.4g} '
+                                   f'(+{case[metric] / base[metric] - 1:.0%})')
+    return regressions
@@ -0,0 +1,146 @@
+"""
+Streaming bulk scoring of CSV and NDJSON uploads.
+
+The request body is read in fixed-size chunks, split into records and
+scored ``chunk_rows`` at a time with the vectorized model, and results
+are yielded as soon as each chunk is done. Memory stays bounded by the
+chunk size however large the upload is.
+"""
+
+import codecs
+import csv
+import json
+
+import numpy as np
+
+from .prediction import FEATURES, parse_records, predict_matrix, validate_matrix
+
+# Column names accepted in CSV headers, including the dataset's short names.
+CSV_COLUMNS = {'N': 'nitrogen', 'P': 'phosphorus', 'K': 'potassium'}
+CSV_COLUMNS.update({f: f for f in FEATURES})
+
+OUTPUT_FORMATS = ('ndjson', 'csv')
+CONTENT_TYPES = {'ndjson': 'application/x-ndjson', 'csv': 'text/csv'}
+
+
+def iter_lines(stream, chunk_size=64 * 1024, encoding='utf-8'):
+    """Yield decoded lines from a file-like object, reading ``chunk_size`` bytes at a time."""
+    decoder = codecs.getincrementaldecoder(encoding)(errors='replace')
+    pending = ''
+    while True:
+        chunk = stream.read(chunk_size)
+        if not chunk:
+            break
+        pending += decoder.decode(chunk)
+        lines = pending.split('\n')
+        pending = lines.pop()
+        for line in lines:
+            yield line.rstrip('\r')
+    pending += decoder.decode(b'', final=True)
+    if pending:
+        yield pending.rstrip('\r')
+
+
+def read_csv_header(lines):
+    """
+    Consume the header line and return the position of every feature in it.
+
+    Raises ValueError for an empty upload or naming the first missing column.
+    """
+    header = next(csv.reader(line for line in lines if line.strip()), None)
+    if header is None:
+        raise ValueError('CSV upload is empty')
+    positions = {}
+    for i, name in enumerate(header):
+        feature = CSV_COLUMNS.get(name.strip())
+        if feature is not None:
+            positions.setdefault(feature, i)
+    for feature in FEATURES:
+        if feature not in positions:
+            raise ValueError(f'Missing required column: {feature}')
+    return [positions[f] for f in FEATURES]
+
+
+def iter_csv_records(lines, columns):
+    """Yield FEATURES-ordered value lists from CSV data lines."""
+    for row in csv.reader(lines):
+        if not row:
+            continue
+        try:
+            yield [row[i] for i in columns]
+        except IndexError:
+            yield None
+
+
+def iter_ndjson_records(lines):
+    """Yield one decoded object per non-blank NDJSON line (None if it is not valid JSON)."""
+    for line in lines:
+        if not line.strip():
+            continue
+        try:
+            yield json.loads(line)
+        except ValueError:
+            yield None
+
+
+def score_records(records, bundle, chunk_rows=1024):
+    """
+    Score records in chunks.
+
+    Yields one list per chunk of ``(row, label, probability, error)`` tuples,
+    where ``label`` and ``probability`` are None for rows with an error.
+    """
+    start = 0
+    chunk = []
+    for record in records:
+        chunk.append(record)
+        if len(chunk) == chunk_rows:
+            yield _score_chunk(chunk, start, bundle)
+            start += len(chunk)
+            chunk = []
+    if chunk:
+        yield _score_chunk(chunk, start, bundle)
+
+
+def _score_chunk(records, start, bundle):
+    matrix, errors = parse_records([[] if r is None else r for r in records])
+    errors.update({i: 'Invalid record' for i, record in enumerate(records) if record is None})
+    valid, errors = validate_matrix(matrix, errors)
+    rows = np.flatnonzero(valid)
+    results = [None] * len(records)
+    if len(rows):
+        labels, probabilities = predict_matrix(bundle, matrix[rows])
+        top = probabilities.max(axis=1)
+        for j, i in enumerate(rows.tolist()):
+            results[i] = (start + i, str(labels[j]), float(top[j]), None)
+    for i, error in errors.items():
+        results[i] = (start + i, None, None, error)
+    return results
+
+
+def render_ndjson(chunks):
+    for results in chunks:
+        lines = []
+        for row, label, probability, error in results:
+            if error is None:
+                lines.append(json.dumps({'row': row, 'prediction': label, 'probability': round(probability, 4)}))
+            else:
+                lines.append(json.dumps({'row': row, 'error': error}))
+        yield '\n'.join(lines) + '\n'
+
+
+class _Echo:
+    """File-like object whose write() returns the line, for csv.writer."""
+
+    def write(self, value):
+        return value
+
+
+def render_csv(chunks):
+    writer = csv.writer(_Echo())
+    yield writer.writerow(['row', 'prediction', 'probability', 'error'])
+    for results in chunks:
+        yield ''.join(
+            writer.writerow([row, label or '', '' if probability is None else f'{probability:.4f}', error or ''])
+            for row, label, probability, error in results
+        )
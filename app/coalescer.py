@@ -0,0 +1,91 @@
+"""
+Micro-batching for single-sample predictions.
+
+Concurrent requests hand their row to a ``RequestCoalescer`` which waits
+up to ``window`` seconds (or until ``max_batch_size`` rows are queued),
+runs one vectorized prediction over all of them and gives every caller
+back its own row. This only pays off when a worker serves requests
+concurrently, e.g. gunicorn's ``gthread`` worker or an ASGI server.
+"""
+
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+import numpy as np
+
+
+class RequestCoalescer:
+    """Collects rows from many threads and predicts them in batches."""
+
+    def __init__(self, predict_rows, window=0.002, max_batch_size=64):
+        """
+        ``predict_rows`` takes an (n, features) float array and returns a
+        sequence of n per-row results.
+        """
+        self.predict_rows = predict_rows
+        self.window = window
+        self.max_batch_size = max_batch_size
+        self.batches = 0
+        self.rows = 0
+        self._lock = threading.Lock()
+        self._pid = None
+        self._queue = None
+
+    def submit(self, row):
+        """Queue one row and return a Future resolving to its result."""
+        future = Future()
+        self._ensure_worker().put((row, future))
+        return future
+
+    def predict(self, row, timeout=30):
+        """Queue one row and block until its result is ready."""
+        return self.submit(row).result(timeout)
+
+    def stats(self):
+        return {
+            'batches': self.batches,
+            'rows': self.rows,
+            'mean_batch_size': self.rows / self.batches if self.batches else 0.0,
+        }
+
+    def _ensure_worker(self):
+        # Threads do not survive fork(), so every worker process starts its own.
+        if self._pid != os.getpid():
+            with self._lock:
+                if self._pid != os.getpid():
+                    self._queue = queue.Queue()
+                    thread = threading.Thread(target=self._run, args=(self._queue,),
+                                              name='prediction-coalescer', daemon=True)
+                    thread.start()
+                    self._pid = os.getpid()
+        return self._queue
+
+    def _run(self, pending):
+        while True:
+            batch = [pending.get()]
+            deadline = time.monotonic() + self.window
+            while len(batch) < self.max_batch_size:
+                remaining = deadline - time.monotonic()
+                try:
+                    batch.append(pending.get(timeout=remaining) if remaining > 0 else pending.get_nowait())
+                except queue.Empty:
+                    break
+            self._dispatch(batch)
+
+    def _dispatch(self, batch):
+        batch = [(row, future) for row, future in batch if future.set_running_or_notify_cancel()]
+        if not batch:
+            return
+        try:
+            results = self.predict_rows(np.array([row for row, _ in batch], dtype=np.float64))
+        except Exception as e:
+            for _, future in batch:
+                future.set_exception(e)
+            return
+        self.batches += 1
+        self.rows += len(batch)
+        for (_, future), result in zip(batch, results):
+            future.set_result(result)
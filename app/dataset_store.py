@@ -0,0 +1,256 @@
+"""
+Columnar binary copy of the training CSV.
+
+``read_dataset`` parses the CSV once into a store directory holding one
+``.npy`` file per column and a ``meta.json``, then memory-maps the
+columns on every later call instead of parsing again. Columns use the
+smallest dtype that holds their values exactly: integer columns the
+smallest integer type, float columns float32 when every value survives
+the round trip (float64 otherwise, so models train on the same numbers
+as from the CSV), and text columns are stored as category codes with
+the categories in ``meta.json``.
+
+The store remembers the size, modification time and SHA-256 of the CSV
+it was built from and is rebuilt when the file changes; a file that was
+only touched is rehashed, not re-parsed. ``append_rows`` adds newly
+labeled rows to the CSV and extends the store without parsing the whole
+file again; the batches it appended are listed in a ``.appended`` file
+beside the CSV, so the record survives the store being rebuilt or
+deleted. This module must not import Django.
+"""
+
+import hashlib
+import io
+import json
+import os
+import shutil
+import tempfile
+
+import numpy as np
+import pandas as pd
+
+from .training_cache import dataset_digest
+
+DEFAULT_DIR = '.dataset_cache'
+FORMAT_VERSION = 1
+
+
+def store_path(csv_path, directory=DEFAULT_DIR):
+    """The store directory for ``csv_path`` (one per CSV file)."""
+    name = os.path.splitext(os.path.basename(csv_path))[0]
+    return os.path.join(directory, f'{name}-{hashlib.sha1(os.path.abspath(csv_path).encode()).hexdigest()[:8]}')
+
+
+def source_stamp(csv_path):
+    stat = os.stat(csv_path)
+    return {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+
+
+def compact_column(values):
+    """Return ``(array, categories)``: the column in its smallest exact dtype, or as category codes."""
+    if pd.api.types.is_integer_dtype(values):
+        return pd.to_numeric(values, downcast='unsigned' if values.min() >= 0 else 'integer').to_numpy(), None
+    if pd.api.types.is_float_dtype(values):
+        array = values.to_numpy(dtype=np.float64)
+        narrow = array.astype(np.float32)
+        exact = np.array_equal(narrow.astype(np.float64), array, equal_nan=True)
+        return (narrow if exact else array), None
+    # Categories in order of first appearance, as pandas lists the values of a text column.
+    categorical = pd.Categorical(values, categories=pd.unique(values.dropna()))
+    return np.asarray(categorical.codes), [str(category) for category in categorical.categories]
+
+
+def build_store(csv_path, path, df=None):
+    """Parse ``csv_path`` (or take its contents, ``df``) into a store at ``path``; returns its metadata."""
+    stamp = source_stamp(csv_path)
+    if df is None:
+        df = pd.read_csv(csv_path)
+    meta = {'format': FORMAT_VERSION, 'source': dict(stamp, sha256=dataset_digest(csv_path)), 'rows': len(df),
+            'columns': []}
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    # Written beside the store and renamed into place, so readers never see half of one.
+    staging = tempfile.mkdtemp(prefix='.build-', dir=os.path.dirname(path) or '.')
+    try:
+        for i, column in enumerate(df.columns):
+            array, categories = compact_column(df[column])
+            np.save(os.path.join(staging, f'{i}.npy'), array)
+            meta['columns'].append({'name': column, 'dtype': array.dtype.str, 'categories': categories})
+        with open(os.path.join(staging, 'meta.json'), 'w') as fh:
+            json.dump(meta, fh, indent=2)
+        if os.path.isdir(path):
+            shutil.rmtree(path)
+        os.rename(staging, path)
+    except BaseException:
+        shutil.rmtree(staging, ignore_errors=True)
+        raise
+    return meta
+
+
+def current_meta(csv_path, path):
+    """Return the metadata of the store at ``path`` if it matches ``csv_path``, else None."""
+    try:
+        with open(os.path.join(path, 'meta.json')) as fh:
+            meta = json.load(fh)
+    except (OSError, ValueError):
+        return None
+    if meta.get('format') != FORMAT_VERSION:
+        return None
+    stamp = source_stamp(csv_path)
+    source = meta['source']
+    if stamp == {'size': source['size'], 'mtime_ns': source['mtime_ns']}:
+        return meta
+    if stamp['size'] != source['size'] or dataset_digest(csv_path) != source['sha256']:
+        return None
+    # Same contents with a new modification time: remember it instead of rebuilding.
+    source.update(stamp)
+    with open(os.path.join(path, 'meta.json'), 'w') as fh:
+        json.dump(meta, fh, indent=2)
+    return meta
+
+
+def open_store(csv_path, directory=DEFAULT_DIR):
+    """Return ``(path, metadata, rebuilt)`` for the store of ``csv_path``, building it if needed."""
+    path = store_path(csv_path, directory)
+    meta = current_meta(csv_path, path)
+    if meta is not None:
+        return path, meta, False
+    return path, build_store(csv_path, path), True
+
+
+def read_columns(csv_path, directory=DEFAULT_DIR, mmap=True):
+    """Return ``{column: array}`` as stored (category columns as codes) and the metadata."""
+    path, meta, _ = open_store(csv_path, directory)
+    return _load_columns(path, meta, mmap), meta
+
+
+def _load_columns(path, meta, mmap=True):
+    return {column['name']: np.load(os.path.join(path, f'{i}.npy'), mmap_mode='r' if mmap else None)
+            for i, column in enumerate(meta['columns'])}
+
+
+def read_dataset(csv_path, directory=DEFAULT_DIR):
+    """
+    Return the CSV as a DataFrame read from its store.
+
+    Numeric columns keep their compact dtypes and text columns are
+    ``pandas.Categorical``. Drop-in for ``pd.read_csv(csv_path)`` in the
+    training scripts.
+    """
+    columns, meta = read_columns(csv_path, directory)
+    data = {}
+    for column in meta['columns']:
+        values = columns[column['name']]
+        if column['categories'] is None:
+            data[column['name']] = values
+        else:
+            data[column['name']] = pd.Categorical.from_codes(values, column['categories'])
+    return pd.DataFrame(data)
+
+
+def _parsed_frame(columns, meta):
+    """The stored columns in the dtypes ``pd.read_csv`` gives them."""
+    data = {}
+    for column in meta['columns']:
+        values = np.asarray(columns[column['name']])
+        if column['categories'] is not None:
+            data[column['name']] = pd.Categorical.from_codes(values, column['categories']).astype(object)
+        elif values.dtype.kind in 'iu':
+            data[column['name']] = values.astype(np.int64)
+        else:
+            data[column['name']] = values.astype(np.float64)
+    return pd.DataFrame(data)
+
+
+def appended_path(csv_path):
+    """The file listing the batches ``append_rows`` added to ``csv_path``: a SHA-256 and row count per line."""
+    return csv_path + '.appended'
+
+
+def appended_batches(csv_path):
+    """``[(sha256, rows)]`` of the batches appended to ``csv_path``, oldest first."""
+    try:
+        with open(appended_path(csv_path)) as fh:
+            return [(digest, int(rows)) for digest, rows in (line.split() for line in fh if line.strip())]
+    except FileNotFoundError:
+        return []
+
+
+def appended_row_count(csv_path):
+    """Rows at the end of ``csv_path`` that ``append_rows`` added."""
+    return sum(rows for _, rows in appended_batches(csv_path))
+
+
+def _replace(path, write):
+    """Write ``path`` anew with ``write(fh)`` beside it and rename it into place."""
+    fd, temp_path = tempfile.mkstemp(prefix='.append-', dir=os.path.dirname(os.path.abspath(path)))
+    try:
+        with os.fdopen(fd, 'wb') as fh:
+            write(fh)
+            fh.flush()
+            os.fsync(fh.fileno())
+        if os.path.exists(path):
+            shutil.copymode(path, temp_path)
+        os.replace(temp_path, path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+
+def _ends_with(path, data):
+    with open(path, 'rb') as fh:
+        fh.seek(0, os.SEEK_END)
+        if fh.tell() < len(data):
+            return False
+        fh.seek(-len(data), os.SEEK_END)
+        return fh.read() == data
+
+
+def append_rows(csv_path, rows, directory=DEFAULT_DIR):
+    """
+    Append the DataFrame ``rows`` to ``csv_path`` and its store; returns the number of rows appended.
+
+    ``rows`` must have the CSV's columns. The rows are written to the CSV
+    as text and parsed back, so the store ends up exactly as a full
+    rebuild would leave it. A batch that was appended before (same
+    contents) is skipped and 0 returned, so a failed update can be rerun.
+
+    The CSV is rewritten beside itself and renamed into place, then the
+    batch is recorded. A run stopped in between left the batch as the
+    CSV's last rows; the rerun finds it there and only records it.
+    """
+    path, meta, _ = open_store(csv_path, directory)
+    names = [column['name'] for column in meta['columns']]
+    missing = set(names) - set(rows.columns)
+    if missing:
+        raise ValueError(f"New rows lack the dataset's columns: {', '.join(sorted(missing))}")
+    if rows.empty:
+        return 0
+    text = rows[names].to_csv(index=False, header=False).encode()
+    batch = hashlib.sha256(text).hexdigest()
+    appended = appended_batches(csv_path)
+    if batch in [digest for digest, _ in appended]:
+        return 0
+
+    def record(fh):
+        fh.write(''.join(f'{digest} {count}\n' for digest, count in appended + [(batch, len(rows))]).encode())
+
+    if _ends_with(csv_path, text):
+        _replace(appended_path(csv_path), record)
+        return 0
+    separator = b'' if _ends_with(csv_path, b'\n') else b'\n'
+
+    def write(fh):
+        with open(csv_path, 'rb') as source:
+            shutil.copyfileobj(source, fh)
+        fh.write(separator + text)
+
+    _replace(csv_path, write)
+    _replace(appended_path(csv_path), record)
+
+    new = pd.read_csv(io.StringIO(','.join(names) + '\n' + text.decode()))
+    # The CSV no longer matches the store, so read the columns straight from it.
+    columns = _load_columns(path, meta, mmap=False)
+    df = pd.concat([_parsed_frame(columns, meta), new], ignore_index=True)
+    build_store(csv_path, path, df=df)
+    return len(new)
@@ -0,0 +1,165 @@
+"""
+One experiment run shared by the training and evaluation scripts.
+
+``run_experiments`` fits every model configuration once on the training
+split and once per cross-validation fold. Everything the scripts report
+(accuracy, weighted precision/recall/F1, the per-crop report, confusion
+matrices, CV scores and feature importances) is computed from those
+predictions and fitted models instead of refitting per metric. Fits go
+through ``fit_and_evaluate``: the CV folds run on a process pool and the
+training cache, which both scripts share, keys them identically since
+both prepare the data with ``split_dataset``, so a run of one script
+after the other refits nothing.
+
+``build_report`` turns the results into the JSON document written to
+``experiment_report.json``. This module must not import Django.
+"""
+
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+from sklearn.linear_model import LogisticRegression
+from sklearn.metrics import (accuracy_score, classification_report, confusion_matrix, f1_score, precision_score,
+                             recall_score)
+from sklearn.model_selection import StratifiedKFold, train_test_split
+from sklearn.naive_bayes import GaussianNB
+from sklearn.svm import SVC
+from sklearn.tree import DecisionTreeClassifier
+
+from .model_search import RANDOM_STATE, forest
+from .training_cache import fit_and_evaluate, submit
+
+CV_FOLDS = 5
+TEST_SIZE = 0.2
+# The production forest's parameters unless ``train_model.py --search`` picks others.
+DEFAULT_FOREST_PARAMS = {'n_estimators': 100}
+REPORT_PATH = 'experiment_report.json'
+
+
+def experiment_models(forest_params=None):
+    """The configurations compared by both scripts; seeded, so every fit is reproducible."""
+    return {
+        'Random Forest': forest(forest_params or DEFAULT_FOREST_PARAMS),
+        'SVM': SVC(kernel='rbf', random_state=RANDOM_STATE),
+        'Logistic Regression': LogisticRegression(random_state=RANDOM_STATE, max_iter=1000),
+        'Decision Tree': DecisionTreeClassifier(random_state=RANDOM_STATE),
+        'Naive Bayes': GaussianNB(),
+    }
+
+
+def split_dataset(X, y):
+    """The stratified 80/20 train/test split both scripts use."""
+    return train_test_split(X, y, test_size=TEST_SIZE, random_state=RANDOM_STATE, stratify=y)
+
+
+def classification_metrics(y_true, y_pred):
+    """Every test-set metric the scripts report, from one set of predictions."""
+    labels = np.unique(np.concatenate([np.asarray(y_true, dtype=object), np.asarray(y_pred, dtype=object)]))
+    return {
+        'accuracy': accuracy_score(y_true, y_pred),
+        'precision': precision_score(y_true, y_pred, average='weighted', zero_division=0),
+        'recall': recall_score(y_true, y_pred, average='weighted', zero_division=0),
+        'f1_score': f1_score(y_true, y_pred, average='weighted', zero_division=0),
+        'labels': labels.tolist(),
+        'confusion_matrix': confusion_matrix(y_true, y_pred, labels=labels),
+        'per_class': classification_report(y_true, y_pred, zero_division=0, output_dict=True),
+    }
+
+
+def run_experiments(X_train, X_test, y_train, y_test, models, cv=CV_FOLDS, jobs=1, cache=None, log=print):
+    """
+    Fit every model in ``models`` on the training split and on each of ``cv`` folds of it.
+
+    The folds are those ``cross_val_score(cv=5)`` uses. They run on a pool
+    of ``jobs`` processes (-1: one per core); the models kept for saving
+    and feature importances are fitted here, because one sent back from a
+    worker pickles to different (equivalent) bytes. Returns
+    ``{name: result}`` where a result holds the fitted ``model``, its test
+    ``predictions`` and ``metrics``, ``accuracy``, ``cv_scores``,
+    ``cv_mean``, ``cv_std``, ``feature_importances`` (or None) and the
+    number of fits ``reused`` from ``cache``.
+    """
+    X_train, X_test = np.asarray(X_train), np.asarray(X_test)
+    y_train, y_test = np.asarray(y_train, dtype=object), np.asarray(y_test, dtype=object)
+    folds = list(StratifiedKFold(n_splits=cv).split(X_train, y_train))
+    workers = os.cpu_count() if jobs < 1 else jobs
+
+    log(f"\nFitting {len(models)} models on the training split and {cv} cross-validation folds "
+        f"on {workers} process(es)...")
+    started = time.perf_counter()
+    results = {}
+    pool = ProcessPoolExecutor(max_workers=workers) if workers > 1 else None
+    try:
+        cv_runs = {
+            name: [submit(pool, fit_and_evaluate, model, X_train[fit_rows], y_train[fit_rows],
+                          X_train[eval_rows], y_train[eval_rows], keep_model=False, cache=cache)
+                   for fit_rows, eval_rows in folds]
+            for name, model in models.items()
+        }
+        for name, model in models.items():
+            fit = fit_and_evaluate(model, X_train, y_train, X_test, y_test, cache=cache)
+            cv_results = [run.result() for run in cv_runs[name]]
+            cv_scores = np.array([result['accuracy'] for result in cv_results])
+            metrics = classification_metrics(y_test, fit['predictions'])
+            results[name] = {
+                'model': fit['model'],
+                'predictions': fit['predictions'],
+                'metrics': metrics,
+                'accuracy': metrics['accuracy'],
+                'cv_scores': cv_scores,
+                'cv_mean': cv_scores.mean(),
+                'cv_std': cv_scores.std(),
+                'feature_importances': getattr(fit['model'], 'feature_importances_', None),
+                'reused': fit['cached'] + sum(result['cached'] for result in cv_results),
+            }
+    finally:
+        if pool is not None:
+            pool.shutdown()
+    reused = sum(result['reused'] for result in results.values())
+    log(f"Fitted in {time.perf_counter() - started:.1f}s"
+        f"{f' ({reused} of {len(models) * (cv + 1)} fits reused from the cache)' if cache is not None else ''}")
+    return results
+
+
+def _jsonable(value):
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    if isinstance(value, np.generic):
+        return value.item()
+    if isinstance(value, dict):
+        return {str(key): _jsonable(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_jsonable(item) for item in value]
+    if value is None or isinstance(value, (bool, int, float, str)):
+        return value
+    return repr(value)
+
+
+def build_report(results, feature_names, dataset=None, n_train=None, n_test=None, cv=CV_FOLDS):
+    """The machine-readable summary of a ``run_experiments`` result."""
+    models = {}
+    for name, result in results.items():
+        importances = result['feature_importances']
+        models[name] = {
+            'estimator': type(result['model']).__name__,
+            'params': result['model'].get_params(),
+            'test': result['metrics'],
+            'cv': {'scores': result['cv_scores'], 'mean': result['cv_mean'], 'std': result['cv_std']},
+            'feature_importances': None if importances is None else dict(zip(feature_names, importances)),
+        }
+    return _jsonable({
+        'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'dataset': dataset,
+        'features': list(feature_names),
+        'split': {'train': n_train, 'test': n_test, 'test_size': TEST_SIZE, 'cv_folds': cv,
+                  'random_state': RANDOM_STATE},
+        'models': models,
+    })
+
+
+def write_report(report, path=REPORT_PATH):
+    with open(path, 'w') as fh:
+        json.dump(report, fh, indent=2)
@@ -0,0 +1,330 @@
+"""
+Flat-array RandomForest inference.
+
+``train_model.py`` exports the fitted forest as a handful of contiguous
+NumPy arrays: split feature, threshold and child pointers for every
+internal node of every tree, and the class distribution of every leaf.
+``FlatForest`` walks those arrays for all trees at once, avoiding
+sklearn's per-call input validation, joblib dispatch and the hundred
+per-estimator Python calls, while returning exactly the same
+probabilities and labels.
+
+The export can also fold a fitted ``StandardScaler`` into the split
+thresholds (``fold_scaler``). Tree splits only compare one feature with
+a constant, and standardisation is monotonic per feature, so every
+threshold can be moved into raw feature units and the serving path can
+skip ``scaler.transform`` altogether.
+
+Child pointers are internal node ids when >= 0 and ``~leaf_id`` for
+leaves, so traversal stops for a (row, tree) pair as soon as it reaches
+a leaf.
+
+For a compact artifact, ``from_sklearn(forest, purity=...)`` collapses
+subtrees whose leaves all vote for the same crop, or whose samples are
+already nearly pure, into single leaves, and ``quantize`` stores
+thresholds as float32 and leaf distributions as small integers. Both
+change the probabilities slightly, so ``train_model.py --compact`` checks
+the result against an accuracy budget on the held-out split.
+
+An export records the ``forest_fingerprint`` of the forest it came from,
+so a loader can tell whether it still belongs to the model next to it.
+
+This module must not import Django: the training scripts use it too.
+"""
+
+import hashlib
+import struct
+import zipfile
+
+import numpy as np
+
+# Rows traversed together; bounds the temporary (rows x trees) arrays.
+CHUNK_SIZE = 4096
+_SIGN_BIT = np.uint64(1) << np.uint64(63)
+# Rows whose (trees x classes) leaf distributions are gathered at once.
+SUM_CHUNK_SIZE = 256
+
+
+class FlatForest:
+    """A RandomForestClassifier flattened into contiguous arrays."""
+
+    _ARRAYS = ('feature', 'threshold', 'children', 'value', 'roots', 'classes', 'folded', 'value_scale', 'fingerprint')
+
+    def __init__(self, feature, threshold, children, value, roots, classes, folded=False, value_scale=1,
+                 fingerprint=None):
+        self.feature = feature
+        self.threshold = threshold
+        # Interleaved (left, right) pairs so each step is a single gather.
+        self.children = children
+        self.value = value
+        self.roots = roots
+        self.classes_ = classes
+        # Folded thresholds are exact for float64 inputs; unfolded ones follow
+        # sklearn, which compares float32 inputs against float64 thresholds.
+        # Quantized thresholds are float32 and compare float32 inputs.
+        self.folded = bool(folded)
+        self.input_dtype = np.float64 if self.folded and threshold.dtype == np.float64 else np.float32
+        # Every leaf distribution sums to this (1 unless quantized).
+        self.value_scale = int(value_scale)
+        # ``forest_fingerprint`` of the sklearn forest this was exported from (None for older files).
+        self.fingerprint = None if fingerprint is None else str(fingerprint)
+
+    @property
+    def n_estimators(self):
+        return len(self.roots)
+
+    @property
+    def n_classes(self):
+        return self.value.shape[1]
+
+    @property
+    def nbytes(self):
+        return sum(a.nbytes for a in (self.feature, self.threshold, self.children, self.value, self.roots, self.classes_))
+
+    @classmethod
+    def from_sklearn(cls, forest, purity=None):
+        """
+        Flatten a fitted single-output ``RandomForestClassifier``.
+
+        With ``purity``, subtrees whose leaves all vote for one class, or whose
+        node already has at least this fraction of one class, become leaves
+        holding that node's class distribution.
+        """
+        features, thresholds, children, values, roots = [], [], [], [], []
+        n_internal = n_leaves = 0
+        n_classes = len(forest.classes_)
+        for estimator in forest.estimators_:
+            tree = estimator.tree_
+            is_leaf = tree.children_left == -1
+            if purity is not None:
+                is_leaf = _collapsible(tree, n_classes, purity)
+            keep = _reachable(tree, is_leaf)
+            internal = np.flatnonzero(keep & ~is_leaf)
+            leaves = np.flatnonzero(keep & is_leaf)
+            # Map every kept sklearn node id to its flat pointer.
+            pointer = np.zeros(tree.node_count, dtype=np.int64)
+            pointer[internal] = np.arange(len(internal)) + n_internal
+            pointer[leaves] = ~(np.arange(len(leaves)) + n_leaves)
+            roots.append(pointer[0])
+            features.append(tree.feature[internal])
+            thresholds.append(tree.threshold[internal])
+            children.append(np.stack([pointer[tree.children_left[internal]],
+                                      pointer[tree.children_right[internal]]], axis=1))
+            value = tree.value[leaves, 0, :n_classes]
+            totals = value.sum(axis=1, keepdims=True)
+            if not np.allclose(totals, 1.0):
+                # Older sklearn versions store class counts rather than fractions.
+                value = value / np.where(totals == 0, 1.0, totals)
+            values.append(value)
+            n_internal += len(internal)
+            n_leaves += len(leaves)
+        return cls(
+            feature=np.concatenate(features).astype(np.int32),
+            threshold=np.concatenate(thresholds).astype(np.float64),
+            children=np.concatenate(children).ravel().astype(np.int32),
+            value=np.ascontiguousarray(np.concatenate(values), dtype=np.float64),
+            roots=np.asarray(roots, dtype=np.int32),
+            classes=np.asarray(forest.classes_).astype(str),
+            fingerprint=forest_fingerprint(forest),
+        )
+
+    def fold_scaler(self, scaler):
+        """
+        Return a copy whose thresholds are in raw feature units.
+
+        ``fold_scaler(scaler).predict_proba(X)`` is bit-identical to
+        ``predict_proba(scaler.transform(X))`` for every float64 ``X``: for each
+        split we binary-search the largest float64 ``x`` that the original
+        pipeline (float64 standardisation, then float32 cast) sends left.
+        """
+        if self.folded:
+            raise ValueError('Scaler is already folded into this forest')
+        mean = np.zeros(len(scaler.scale_)) if scaler.mean_ is None else scaler.mean_
+        mean, scale = mean[self.feature], scaler.scale_[self.feature]
+
+        def goes_left(x):
+            with np.errstate(over='ignore'):
+                return ((x - mean) / scale).astype(np.float32) <= self.threshold
+
+        big = np.finfo(np.float64).max
+        low = _float_keys(np.full(len(self.threshold), -big))
+        high = _float_keys(np.full(len(self.threshold), big))
+        # Invariant: low goes left, high goes right.
+        while True:
+            open_ = high - low > 1
+            if not open_.any():
+                break
+            middle = low + (high - low) // np.uint64(2)
+            left = goes_left(_float_values(middle))
+            low = np.where(open_ & left, middle, low)
+            high = np.where(open_ & ~left, middle, high)
+        return FlatForest(self.feature, _float_values(low), self.children, self.value,
+                          self.roots, self.classes_, folded=True, value_scale=self.value_scale,
+                          fingerprint=self.fingerprint)
+
+    def quantize(self, levels=255):
+        """
+        Return a compact copy: uint8 feature ids, float32 thresholds and leaf
+        distributions stored as integers summing to ``levels``.
+
+        Thresholds are rounded down, so a float32 input goes the same way as
+        against the float64 threshold.
+        """
+        if self.value_scale != 1:
+            raise ValueError('This forest is already quantized')
+        threshold = self.threshold.astype(np.float32)
+        threshold = np.where(threshold > self.threshold, np.nextafter(threshold, np.float32(-np.inf)), threshold)
+        # Largest-remainder rounding keeps every leaf summing to exactly ``levels``.
+        scaled = self.value * levels
+        counts = np.floor(scaled)
+        short = np.round(levels - counts.sum(axis=1, keepdims=True))
+        order = np.argsort(counts - scaled, axis=1, kind='stable')
+        rank = np.empty_like(order)
+        np.put_along_axis(rank, order, np.arange(self.n_classes)[np.newaxis], axis=1)
+        counts += rank < short
+        return FlatForest(self.feature.astype(np.uint8), threshold.astype(np.float32), self.children,
+                          counts.astype(np.uint8 if levels <= 255 else np.uint16), self.roots,
+                          self.classes_, folded=self.folded, value_scale=levels, fingerprint=self.fingerprint)
+
+    def save(self, path):
+        """Write the arrays to an uncompressed ``.npz`` file."""
+        extra = {} if self.fingerprint is None else {'fingerprint': self.fingerprint}
+        np.savez(path, feature=self.feature, threshold=self.threshold, children=self.children,
+                 value=self.value, roots=self.roots, classes=self.classes_, folded=self.folded,
+                 value_scale=self.value_scale, **extra)
+
+    @classmethod
+    def load(cls, path, mmap=False):
+        """
+        Read a forest written by ``save``.
+
+        With ``mmap`` the arrays are memory-mapped read-only straight from the
+        file, so every process serving the same file shares one copy of the
+        pages through the OS page cache.
+        """
+        if mmap:
+            return cls(**_mmap_npz(path, cls._ARRAYS))
+        with np.load(path, allow_pickle=False) as data:
+            return cls(**{name: data[name] for name in cls._ARRAYS if name in data.files})
+
+    def apply(self, X):
+        """Return the leaf id reached in every tree, shape (n_samples, n_estimators)."""
+        X = np.asarray(X, dtype=self.input_dtype)
+        if X.ndim == 1:
+            X = X.reshape(1, -1)
+        leaves = np.empty((X.shape[0], self.n_estimators), dtype=np.int32)
+        for start in range(0, X.shape[0], CHUNK_SIZE):
+            chunk = np.ascontiguousarray(X[start:start + CHUNK_SIZE])
+            self._apply_chunk(chunk, leaves[start:start + CHUNK_SIZE].reshape(-1))
+        return leaves
+
+    def _apply_chunk(self, chunk, out):
+        n_rows, n_features = chunk.shape
+        values = chunk.ravel()
+        nodes = np.tile(self.roots, n_rows)
+        row_offset = np.repeat(np.arange(n_rows, dtype=np.int32) * n_features, self.n_estimators)
+        position = np.arange(nodes.size)
+        while nodes.size:
+            done = nodes < 0
+            if done.any():
+                out[position[done]] = ~nodes[done]
+                active = ~done
+                nodes, position, row_offset = nodes[active], position[active], row_offset[active]
+                if not nodes.size:
+                    break
+            go_left = values[row_offset + self.feature[nodes]] <= self.threshold[nodes]
+            nodes = self.children[2 * nodes + 1 - go_left]
+
+    def predict_proba(self, X):
+        leaves = self.apply(X)
+        proba = np.empty((leaves.shape[0], self.n_classes), dtype=np.float64)
+        # Reducing over the (non-contiguous) tree axis adds the trees one after
+        # another, in the same order as sklearn, so the sums are bit-identical.
+        for start in range(0, leaves.shape[0], SUM_CHUNK_SIZE):
+            stop = start + SUM_CHUNK_SIZE
+            np.sum(self.value[leaves[start:stop]], axis=1, out=proba[start:stop])
+        proba /= self.n_estimators * self.value_scale
+        return proba
+
+    def predict(self, X):
+        return self.classes_.take(np.argmax(self.predict_proba(X), axis=1))
+
+
+def forest_fingerprint(forest):
+    """SHA-256 of the splits and leaf values of a fitted forest's trees."""
+    digest = hashlib.sha256()
+    for estimator in forest.estimators_:
+        tree = estimator.tree_
+        for array in (tree.feature, tree.threshold, tree.children_left, tree.children_right, tree.value):
+            digest.update(np.ascontiguousarray(array).tobytes())
+    return digest.hexdigest()
+
+
+def _collapsible(tree, n_classes, purity):
+    """Leaves of ``tree`` once prunable subtrees are collapsed (``from_sklearn``)."""
+    left, right = tree.children_left, tree.children_right
+    value = tree.value[:, 0, :n_classes]
+    is_leaf = left == -1
+    # The class every leaf below a node votes for, or -1; children always
+    # have larger ids than their parent, so one backwards pass suffices.
+    agreed = np.where(is_leaf, value.argmax(axis=1), -1)
+    for node in np.flatnonzero(~is_leaf)[::-1]:
+        if agreed[left[node]] == agreed[right[node]]:
+            agreed[node] = agreed[left[node]]
+    return is_leaf | (agreed >= 0) | (value.max(axis=1) >= purity * value.sum(axis=1))
+
+
+def _reachable(tree, is_leaf):
+    """Nodes of ``tree`` still reachable from the root when ``is_leaf`` nodes stop the descent."""
+    keep = np.zeros(tree.node_count, dtype=bool)
+    keep[0] = True
+    for node in range(tree.node_count):
+        if keep[node] and not is_leaf[node]:
+            keep[tree.children_left[node]] = keep[tree.children_right[node]] = True
+    return keep
+
+
+def _mmap_npz(path, names):
+    """
+    Memory-map the arrays of an uncompressed ``.npz`` file.
+
+    ``np.load`` ignores ``mmap_mode`` for archives, but ``np.savez`` stores
+    its members uncompressed, so each one is a plain ``.npy`` at a fixed
+    offset in the file. Scalars are small and simply read.
+    """
+    arrays = {}
+    with zipfile.ZipFile(path) as archive, open(path, 'rb') as fh:
+        for name in names:
+            try:
+                info = archive.getinfo(f'{name}.npy')
+            except KeyError:
+                continue
+            if info.compress_type != zipfile.ZIP_STORED:
+                raise ValueError(f'{path} is compressed and cannot be memory-mapped')
+            # The local file header is 30 bytes plus the name and extra field.
+            fh.seek(info.header_offset + 26)
+            name_length, extra_length = struct.unpack('<HH', fh.read(4))
+            fh.seek(info.header_offset + 30 + name_length + extra_length)
+            if np.lib.format.read_magic(fh) == (1, 0):
+                shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(fh)
+            else:
+                shape, fortran_order, dtype = np.lib.format.read_array_header_2_0(fh)
+            if not shape:
+                arrays[name] = np.frombuffer(fh.read(dtype.itemsize), dtype=dtype).reshape(())
+            else:
+                mapped = np.memmap(path, dtype=dtype, mode='r', offset=fh.tell(), shape=shape,
+                                   order='F' if fortran_order else 'C')
+                # Plain ndarray views index much faster than np.memmap and keep the map open.
+                arrays[name] = mapped.view(np.ndarray)
+    return arrays
+
+
+def _float_keys(x):
+    """Map float64 values to uint64 keys with the same ordering."""
+    bits = np.asarray(x, dtype=np.float64).view(np.uint64)
+    return np.where(bits & _SIGN_BIT, ~bits, bits | _SIGN_BIT)
+
+
+def _float_values(keys):
+    """Inverse of ``_float_keys``."""
+    return np.where(keys & _SIGN_BIT, keys & ~_SIGN_BIT, ~keys).view(np.float64)
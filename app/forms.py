@@ -1,4 +1,3 @@
-from sre_constants import CATEGORY
 from django import forms
 from django.contrib.auth.models import User
 from .models import *
@@ -132,3 +131,4 @@ class FindCropForm(forms.Form):
     humidity = forms.FloatField(widget=forms.TextInput(attrs={'class':'form-control','placeholder':'Enter Humidity'}), required=True)
     ph = forms.FloatField(widget=forms.TextInput(attrs={'class':'form-control','placeholder':'Enter pH value'}), required=True)
     rainfall = forms.FloatField(widget=forms.TextInput(attrs={'class':'form-control','placeholder':'Enter Rainfall (in cm)'}), required=True)
+    top_k = forms.IntegerField(widget=forms.TextInput(attrs={'class':'form-control','placeholder':'Number of crops to show (optional)'}), required=False, min_value=1, label='Top crops')
@@ -0,0 +1,122 @@
+"""
+Incremental updates of the production Random Forest.
+
+A forest's trees are independent, so it can be changed a few trees at a
+time instead of retraining all of them:
+
+- ``grow`` adds trees fitted on the most recent training rows (the CSV
+  is append-only, so the last rows are the newest), dropping the oldest
+  trees beyond ``max_trees``;
+- ``refresh`` replaces the oldest (stalest) trees with new ones fitted
+  on the whole training split.
+
+The new trees are fitted as a small forest with the production forest's
+parameters and spliced into a copy of it; the production scaler is kept,
+so the flat export and the served inputs don't change meaning. Both need
+every crop in the rows the new trees are fitted on: a crop the model has
+never seen calls for a full ``train_model.py`` run.
+
+``validation_gate`` compares the candidate with the production model on
+held-out rows. ``update_model.py`` uses ``train_model.py``'s split of
+the dataset without the rows it appended, which only ever join the
+training rows, so neither the new trees nor a model ``train_model.py``
+fitted before the appends has seen the held-out rows. A model retrained
+after rows were appended was split differently, and the gate then
+favours it.
+This module must not import Django.
+"""
+
+import copy
+import hashlib
+
+import numpy as np
+from sklearn.base import clone
+from sklearn.metrics import accuracy_score
+
+from .flat_forest import forest_fingerprint
+
+MODES = ('grow', 'refresh')
+
+
+class IncrementalUpdateError(ValueError):
+    """The forest cannot be updated incrementally from the given rows."""
+
+
+def recent_rows(y, window, min_per_class=5):
+    """
+    Positions of the last ``window`` rows, topped up so every class has ``min_per_class`` rows.
+
+    Classes that are rare or absent in the window get their most recent
+    earlier rows added, so the new trees still cover every crop.
+    """
+    y = np.asarray(y, dtype=object)
+    start = max(0, len(y) - window)
+    chosen = list(range(start, len(y)))
+    for label in np.unique(y):
+        have = int((y[start:] == label).sum())
+        if have < min_per_class:
+            earlier = np.flatnonzero(y[:start] == label)
+            chosen.extend(earlier[len(earlier) - (min_per_class - have):].tolist())
+    return np.sort(np.array(chosen, dtype=np.int64))
+
+
+def fit_trees(model, X, y, n_trees, random_state, n_jobs=None):
+    """Fit ``n_trees`` new trees with ``model``'s parameters; returns them as a forest."""
+    labels = set(map(str, np.unique(np.asarray(y, dtype=object))))
+    known = set(map(str, model.classes_))
+    missing, extra = known - labels, labels - known
+    if extra:
+        raise IncrementalUpdateError(f"Crops the model has never seen: {', '.join(sorted(extra))}; "
+                                     "retrain with train_model.py")
+    if missing:
+        raise IncrementalUpdateError(f"No rows for: {', '.join(sorted(missing))}")
+    trees = clone(model).set_params(n_estimators=n_trees, random_state=random_state, warm_start=False)
+    if n_jobs is not None:
+        trees.set_params(n_jobs=n_jobs)
+    return trees.fit(X, y)
+
+
+def splice(model, trees, drop_oldest):
+    """A copy of ``model`` without its ``drop_oldest`` first trees and with ``trees``' appended."""
+    updated = copy.deepcopy(model)
+    updated.estimators_ = list(model.estimators_[drop_oldest:]) + list(trees.estimators_)
+    updated.n_estimators = len(updated.estimators_)
+    return updated
+
+
+def update_forest(model, X_train, y_train, mode='grow', n_trees=20, window=500, max_trees=None, seed=None,
+                  n_jobs=None):
+    """
+    Return an updated copy of the fitted forest ``model`` (see the module docstring).
+
+    ``seed`` defaults to one derived from ``model``'s trees and the number
+    of rows, so an update is reproducible, while repeating it on the
+    updated model (even on the same rows) fits different trees.
+    """
+    if mode not in MODES:
+        raise ValueError(f'mode must be one of: {", ".join(MODES)}')
+    if seed is None:
+        digest = hashlib.sha256(f'{forest_fingerprint(model)}:{len(y_train)}'.encode()).digest()
+        seed = int.from_bytes(digest[:4], 'little')
+    y_train = np.asarray(y_train, dtype=object)
+    if mode == 'grow':
+        rows = recent_rows(y_train, window)
+        trees = fit_trees(model, X_train[rows], y_train[rows], n_trees, seed, n_jobs)
+        total = len(model.estimators_) + n_trees
+        drop = max(0, total - max_trees) if max_trees else 0
+    else:
+        trees = fit_trees(model, X_train, y_train, n_trees, seed, n_jobs)
+        drop = min(n_trees, len(model.estimators_))
+    return splice(model, trees, drop)
+
+
+def validation_gate(current, candidate, X_holdout, y_holdout, max_accuracy_loss=0.0):
+    """
+    Compare both models on the held-out rows; returns ``(passed, current accuracy, candidate accuracy)``.
+
+    The candidate passes when it is at most ``max_accuracy_loss`` less accurate.
+    """
+    y_holdout = np.asarray(y_holdout, dtype=object)
+    current_accuracy = accuracy_score(y_holdout, current.predict(X_holdout))
+    candidate_accuracy = accuracy_score(y_holdout, candidate.predict(X_holdout))
+    return candidate_accuracy >= current_accuracy - max_accuracy_loss, current_accuracy, candidate_accuracy
@@ -0,0 +1,199 @@
+"""
+Per-stage latency histograms for the prediction views.
+
+Views wrapped in ``timed_view`` get a ``RequestTimer`` in a context
+variable for the duration of the request, and code along the prediction
+path marks its stages with ``with stage('scale'):``. Durations go into
+fixed-bucket histograms kept per worker process, which admins can read
+at ``/api/latency/``; with ``ML_LATENCY_SERVER_TIMING`` each response
+also carries a ``Server-Timing`` header.
+
+With ``ML_LATENCY_ENABLED`` off no timer is created and ``stage`` returns
+a shared no-op context manager, so the hooks cost one context variable
+lookup each.
+"""
+
+import asyncio
+import bisect
+import contextlib
+import contextvars
+import functools
+import os
+import threading
+import time
+
+from django.conf import settings
+
+# Upper bounds of the histogram buckets in milliseconds; one more bucket holds the rest.
+BUCKETS_MS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 25, 50, 100, 250, 500, 1000, 2500)
+
+_NOOP = contextlib.nullcontext()
+_current = contextvars.ContextVar('latency_timer', default=None)
+
+
+class Histogram:
+    """Counts of durations per bucket, plus their count, sum and maximum."""
+
+    def __init__(self, bounds=BUCKETS_MS):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, ms):
+        self.counts[bisect.bisect_left(self.bounds, ms)] += 1
+        self.count += 1
+        self.total += ms
+        self.max = max(self.max, ms)
+
+    def quantile(self, q):
+        """Upper bound of the bucket holding the ``q`` quantile (the maximum for the last bucket)."""
+        if not self.count:
+            return None
+        rank = q * self.count
+        seen = 0
+        for bound, count in zip(self.bounds, self.counts):
+            seen += count
+            if seen >= rank:
+                return min(bound, self.max)
+        return self.max
+
+    def as_dict(self):
+        return {
+            'count': self.count,
+            'mean_ms': self.total / self.count if self.count else None,
+            'max_ms': self.max,
+            'p50_ms': self.quantile(0.5),
+            'p90_ms': self.quantile(0.9),
+            'p99_ms': self.quantile(0.99),
+            'buckets': [[bound, count] for bound, count in zip(self.bounds + (None,), self.counts)],
+        }
+
+
+class LatencyRecorder:
+    """Thread-safe set of histograms, one per stage."""
+
+    def __init__(self):
+        self._histograms = {}
+        self._lock = threading.Lock()
+
+    def record(self, durations):
+        with self._lock:
+            for name, ms in durations:
+                histogram = self._histograms.get(name)
+                if histogram is None:
+                    histogram = self._histograms[name] = Histogram()
+                histogram.add(ms)
+
+    def stats(self):
+        with self._lock:
+            return {name: histogram.as_dict() for name, histogram in self._histograms.items()}
+
+    def clear(self):
+        with self._lock:
+            self._histograms.clear()
+
+
+recorder = LatencyRecorder()
+
+
+class RequestTimer:
+    """Stage durations of one request, in the order the stages finished."""
+
+    __slots__ = ('durations',)
+
+    def __init__(self):
+        self.durations = []
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.durations.append((name, (time.perf_counter() - started) * 1000))
+
+    def server_timing(self):
+        return ', '.join(f'{name};dur={ms:.3f}' for name, ms in self.durations)
+
+
+def stage(name):
+    """Time the enclosed block as ``name`` when the current request is being timed."""
+    timer = _current.get()
+    if timer is None:
+        return _NOOP
+    return timer.stage(name)
+
+
+def collect_stages(func, *args):
+    """
+    Run ``func(*args)`` with a timer of its own; returns ``(result, durations)``.
+
+    For work done outside the request's context, e.g. on the coalescer's
+    thread; the caller passes the durations to ``add_stages``.
+    """
+    if not settings.ML_LATENCY_ENABLED:
+        return func(*args), ()
+    timer = RequestTimer()
+
+    def run():
+        _current.set(timer)
+        return func(*args)
+
+    return contextvars.copy_context().run(run), tuple(timer.durations)
+
+
+def add_stages(durations):
+    """Record ``durations`` from ``collect_stages`` as stages of the current request."""
+    timer = _current.get()
+    if timer is not None:
+        timer.durations.extend(durations)
+
+
+def _finish(timer, response):
+    recorder.record(timer.durations)
+    if settings.ML_LATENCY_SERVER_TIMING:
+        response['Server-Timing'] = timer.server_timing()
+    return response
+
+
+def timed_view(view):
+    """Time a (sync or async) view as the ``total`` stage, with its inner stages, when enabled."""
+    if asyncio.iscoroutinefunction(view):
+        @functools.wraps(view)
+        async def wrapper(request, *args, **kwargs):
+            if not settings.ML_LATENCY_ENABLED:
+                return await view(request, *args, **kwargs)
+            timer = RequestTimer()
+            token = _current.set(timer)
+            try:
+                with timer.stage('total'):
+                    response = await view(request, *args, **kwargs)
+            finally:
+                _current.reset(token)
+            return _finish(timer, response)
+    else:
+        @functools.wraps(view)
+        def wrapper(request, *args, **kwargs):
+            if not settings.ML_LATENCY_ENABLED:
+                return view(request, *args, **kwargs)
+            timer = RequestTimer()
+            token = _current.set(timer)
+            try:
+                with timer.stage('total'):
+                    response = view(request, *args, **kwargs)
+            finally:
+                _current.reset(token)
+            return _finish(timer, response)
+    return wrapper
+
+
+def latency_stats():
+    """Histograms recorded by this worker process."""
+    return {
+        'enabled': settings.ML_LATENCY_ENABLED,
+        'pid': os.getpid(),
+        'buckets_ms': list(BUCKETS_MS),
+        'stages': recorder.stats(),
+    }
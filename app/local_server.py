@@ -0,0 +1,37 @@
+"""
+Start gunicorn on a free local port for the measurement commands.
+"""
+
+import socket
+import subprocess
+import sys
+import time
+
+from django.conf import settings
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def start_gunicorn(port, workers, extra_args=(), env=None):
+    """Start ``project2.wsgi`` under gunicorn on 127.0.0.1:``port`` and return the master process."""
+    command = [sys.executable, '-m', 'gunicorn', '--workers', str(workers), '--bind', f'127.0.0.1:{port}',
+               '--log-level', 'warning', *extra_args, 'project2.wsgi:application']
+    return subprocess.Popen(command, cwd=settings.BASE_DIR, env=env)
+
+
+def wait_until_listening(process, port, timeout=120):
+    """Wait until something accepts connections on ``port``; raises RuntimeError if ``process`` dies first."""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f'gunicorn exited with status {process.returncode}')
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=1).close()
+            return
+        except OSError:
+            time.sleep(0.2)
+    raise RuntimeError(f'gunicorn did not listen on port {port} within {timeout}s')
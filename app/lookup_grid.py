@@ -0,0 +1,177 @@
+"""
+Precomputed decision grid for constant-time crop predictions.
+
+The valid input space is the box given by ``VALIDATION_RANGES``. The
+``build_lookup_grid`` management command splits every feature into a
+configurable number of bins, predicts the centre of each cell once and
+stores the label and top-class probability as a memory-mapped uint8
+array. A cell is flagged ambiguous (and answered by the real model)
+when its top-class probability is low or any neighbouring cell along an
+axis predicts a different crop, i.e. when it may straddle a decision
+boundary.
+
+With ``ML_LOOKUP_GRID_ENABLED`` the visitor page answers through
+``predict_label``, which only uses a grid built for the model version
+currently being served.
+"""
+
+import json
+import logging
+import os
+
+import numpy as np
+from django.conf import settings
+
+from .model_registry import get_model_bundle
+from .prediction import FEATURES, VALIDATION_RANGES, predict_matrix, predict_sample
+
+logger = logging.getLogger(__name__)
+
+AMBIGUOUS = 255
+_LOWER = np.array([VALIDATION_RANGES[f][0] for f in FEATURES], dtype=np.float64)
+_UPPER = np.array([VALIDATION_RANGES[f][1] for f in FEATURES], dtype=np.float64)
+
+
+def build_grid(bundle, bins, min_confidence=0.6, chunk_size=65536):
+    """
+    Evaluate ``bundle`` at every cell centre.
+
+    Returns a uint8 array of shape ``(*bins, 2)`` holding the class index
+    (or AMBIGUOUS) and the top-class probability scaled to 0-255.
+    """
+    bins = np.asarray(bins, dtype=np.int64)
+    if len(bins) != len(FEATURES) or (bins < 1).any():
+        raise ValueError(f'Need a positive bin count for each of {len(FEATURES)} features')
+    if len(bundle.classes) >= AMBIGUOUS:
+        raise ValueError('Too many classes for a uint8 grid')
+    steps = (_UPPER - _LOWER) / bins
+    n_cells = int(np.prod(bins))
+    labels = np.empty(n_cells, dtype=np.uint8)
+    confidence = np.empty(n_cells, dtype=np.uint8)
+    for start in range(0, n_cells, chunk_size):
+        index = np.arange(start, min(start + chunk_size, n_cells))
+        cells = np.stack(np.unravel_index(index, bins), axis=1)
+        centres = _LOWER + (cells + 0.5) * steps
+        _, probabilities = predict_matrix(bundle, centres)
+        labels[index] = probabilities.argmax(axis=1)
+        confidence[index] = np.round(probabilities.max(axis=1) * 255)
+
+    labels = labels.reshape(bins)
+    ambiguous = confidence.reshape(bins) < round(min_confidence * 255)
+    for axis in range(len(bins)):
+        differs = np.diff(labels, axis=axis) != 0
+        lower = [slice(None)] * len(bins)
+        upper = [slice(None)] * len(bins)
+        lower[axis], upper[axis] = slice(None, -1), slice(1, None)
+        ambiguous[tuple(lower)] |= differs
+        ambiguous[tuple(upper)] |= differs
+    labels[ambiguous] = AMBIGUOUS
+    return np.stack([labels, confidence.reshape(bins)], axis=-1)
+
+
+class LookupGrid:
+    """Read-only view of a grid written by ``save``."""
+
+    def __init__(self, cells, classes, model_version):
+        self.cells = cells
+        self.classes = np.asarray(classes)
+        self.model_version = model_version
+        self.bins = np.asarray(cells.shape[:-1], dtype=np.int64)
+        self._scale = self.bins / (_UPPER - _LOWER)
+
+    @staticmethod
+    def save(path, cells, classes, model_version, **report):
+        """Write ``<path>.npy`` and its ``<path>.json`` metadata."""
+        np.save(f'{path}.npy', cells)
+        meta = {
+            'features': list(FEATURES),
+            'bins': [int(b) for b in cells.shape[:-1]],
+            'classes': [str(c) for c in classes],
+            'model_version': model_version,
+            **report,
+        }
+        with open(f'{path}.json', 'w') as fh:
+            json.dump(meta, fh, indent=2)
+
+    @classmethod
+    def load(cls, path):
+        with open(f'{path}.json') as fh:
+            meta = json.load(fh)
+        if meta['features'] != list(FEATURES):
+            raise ValueError(f'{path}.json was built for different features')
+        cells = np.load(f'{path}.npy', mmap_mode='r')
+        return cls(cells, meta['classes'], meta['model_version'])
+
+    @staticmethod
+    def exists(path):
+        return os.path.exists(f'{path}.npy') and os.path.exists(f'{path}.json')
+
+    def cell_index(self, matrix):
+        """Return the grid cell of every row of ``matrix``, shape (n, features)."""
+        cells = np.floor((np.asarray(matrix, dtype=np.float64) - _LOWER) * self._scale).astype(np.int64)
+        return np.clip(cells, 0, self.bins - 1)
+
+    def lookup_matrix(self, matrix):
+        """
+        Return ``(labels, confidence, hit)`` for every row; ``hit`` is False
+        for ambiguous cells, whose label must come from the model.
+        """
+        entries = self.cells[tuple(self.cell_index(matrix).T)]
+        hit = entries[:, 0] != AMBIGUOUS
+        labels = np.where(hit, self.classes.take(np.where(hit, entries[:, 0], 0)), None)
+        return labels, entries[:, 1] / 255.0, hit
+
+    def lookup(self, values):
+        """Return ``(label, confidence)`` for one sample, or None if its cell is ambiguous."""
+        label, confidence = self.cells[tuple(self.cell_index([values])[0])]
+        if label == AMBIGUOUS:
+            return None
+        return self.classes[label], confidence / 255.0
+
+
+def agreement_report(grid, bundle, matrix):
+    """Compare grid answers (with model fallback) against the full model on ``matrix``."""
+    expected, _ = predict_matrix(bundle, matrix)
+    labels, _, hit = grid.lookup_matrix(matrix)
+    answered = np.where(hit, labels, expected)
+    n = len(matrix)
+    return {
+        'samples': n,
+        'grid_hit_rate': float(hit.mean()) if n else 0.0,
+        'agreement_on_hits': float((labels[hit] == expected[hit]).mean()) if hit.any() else 1.0,
+        'agreement_with_fallback': float((answered == expected).mean()) if n else 1.0,
+    }
+
+
+_grid = None
+
+
+def get_lookup_grid(model_version):
+    """Return the grid built for ``model_version``, or None if disabled, missing or stale."""
+    global _grid
+    if not settings.ML_LOOKUP_GRID_ENABLED:
+        return None
+    if _grid is None or _grid[0] != model_version:
+        grid = None
+        path = settings.ML_LOOKUP_GRID_PATH
+        if LookupGrid.exists(path):
+            try:
+                grid = LookupGrid.load(path)
+            except (OSError, ValueError, KeyError):
+                logger.exception('Could not load lookup grid %s', path)
+            if grid is not None and grid.model_version != model_version:
+                logger.warning('Lookup grid %s was built for model %s, not %s; ignoring it',
+                               path, grid.model_version, model_version)
+                grid = None
+        _grid = (model_version, grid)
+    return _grid[1]
+
+
+def predict_label(values):
+    """Return the predicted crop for one sample, from the grid when its cell is unambiguous."""
+    grid = get_lookup_grid(get_model_bundle().version)
+    if grid is not None:
+        hit = grid.lookup(values)
+        if hit is not None:
+            return hit[0]
+    return predict_sample(values)[1]
@@ -0,0 +1,105 @@
+import json
+import os
+import platform
+import time
+
+import numpy as np
+import pandas as pd
+import sklearn
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from app.benchmark import BATCH_SIZES, compare, run_suite
+from app.flat_forest import FlatForest
+from app.model_registry import get_model_bundle
+from app.prediction import predict_matrix
+
+DATASET_COLUMNS = ['N', 'P', 'K', 'temperature', 'humidity', 'ph', 'rainfall']
+ENGINES = ('sklearn', 'flat', 'compact', 'serving')
+
+
+def build_engines(bundle, names, compact_path):
+    """Return ``{name: predict_proba on raw rows}`` for the engines available with ``bundle``."""
+    engines = {}
+    if 'sklearn' in names and bundle.scaler is not None:
+        model, scaler = bundle.model, bundle.scaler
+        engines['sklearn'] = lambda X: model.predict_proba(scaler.transform(X))
+    if 'flat' in names and bundle.flat is not None:
+        flat, scaler = bundle.flat, bundle.scaler
+        engines['flat'] = flat.predict_proba if flat.folded else lambda X: flat.predict_proba(scaler.transform(X))
+    if 'compact' in names and os.path.exists(compact_path):
+        engines['compact'] = FlatForest.load(compact_path).predict_proba
+    if 'serving' in names:
+        engines['serving'] = lambda X: predict_matrix(bundle, X)[1]
+    return engines
+
+
+class Command(BaseCommand):
+    help = 'Benchmark the inference engines on dataset samples and compare against a stored baseline'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--engines', nargs='+', choices=ENGINES, default=list(ENGINES),
+                            help='Engines to benchmark; "serving" is the path the views use (default: all available)')
+        parser.add_argument('--sizes', type=int, nargs='+', default=list(BATCH_SIZES),
+                            help='Batch sizes in rows (default: 1 32 1000 100000)')
+        parser.add_argument('--threads', type=int, default=8,
+                            help='Threads for the concurrent single-row case; 0 skips it (default: 8)')
+        parser.add_argument('--min-time', type=float, default=0.5,
+                            help='Seconds to repeat each batch case for (default: 0.5)')
+        parser.add_argument('--compact-model', default=os.path.join(settings.BASE_DIR, 'crop_model_compact.npz'),
+                            help='Compact model from train_model.py --compact, benchmarked when it exists')
+        parser.add_argument('--output', default=os.path.join(settings.BASE_DIR, 'inference_benchmark.json'),
+                            help='Where to write the results')
+        parser.add_argument('--baseline', default=os.path.join(settings.BASE_DIR, 'benchmarks', 'inference_baseline.json'),
+                            help='Results to compare against')
+        parser.add_argument('--tolerance', type=float, default=0.25,
+                            help='Allowed slowdown or memory growth over the baseline (default: 0.25)')
+        parser.add_argument('--save-baseline', action='store_true',
+                            help='Store these results as the new baseline instead of comparing')
+
+    def handle(self, *args, **options):
+        bundle = get_model_bundle()
+        engines = build_engines(bundle, options['engines'], options['compact_model'])
+        if not engines:
+            raise CommandError('None of the requested engines is available')
+        dataset = pd.read_csv(settings.ML_DATASET_PATH)[DATASET_COLUMNS].to_numpy(dtype=np.float64)
+
+        self.stdout.write(f'Benchmarking {", ".join(engines)} on model {bundle.version}...')
+        cases = run_suite(engines, dataset, sizes=options['sizes'], threads=options['threads'],
+                          min_time=options['min_time'], log=self.log_case)
+        results = {
+            'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'model_version': bundle.version,
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'sklearn': sklearn.__version__,
+            'machine': platform.machine(),
+            'cpus': os.cpu_count(),
+            'cases': cases,
+        }
+        with open(options['output'], 'w') as fh:
+            json.dump(results, fh, indent=2)
+        self.stdout.write(f'Results written to {options["output"]}')
+
+        if options['save_baseline']:
+            os.makedirs(os.path.dirname(os.path.abspath(options['baseline'])), exist_ok=True)
+            with open(options['baseline'], 'w') as fh:
+                json.dump(results, fh, indent=2)
+            self.stdout.write(self.style.SUCCESS(f'Baseline saved to {options["baseline"]}'))
+            return
+        if not os.path.exists(options['baseline']):
+            self.stdout.write(self.style.WARNING(f'No baseline at {options["baseline"]}; run with --save-baseline'))
+            return
+        with open(options['baseline']) as fh:
+            baseline = json.load(fh)
+        regressions = compare(cases, baseline['cases'], options['tolerance'])
+        if regressions:
+            for message in regressions:
+                self.stderr.write(message)
+            raise CommandError(f'{len(regressions)} regression(s) beyond {options["tolerance"]:.0%} of the baseline')
+        self.stdout.write(self.style.SUCCESS(f'No regressions beyond {options["tolerance"]:.0%} of the baseline'))
+
+    def log_case(self, name, case):
+        memory = f', peak {case["peak_bytes"] / 2**20:.1f} MB' if 'peak_bytes' in case else ''
+        self.stdout.write(f'  {name:<24} p50 {case["p50_ms"]:9.3f} ms  p99 {case["p99_ms"]:9.3f} ms  '
+                          f'{case["rows_per_second"]:12,.0f} rows/s{memory}')
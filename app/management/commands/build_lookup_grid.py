@@ -0,0 +1,54 @@
+import time
+
+import numpy as np
+import pandas as pd
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from app.lookup_grid import AMBIGUOUS, LookupGrid, agreement_report, build_grid
+from app.model_registry import get_model_bundle
+from app.prediction import FEATURES
+
+DATASET_COLUMNS = ['N', 'P', 'K', 'temperature', 'humidity', 'ph', 'rainfall']
+
+
+class Command(BaseCommand):
+    help = 'Precompute the crop lookup grid for the current model and report its agreement with the model'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--bins', default='8',
+                            help='Bins per feature: one number for all, or one per feature separated by commas')
+        parser.add_argument('--min-confidence', type=float, default=0.6,
+                            help='Cells whose top-class probability is lower are answered by the model')
+        parser.add_argument('--output', default=settings.ML_LOOKUP_GRID_PATH,
+                            help='Path prefix for the .npy grid and its .json metadata')
+
+    def handle(self, *args, **options):
+        try:
+            bins = [int(b) for b in options['bins'].split(',')]
+        except ValueError:
+            raise CommandError('--bins must be integers')
+        if len(bins) == 1:
+            bins = bins * len(FEATURES)
+        if len(bins) != len(FEATURES):
+            raise CommandError(f'--bins needs 1 or {len(FEATURES)} values')
+
+        bundle = get_model_bundle()
+        self.stdout.write(f'Building {"x".join(map(str, bins))} grid ({np.prod(bins):,} cells) '
+                          f'for model {bundle.version}...')
+        started = time.perf_counter()
+        cells = build_grid(bundle, bins, options['min_confidence'])
+        build_seconds = time.perf_counter() - started
+
+        dataset = pd.read_csv(settings.ML_DATASET_PATH)[DATASET_COLUMNS].to_numpy(dtype=np.float64)
+        grid = LookupGrid(cells, bundle.classes, bundle.version)
+        report = agreement_report(grid, bundle, dataset)
+        report['ambiguous_cells'] = float((cells[..., 0] == AMBIGUOUS).mean())
+        report['build_seconds'] = round(build_seconds, 2)
+        LookupGrid.save(options['output'], cells, bundle.classes, bundle.version, report=report)
+
+        self.stdout.write(f'Grid size: {cells.nbytes / 1024:.0f} KB, ambiguous cells: {report["ambiguous_cells"]:.1%}')
+        self.stdout.write(f'Dataset ({report["samples"]} samples): grid answers {report["grid_hit_rate"]:.1%}, '
+                          f'agreement on those {report["agreement_on_hits"]:.2%}, '
+                          f'overall with fallback {report["agreement_with_fallback"]:.2%}')
+        self.stdout.write(self.style.SUCCESS(f'Saved {options["output"]}.npy'))
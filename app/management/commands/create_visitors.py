@@ -0,0 +1,26 @@
+from django.contrib.auth.models import Group, User
+from django.core.management.base import BaseCommand
+
+from app.models import Visitor
+
+
+class Command(BaseCommand):
+    help = 'Create approved visitor accounts <prefix>1..<prefix>N (for load testing and local development)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--count', type=int, default=10)
+        parser.add_argument('--prefix', default='loadtest')
+        parser.add_argument('--password', default='loadtest-password')
+
+    def handle(self, *args, **options):
+        group = Group.objects.get_or_create(name='VISITOR')[0]
+        created = 0
+        for i in range(1, options['count'] + 1):
+            username = f"{options['prefix']}{i}"
+            if User.objects.filter(username=username).exists():
+                continue
+            user = User.objects.create_user(username=username, password=options['password'])
+            group.user_set.add(user)
+            Visitor.objects.create(user=user, email=f'{username}@example.com', gender='Other', status=True)
+            created += 1
+        self.stdout.write(self.style.SUCCESS(f'Created {created} visitor(s)'))
@@ -0,0 +1,222 @@
+import http.client
+import json
+import os
+import random
+import secrets
+import signal
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.parse
+from http.cookies import SimpleCookie
+
+import numpy as np
+import pandas as pd
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from app.latency import Histogram
+from app.local_server import free_port, start_gunicorn, wait_until_listening
+from app.prediction import FEATURES, validate_matrix
+
+DATASET_COLUMNS = ['N', 'P', 'K', 'temperature', 'humidity', 'ph', 'rainfall']
+ENDPOINTS = ('login', 'find_crop', 'api')
+# Default traffic mix: mostly API calls, some form submissions and the odd fresh login.
+DEFAULT_MIX = 'api=7,find_crop=2,login=1'
+
+
+def parse_mix(value):
+    """Parse ``name=weight,...`` into ``{endpoint: weight}``."""
+    mix = {}
+    for part in value.split(','):
+        name, _, weight = part.partition('=')
+        if name.strip() not in ENDPOINTS:
+            raise CommandError(f'Unknown endpoint in --mix: {name!r} (choose from {", ".join(ENDPOINTS)})')
+        try:
+            mix[name.strip()] = float(weight)
+        except ValueError:
+            raise CommandError(f'Bad weight in --mix: {part!r}')
+    return mix
+
+
+class VirtualUser:
+    """One visitor with its own cookies, talking to the server over plain HTTP."""
+
+    def __init__(self, host, port, username, password, samples, rng):
+        self.host, self.port = host, port
+        self.username, self.password = username, password
+        self.samples = samples
+        self.rng = rng
+        self.cookies = {}
+
+    def request(self, method, path, body=None, content_type=None):
+        """Return the response status (0 if the request failed)."""
+        headers = {'Cookie': '; '.join(f'{k}={v}' for k, v in self.cookies.items())}
+        if content_type:
+            headers['Content-Type'] = content_type
+        connection = http.client.HTTPConnection(self.host, self.port, timeout=60)
+        try:
+            connection.request(method, path, body=body, headers=headers)
+            response = connection.getresponse()
+            response.read()
+            for header in response.headers.get_all('Set-Cookie') or ():
+                for name, morsel in SimpleCookie(header).items():
+                    self.cookies[name] = morsel.value
+            return response.status
+        except (OSError, http.client.HTTPException):
+            return 0
+        finally:
+            connection.close()
+
+    def post_form(self, path, fields):
+        # Django accepts any well-formed token as long as the cookie and form agree,
+        # so the client picks its own instead of scraping it from a page.
+        token = self.cookies.setdefault('csrftoken', secrets.token_hex(32))
+        body = urllib.parse.urlencode({**fields, 'csrfmiddlewaretoken': token})
+        return self.request('POST', path, body, 'application/x-www-form-urlencoded')
+
+    def sample(self):
+        return dict(zip(FEATURES, self.samples[self.rng.randrange(len(self.samples))].tolist()))
+
+    def login(self):
+        self.cookies.clear()
+        return self.post_form('/visitor_login', {'username': self.username, 'password': self.password}) == 302
+
+    def find_crop(self):
+        return self.post_form('/visitor_find_crop', self.sample()) == 200
+
+    def api(self):
+        body = json.dumps(self.sample())
+        return self.request('POST', '/api/predict-crop/', body, 'application/json') == 200
+
+
+class Command(BaseCommand):
+    help = ('Drive visitor logins, visitor_find_crop form posts and /api/predict-crop/ calls at fixed '
+            'concurrency and report latency histograms and error rates per endpoint')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 4, 16],
+                            help='Concurrent virtual users; each level is run in turn (default: 1 4 16)')
+        parser.add_argument('--duration', type=float, default=20, help='Seconds per concurrency level (default: 20)')
+        parser.add_argument('--warmup', type=float, default=5,
+                            help='Seconds of unrecorded traffic first, so workers are past their first requests (default: 5)')
+        parser.add_argument('--mix', default=DEFAULT_MIX, help=f'Weights per endpoint (default: {DEFAULT_MIX})')
+        parser.add_argument('--url', help='Test a running server instead of starting gunicorn, e.g. http://127.0.0.1:8000')
+        parser.add_argument('--workers', type=int, default=3, help='gunicorn workers (default: 3)')
+        parser.add_argument('--threads', type=int, default=1, help='gunicorn threads per worker (default: 1)')
+        parser.add_argument('--gunicorn-args', default='', help='Extra gunicorn arguments, e.g. "--preload"')
+        parser.add_argument('--password', default='loadtest-password',
+                            help='Password of the loadtest<N> visitors (created automatically with a local server)')
+        parser.add_argument('--output', help='Write the results as JSON')
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        mix = parse_mix(options['mix'])
+        dataset = pd.read_csv(settings.ML_DATASET_PATH)[DATASET_COLUMNS].to_numpy(dtype=np.float64)
+        samples = dataset[validate_matrix(dataset)[0]]
+
+        server = tmpdir = None
+        if options['url']:
+            target = urllib.parse.urlsplit(options['url'])
+            host, port = target.hostname, target.port or 80
+        else:
+            tmpdir = tempfile.mkdtemp(prefix='agrosmart-loadtest-')
+            host, port = '127.0.0.1', free_port()
+            server = self.start_server(tmpdir, port, max(options['concurrency']), options)
+        try:
+            if options['warmup']:
+                self.run_level(host, port, max(options['concurrency']), options['warmup'], mix, samples, options,
+                               report=False)
+            results = [self.run_level(host, port, level, options['duration'], mix, samples, options)
+                       for level in options['concurrency']]
+        finally:
+            if server is not None:
+                server.send_signal(signal.SIGTERM)
+                server.wait(timeout=60)
+                # The SQLite database only lives for this run.
+                for name in os.listdir(tmpdir):
+                    os.remove(os.path.join(tmpdir, name))
+                os.rmdir(tmpdir)
+
+        if options['output']:
+            with open(options['output'], 'w') as fh:
+                json.dump({'mix': mix, 'levels': results}, fh, indent=2)
+            self.stdout.write(f'Results written to {options["output"]}')
+
+    def start_server(self, tmpdir, port, users, options):
+        """Prepare a throwaway SQLite database with enough visitors and start gunicorn on it."""
+        env = dict(os.environ, DATABASE_ENGINE='sqlite', DATABASE_NAME=os.path.join(tmpdir, 'db.sqlite3'))
+        manage = [sys.executable, os.path.join(settings.BASE_DIR, 'manage.py')]
+        subprocess.run(manage + ['migrate', '--verbosity', '0'], env=env, check=True)
+        subprocess.run(manage + ['create_visitors', '--count', str(users), '--password', options['password']],
+                       env=env, check=True, stdout=subprocess.DEVNULL)
+        extra = ['--threads', str(options['threads']), *options['gunicorn_args'].split()]
+        server = start_gunicorn(port, options['workers'], extra, env)
+        try:
+            wait_until_listening(server, port)
+        except RuntimeError as e:
+            server.kill()
+            raise CommandError(str(e))
+        self.stdout.write(f'gunicorn: {options["workers"]} workers x {options["threads"]} threads on port {port}')
+        return server
+
+    def run_level(self, host, port, users, duration, mix, samples, options, report=True):
+        names, weights = list(mix), list(mix.values())
+        latencies = {name: [] for name in ENDPOINTS}
+        errors = {name: 0 for name in ENDPOINTS}
+        lock = threading.Lock()
+        deadline = time.monotonic() + duration
+
+        def run(index):
+            rng = random.Random(options['seed'] * 1000 + index)
+            user = VirtualUser(host, port, f'loadtest{index + 1}', options['password'], samples, rng)
+            action = 'login'
+            while time.monotonic() < deadline:
+                started = time.perf_counter()
+                ok = getattr(user, action)()
+                elapsed = time.perf_counter() - started
+                with lock:
+                    latencies[action].append(elapsed * 1000)
+                    errors[action] += not ok
+                if action == 'login' and not ok:
+                    time.sleep(0.1)
+                    continue
+                action = rng.choices(names, weights)[0]
+
+        threads = [threading.Thread(target=run, args=(i,)) for i in range(users)]
+        started = time.monotonic()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.monotonic() - started
+
+        level = {'concurrency': users, 'seconds': elapsed, 'endpoints': {}}
+        if not report:
+            return level
+        self.stdout.write(f'\n{users} concurrent users, {elapsed:.1f}s')
+        for name in ENDPOINTS:
+            if not latencies[name]:
+                continue
+            ms = np.array(latencies[name])
+            histogram = Histogram()
+            for value in ms:
+                histogram.add(value)
+            stats = {
+                'requests': len(ms),
+                'errors': errors[name],
+                'error_rate': errors[name] / len(ms),
+                'requests_per_second': len(ms) / elapsed,
+                'p50_ms': float(np.percentile(ms, 50)),
+                'p90_ms': float(np.percentile(ms, 90)),
+                'p99_ms': float(np.percentile(ms, 99)),
+                'max_ms': float(ms.max()),
+                'histogram': histogram.as_dict()['buckets'],
+            }
+            level['endpoints'][name] = stats
+            self.stdout.write(f'  {name:<10} {stats["requests_per_second"]:8.1f} req/s  '
+                              f'p50 {stats["p50_ms"]:8.1f} ms  p90 {stats["p90_ms"]:8.1f} ms  '
+                              f'p99 {stats["p99_ms"]:8.1f} ms  errors {stats["error_rate"]:6.1%}')
+        return level
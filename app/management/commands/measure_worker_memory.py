@@ -0,0 +1,149 @@
+import json
+import os
+import signal
+import time
+import urllib.request
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from app.local_server import free_port, start_gunicorn
+from app.prediction import FEATURES
+
+SAMPLE = [90, 42, 43, 20.88, 82.0, 6.5, 202.94]
+
+# Extra environment and gunicorn flags for each way of holding the model.
+MODES = {
+    # Workers start without the model (baseline for the others).
+    'none': ({'ML_MODEL_PRELOAD': 'False'}, []),
+    # Every worker loads its own copy at boot.
+    'private': ({'ML_MODEL_PRELOAD': 'True'}, []),
+    # Loaded once in the master and shared copy-on-write.
+    'preload': ({'ML_MODEL_PRELOAD': 'True'}, ['--preload']),
+    # The flat forest alone, memory-mapped by every worker.
+    'mmap': ({'ML_MODEL_PRELOAD': 'True', 'ML_MODEL_MMAP': 'True', 'ML_MODEL_PATH': settings.ML_FLAT_MODEL_PATH}, []),
+    # Both: the app and its imports are shared too.
+    'preload-mmap': ({'ML_MODEL_PRELOAD': 'True', 'ML_MODEL_MMAP': 'True', 'ML_MODEL_PATH': settings.ML_FLAT_MODEL_PATH},
+                     ['--preload']),
+}
+
+
+def memory(pid):
+    """Return RSS, PSS and private bytes of a process from /proc/<pid>/smaps_rollup."""
+    fields = {}
+    with open(f'/proc/{pid}/smaps_rollup') as fh:
+        for line in fh:
+            parts = line.split()
+            if len(parts) == 3 and parts[2] == 'kB':
+                fields[parts[0].rstrip(':')] = int(parts[1]) * 1024
+    return {
+        'rss': fields['Rss'],
+        'pss': fields['Pss'],
+        'private': fields['Private_Clean'] + fields['Private_Dirty'],
+    }
+
+
+def children(pid):
+    """Return the ids of the direct children of ``pid``."""
+    found = []
+    for entry in os.listdir('/proc'):
+        if entry.isdigit():
+            try:
+                with open(f'/proc/{entry}/stat') as fh:
+                    # The command name may contain spaces; the parent id follows its closing parenthesis.
+                    if int(fh.read().rsplit(')', 1)[1].split()[1]) == pid:
+                        found.append(int(entry))
+            except (OSError, IndexError, ValueError):
+                continue
+    return found
+
+
+class Command(BaseCommand):
+    help = 'Start gunicorn with each model sharing mode and report the memory used by its workers (Linux only)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, nargs='+', default=[3, 16],
+                            help='Worker counts to measure (default: 3 16)')
+        parser.add_argument('--modes', nargs='+', choices=list(MODES), default=list(MODES),
+                            help='Sharing modes to measure (default: all)')
+        parser.add_argument('--requests', type=int, default=8,
+                            help='Predictions sent per worker before measuring (default: 8)')
+        parser.add_argument('--json', action='store_true', help='Print the results as JSON')
+
+    def handle(self, *args, **options):
+        if not os.path.exists('/proc/self/smaps_rollup'):
+            raise CommandError('This command needs Linux /proc/<pid>/smaps_rollup')
+        results = []
+        for workers in options['workers']:
+            for mode in options['modes']:
+                result = self.measure(mode, workers, options['requests'])
+                results.append(result)
+                if not options['json']:
+                    self.stdout.write(
+                        f'{mode:<12} {workers:>3} workers: total PSS {result["total_pss"] / 2**20:7.1f} MB, '
+                        f'per worker RSS {result["worker_rss"] / 2**20:6.1f} MB, '
+                        f'private {result["worker_private"] / 2**20:6.1f} MB'
+                    )
+        if options['json']:
+            self.stdout.write(json.dumps(results, indent=2))
+
+    def measure(self, mode, workers, requests):
+        env_overrides, flags = MODES[mode]
+        port = free_port()
+        env = dict(os.environ, **env_overrides)
+        master = start_gunicorn(port, workers, flags, env)
+        try:
+            pids = self.wait_for_workers(master, workers)
+            if mode != 'none':
+                self.send_predictions(port, workers * requests)
+            self.wait_until_stable([master.pid] + pids)
+            usage = [memory(pid) for pid in pids]
+            return {
+                'mode': mode,
+                'workers': workers,
+                'total_pss': sum(u['pss'] for u in usage) + memory(master.pid)['pss'],
+                'worker_rss': sum(u['rss'] for u in usage) // workers,
+                'worker_private': sum(u['private'] for u in usage) // workers,
+            }
+        finally:
+            master.send_signal(signal.SIGTERM)
+            master.wait(timeout=60)
+
+    def wait_for_workers(self, master, workers, timeout=120):
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            if master.poll() is not None:
+                raise CommandError(f'gunicorn exited with status {master.returncode}')
+            pids = children(master.pid)
+            if len(pids) == workers:
+                return pids
+            time.sleep(0.2)
+        raise CommandError(f'gunicorn did not start {workers} workers in {timeout}s')
+
+    def wait_until_stable(self, pids, timeout=120):
+        """Wait until the workers have finished booting, i.e. their memory stops growing."""
+        deadline = time.monotonic() + timeout
+        previous = None
+        while time.monotonic() < deadline:
+            total = sum(memory(pid)['rss'] for pid in pids)
+            if previous is not None and abs(total - previous) <= total * 0.002:
+                return
+            previous = total
+            time.sleep(1)
+
+    def send_predictions(self, port, count, timeout=120):
+        body = json.dumps(dict(zip(FEATURES, SAMPLE))).encode()
+        deadline = time.monotonic() + timeout
+        sent = 0
+        while sent < count:
+            request = urllib.request.Request(f'http://127.0.0.1:{port}/api/predict-crop/', data=body,
+                                             headers={'Content-Type': 'application/json'})
+            try:
+                with urllib.request.urlopen(request, timeout=30) as response:
+                    response.read()
+                sent += 1
+            except OSError:
+                # Workers still booting.
+                if time.monotonic() > deadline:
+                    raise CommandError('gunicorn did not answer predictions')
+                time.sleep(0.2)
@@ -0,0 +1,54 @@
+import json
+import os
+import subprocess
+import sys
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from app.startup_profile import STAGES
+
+
+class Command(BaseCommand):
+    help = 'Boot the app in a fresh interpreter and report import time and RSS per package and stage'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--stages', nargs='+', choices=STAGES, default=['setup', 'urls'],
+                            help='Boot stages to run, in order; add "model" to include loading the model '
+                                 '(default: setup urls, i.e. what a worker does before its first request)')
+        parser.add_argument('--top', type=int, default=15, help='Packages to list (default: 15)')
+        parser.add_argument('--modules', action='store_true', help='List individual modules instead of packages')
+        parser.add_argument('--max-seconds', type=float,
+                            help='Fail if the stages take longer than this in total, e.g. in CI')
+        parser.add_argument('--json', action='store_true', help='Print the full profile as JSON')
+
+    def handle(self, *args, **options):
+        stages = [stage for stage in STAGES if stage in options['stages']]
+        env = dict(os.environ, DJANGO_SETTINGS_MODULE=os.environ.get('DJANGO_SETTINGS_MODULE', 'project2.settings'))
+        # The profile is only meaningful in an interpreter that has imported nothing yet.
+        completed = subprocess.run([sys.executable, '-m', 'app.startup_profile', *stages], cwd=settings.BASE_DIR,
+                                   env=env, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+        if completed.returncode:
+            raise CommandError(f'Startup profile failed:\n{completed.stderr}')
+        result = json.loads(completed.stdout)
+
+        if options['json']:
+            self.stdout.write(json.dumps(result, indent=2))
+        else:
+            self.report(result, options)
+        total = sum(stage['seconds'] for stage in result['stages'])
+        if options['max_seconds'] is not None and total > options['max_seconds']:
+            raise CommandError(f'Startup took {total:.2f}s, over the {options["max_seconds"]:.2f}s budget')
+
+    def report(self, result, options):
+        self.stdout.write(f'Python {result["python"]}, interpreter RSS {result["interpreter_rss_bytes"] / 2**20:.1f} MB')
+        for stage in result['stages']:
+            self.stdout.write(f'  {stage["stage"]:<8} {stage["seconds"] * 1000:8.1f} ms  '
+                              f'{stage["rss_bytes"] / 2**20:+7.1f} MB')
+        self.stdout.write(f'  {"total":<8} {sum(s["seconds"] for s in result["stages"]) * 1000:8.1f} ms  '
+                          f'RSS {result["rss_bytes"] / 2**20:.1f} MB')
+        rows = result['modules'] if options['modules'] else result['packages']
+        self.stdout.write(f'\nSlowest {"modules" if options["modules"] else "packages"} (own import time and RSS):')
+        for name, row in sorted(rows.items(), key=lambda item: -item[1]['seconds'])[:options['top']]:
+            count = f'  {row["modules"]:4d} modules' if 'modules' in row else ''
+            self.stdout.write(f'  {name:<40} {row["seconds"] * 1000:8.1f} ms  {row["rss_bytes"] / 2**20:+7.1f} MB{count}')
@@ -0,0 +1,205 @@
+"""
+Process-wide registry for the crop recommendation model and scaler.
+
+The artifacts are loaded once per worker process and shared by every
+request. Paths come from settings, so nothing depends on the current
+working directory. When a flattened copy of the forest (see
+``app.flat_forest``) sits next to the model it is loaded too and used
+for small inputs. ``ML_MODEL_PATH`` may also name a compact ``.npz``
+forest exported by ``train_model.py --compact``; it then serves every
+request on its own, with the scaler folded in. With ``ML_MODEL_MMAP`` flat
+forests are memory-mapped, so all workers share one copy of their pages;
+replace such files by renaming a new file over them, never by rewriting
+them in place. When the files on disk change, the first request to
+notice loads a complete new bundle and swaps the reference in a single
+assignment; requests already holding the old bundle keep using it until
+they finish, so nobody ever sees a half-loaded model. A flat export
+that was not made from the model next to it (one of the pair replaced,
+the other not yet) fails the load like a half-written file does; a
+worker with nothing loaded yet retries it for a moment instead.
+"""
+
+import hashlib
+import logging
+import os
+import threading
+import time
+
+from django.conf import settings
+
+from .flat_forest import FlatForest, forest_fingerprint
+
+logger = logging.getLogger(__name__)
+
+# Attempts and the pause between them when a first load finds the flat export
+# and the model from different versions, e.g. between update_model.py's renames.
+MISMATCH_ATTEMPTS = 10
+MISMATCH_DELAY = 0.1
+
+
+class ModelMismatchError(ValueError):
+    """The flat export on disk was not made from the model next to it."""
+
+
+class ModelBundle:
+    """Immutable snapshot of a loaded model, its scaler and their checksums."""
+
+    __slots__ = ('model', 'scaler', 'flat', 'checksums', 'version', 'loaded_at', 'load_seconds')
+
+    def __init__(self, model, scaler, flat, checksums, loaded_at, load_seconds):
+        self.model = model
+        self.scaler = scaler
+        self.flat = flat
+        self.checksums = checksums
+        self.version = hashlib.sha256(''.join(checksums.values()).encode()).hexdigest()[:12]
+        self.loaded_at = loaded_at
+        self.load_seconds = load_seconds
+
+    @property
+    def classes(self):
+        return self.model.classes_
+
+
+def file_checksum(path, chunk_size=1 << 20):
+    """Return the SHA-256 hex digest of a file."""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as fh:
+        for chunk in iter(lambda: fh.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class ModelRegistry:
+    """Loads the artifacts lazily and hot-swaps them when they change on disk."""
+
+    def __init__(self, model_path=None, scaler_path=None, flat_model_path=None, check_interval=None, mmap=None):
+        self.model_path = str(model_path or settings.ML_MODEL_PATH)
+        self.scaler_path = str(scaler_path or settings.ML_SCALER_PATH)
+        self.flat_model_path = str(flat_model_path or settings.ML_FLAT_MODEL_PATH)
+        if check_interval is None:
+            check_interval = settings.ML_MODEL_RELOAD_INTERVAL
+        self.check_interval = check_interval
+        self.mmap = settings.ML_MODEL_MMAP if mmap is None else mmap
+        self._bundle = None
+        self._signature = None
+        self._next_check = 0.0
+        self._lock = threading.Lock()
+
+    def paths(self):
+        if self.model_path.endswith('.npz'):
+            return {'model': self.model_path}
+        paths = {'model': self.model_path, 'scaler': self.scaler_path}
+        if os.path.exists(self.flat_model_path):
+            paths['flat'] = self.flat_model_path
+        return paths
+
+    def _stat_signature(self):
+        signature = []
+        for name, path in self.paths().items():
+            st = os.stat(path)
+            signature.append((name, st.st_mtime_ns, st.st_size))
+        return tuple(signature)
+
+    def _load(self):
+        started = time.perf_counter()
+        paths = self.paths()
+        checksums = {name: file_checksum(path) for name, path in paths.items()}
+        if paths['model'].endswith('.npz'):
+            model = flat = FlatForest.load(paths['model'], mmap=self.mmap)
+            scaler = None
+            if not flat.folded:
+                raise ValueError(f"{paths['model']} has no scaler folded in")
+            return ModelBundle(model, scaler, flat, checksums, time.time(), time.perf_counter() - started)
+        # joblib and sklearn (which unpickling imports) load with the first bundle, not at worker boot.
+        import joblib
+        model = joblib.load(paths['model'])
+        scaler = joblib.load(paths['scaler'])
+        flat = FlatForest.load(paths['flat'], mmap=self.mmap) if 'flat' in paths else None
+        if flat is not None and (list(flat.classes_) != list(model.classes_) or
+                                 flat.fingerprint not in (None, forest_fingerprint(model))):
+            # E.g. caught between update_model.py replacing the flat export and the model.
+            raise ModelMismatchError(f"{paths['flat']} does not match {paths['model']}")
+        return ModelBundle(model, scaler, flat, checksums, time.time(), time.perf_counter() - started)
+
+    @property
+    def current(self):
+        """The loaded bundle, without checking the files or loading anything (None before the first load)."""
+        return self._bundle
+
+    def get(self):
+        """
+        Return the current bundle, reloading it first if the files changed.
+
+        Raises FileNotFoundError if the artifacts are missing and nothing
+        has been loaded yet.
+        """
+        bundle = self._bundle
+        if bundle is not None and (self.check_interval < 0 or time.monotonic() < self._next_check):
+            return bundle
+        return self._refresh()
+
+    def _refresh(self):
+        with self._lock:
+            self._next_check = time.monotonic() + max(self.check_interval, 0)
+            try:
+                signature = self._stat_signature()
+            except FileNotFoundError:
+                if self._bundle is None:
+                    raise
+                logger.warning('Model artifacts disappeared; keeping version %s', self._bundle.version)
+                return self._bundle
+            if self._bundle is not None and signature == self._signature:
+                return self._bundle
+            try:
+                bundle = self._load() if self._bundle is not None else self._first_load()
+            except Exception:
+                if self._bundle is None:
+                    raise
+                # Most likely a deploy is still writing the files; retry on the next check.
+                logger.exception('Reloading model artifacts failed; keeping version %s', self._bundle.version)
+                return self._bundle
+            if self._stat_signature() != signature:
+                # Files changed while we were reading them; serve this load but check again.
+                signature = None
+            if self._bundle is None or bundle.version != self._bundle.version:
+                logger.info('Loaded crop model version %s in %.3fs', bundle.version, bundle.load_seconds)
+            self._signature = signature
+            self._bundle = bundle
+            return bundle
+
+    def _first_load(self):
+        """``_load``, retrying a pair caught mid-update rather than failing with nothing to serve."""
+        for attempt in range(1, MISMATCH_ATTEMPTS + 1):
+            try:
+                return self._load()
+            except ModelMismatchError:
+                if attempt == MISMATCH_ATTEMPTS:
+                    raise
+                logger.warning('Model artifacts are being updated; retrying the load')
+                time.sleep(MISMATCH_DELAY)
+
+    def clear(self):
+        """Forget the loaded bundle so the next call reloads from disk."""
+        with self._lock:
+            self._bundle = None
+            self._signature = None
+            self._next_check = 0.0
+
+
+_registry = None
+_registry_lock = threading.Lock()
+
+
+def get_registry():
+    """Return the registry shared by this process."""
+    global _registry
+    if _registry is None:
+        with _registry_lock:
+            if _registry is None:
+                _registry = ModelRegistry()
+    return _registry
+
+
+def get_model_bundle():
+    """Shortcut for ``get_registry().get()``."""
+    return get_registry().get()
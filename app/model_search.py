@@ -0,0 +1,183 @@
+"""
+Successive-halving search over the Random Forest's hyperparameters.
+
+``train_model.py --search`` samples candidates from ``SEARCH_SPACE`` and
+scores them all with cross-validation on a small stratified share of
+each fold's training rows. The best ``1 / factor`` of them are kept and
+scored again on ``factor`` times as many rows, until one is left at the
+full training folds. Every rung's candidates are scored in parallel on
+the caller's process pool; the fits go through ``fit_and_evaluate``, so
+a rerun reuses them from the training cache.
+
+The objective is accuracy net of what the model costs to serve:
+
+    score = accuracy - latency_weight * latency_ms - size_weight * size_mb
+
+where ``latency_ms`` is the median single-row ``predict_proba`` time of
+the flat-array forest the API serves small requests with, and ``size_mb``
+is the size of the saved ``crop_model.joblib``. Latencies are timed in
+the calling process once a rung's fits have finished, so they do not
+depend on what else the pool is running. A forest that is no more
+accurate but slower or larger loses.
+
+This module must not import Django.
+"""
+
+import itertools
+import math
+import os
+import tempfile
+import time
+
+import numpy as np
+from sklearn.ensemble import RandomForestClassifier
+from sklearn.model_selection import train_test_split
+
+from .flat_forest import FlatForest
+from .training_cache import fit_and_evaluate, save_estimator, submit
+
+SEARCH_SPACE = {
+    'n_estimators': [10, 25, 50, 100, 200],
+    'max_depth': [None, 8, 12, 16, 24],
+    'min_samples_leaf': [1, 2, 4],
+    # 'sqrt' is 2 of the 7 features, None all of them.
+    'max_features': ['sqrt', 0.5, None],
+}
+RANDOM_STATE = 42
+
+
+def forest(params):
+    """The Random Forest ``params`` describe, seeded like the production model."""
+    return RandomForestClassifier(random_state=RANDOM_STATE, **params)
+
+
+def sample_candidates(n_candidates, space=SEARCH_SPACE, seed=RANDOM_STATE):
+    """Return ``n_candidates`` distinct parameter dicts drawn from ``space`` (all of it if smaller)."""
+    names = list(space)
+    grid = list(itertools.product(*(space[name] for name in names)))
+    if n_candidates < len(grid):
+        picked = np.random.RandomState(seed).choice(len(grid), n_candidates, replace=False)
+        grid = [grid[i] for i in sorted(picked)]
+    return [dict(zip(names, values)) for values in grid]
+
+
+def rung_schedule(n_candidates, factor, max_rows, min_rows):
+    """Return ``(candidates, rows per fold)`` for every rung, ending with one candidate on ``max_rows``."""
+    counts = [n_candidates]
+    while counts[-1] > 1:
+        counts.append(math.ceil(counts[-1] / factor))
+    rungs = len(counts)
+    return [(count, max(min_rows, min(max_rows, round(max_rows / factor ** (rungs - 1 - i)))))
+            for i, count in enumerate(counts)]
+
+
+def subsample(rows, y, n_rows):
+    """A stratified sample of ``n_rows`` of ``rows`` (all of them when that leaves too few per class)."""
+    n_classes = len(np.unique(y[rows]))
+    if n_rows >= len(rows) - n_classes:
+        return rows
+    sample, _ = train_test_split(rows, train_size=n_rows, stratify=y[rows], random_state=RANDOM_STATE)
+    return np.sort(sample)
+
+
+def single_row_latency(predict_proba, X, repeats=200):
+    """Median seconds of ``predict_proba`` on one row, cycling through the rows of ``X``."""
+    times = []
+    for i in range(repeats):
+        row = X[i % len(X):i % len(X) + 1]
+        started = time.perf_counter()
+        predict_proba(row)
+        times.append(time.perf_counter() - started)
+    return float(np.median(times))
+
+
+def artifact_size(model):
+    """Bytes of ``model`` saved the way ``crop_model.joblib`` is."""
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'model.joblib')
+        save_estimator(model, path)
+        return os.path.getsize(path)
+
+
+def evaluate_candidate(params, X, y, folds, n_rows, cache=None):
+    """
+    Cross-validate the forest ``params`` describe on ``n_rows`` of each fold's training rows.
+
+    Each fold is scored on all of its evaluation rows. The size is measured
+    on the first fold's model, whose flat export is returned as ``flat``
+    for ``time_candidates``.
+    """
+    model = forest(params)
+    accuracies = []
+    fitted = None
+    for i, (fit_rows, eval_rows) in enumerate(folds):
+        fit_rows = subsample(fit_rows, y, n_rows)
+        fit = fit_and_evaluate(model, X[fit_rows], y[fit_rows], X[eval_rows], y[eval_rows], keep_model=i == 0,
+                               cache=cache)
+        accuracies.append(fit['accuracy'])
+        fitted = fitted or fit['model']
+    return {
+        'params': params,
+        'rows': n_rows,
+        'accuracy': float(np.mean(accuracies)),
+        'accuracy_std': float(np.std(accuracies)),
+        'latency_ms': None,
+        'size_bytes': artifact_size(fitted),
+        'flat': FlatForest.from_sklearn(fitted),
+    }
+
+
+def time_candidates(results, X, rounds=3, repeats=100):
+    """
+    Set the ``latency_ms`` of ``evaluate_candidate`` results, one at a time in this process.
+
+    The candidates take turns for ``rounds`` rounds of ``repeats`` rows of
+    ``X``, so a slow moment of the machine hits them alike; each gets the
+    median of its rounds. The ``flat`` forests are dropped afterwards.
+    """
+    timings = [[] for _ in results]
+    for _ in range(rounds):
+        for timing, result in zip(timings, results):
+            timing.append(single_row_latency(result['flat'].predict_proba, X, repeats))
+    for timing, result in zip(timings, results):
+        result['latency_ms'] = float(np.median(timing)) * 1000
+        del result['flat']
+    return results
+
+
+def objective(result, latency_weight, size_weight):
+    return result['accuracy'] - latency_weight * result['latency_ms'] - size_weight * result['size_bytes'] / 2**20
+
+
+def successive_halving(X, y, folds, candidates, factor=3, min_rows=None, latency_weight=0.005, size_weight=0.002,
+                       pool=None, cache=None, log=print):
+    """
+    Run the search over ``candidates`` and return its rungs.
+
+    Each rung is a list of ``evaluate_candidate`` results with a ``score``,
+    best first; the last rung holds the winner. ``pool`` (an executor or
+    None) scores a rung's candidates concurrently.
+    """
+    y = np.asarray(y)
+    max_rows = min(len(fit_rows) for fit_rows, _ in folds)
+    min_rows = min_rows or 4 * len(np.unique(y))
+    rungs = []
+    for number, (count, n_rows) in enumerate(rung_schedule(len(candidates), factor, max_rows, min_rows), 1):
+        started = time.perf_counter()
+        runs = [submit(pool, evaluate_candidate, params, X, y, folds, n_rows, cache=cache)
+                for params in candidates[:count]]
+        results = time_candidates([run.result() for run in runs], X[folds[0][1]])
+        for result in results:
+            result['score'] = objective(result, latency_weight, size_weight)
+        # Ties go to the candidate sampled first, whatever order the fits finished in.
+        results.sort(key=lambda result: -result['score'])
+        rungs.append(results)
+        best = results[0]
+        log(f"Rung {number}: {count} candidate(s) on {n_rows} rows per fold in {time.perf_counter() - started:.1f}s, "
+            f"best score {best['score']:.4f} ({describe(best['params'])})")
+        candidates = [result['params'] for result in results]
+    return rungs
+
+
+def describe(params):
+    return ', '.join(f'{name}={value}' for name, value in params.items())
@@ -0,0 +1,182 @@
+"""
+Charts of the training and evaluation scripts, rendered off the critical path.
+
+The scripts compute and write their metrics first, then hand the data of
+each chart to a ``PlotRenderer``. It draws them headless (Agg backend)
+on a pool of worker processes while the script carries on, e.g. saving
+and exporting the model, and ``wait`` collects the files at the end.
+matplotlib and seaborn are only imported by the workers, so a run with
+``--no-plots`` never loads them.
+
+Every chart is a function of plain data (arrays, lists, dicts) that
+returns its figure; ``PLOTS`` maps the names the scripts use to them.
+This module must not import Django.
+"""
+
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+PLOT_FORMATS = ('png', 'svg', 'pdf')
+
+
+def training_comparison(plt, sns, models, accuracies, cv_means):
+    """Test and CV accuracy of each model (train_model.py)."""
+    x = np.arange(len(models))
+    width = 0.35
+
+    fig, ax = plt.subplots(figsize=(10, 6))
+    ax.bar(x - width/2, accuracies, width, label='Test Accuracy', alpha=0.8)
+    ax.bar(x + width/2, cv_means, width, label='CV Mean Accuracy', alpha=0.8)
+
+    ax.set_xlabel('Models')
+    ax.set_ylabel('Accuracy')
+    ax.set_title('Model Performance Comparison')
+    ax.set_xticks(x)
+    ax.set_xticklabels(models)
+    ax.legend()
+    ax.grid(axis='y', alpha=0.3)
+
+    # Add value labels
+    for i, v in enumerate(accuracies):
+        ax.text(i - width/2, v + 0.01, f'{v:.3f}', ha='center')
+    for i, v in enumerate(cv_means):
+        ax.text(i + width/2, v + 0.01, f'{v:.3f}', ha='center')
+
+    fig.tight_layout()
+    return fig
+
+
+def metric_comparison(plt, sns, results):
+    """Accuracy, precision, recall and F1 of each model, in percent (evaluate_model.py)."""
+    models = list(results.keys())
+    metrics_names = ['accuracy', 'precision', 'recall', 'f1_score']
+
+    fig, ax = plt.subplots(figsize=(12, 6))
+
+    x = np.arange(len(models))
+    width = 0.2
+
+    colors = ['#2E86AB', '#A23B72', '#F18F01', '#C73E1D']
+
+    for i, metric in enumerate(metrics_names):
+        values = [results[model][metric] * 100 for model in models]
+        ax.bar(x + i * width, values, width, label=metric.capitalize(), color=colors[i])
+
+    ax.set_xlabel('Models', fontsize=12, fontweight='bold')
+    ax.set_ylabel('Score (%)', fontsize=12, fontweight='bold')
+    ax.set_title('AgroSmart - Model Performance Comparison', fontsize=14, fontweight='bold')
+    ax.set_xticks(x + width * 1.5)
+    ax.set_xticklabels(models)
+    ax.legend()
+    ax.grid(axis='y', alpha=0.3)
+    ax.set_ylim([0, 105])
+
+    # Add value labels on bars
+    for container in ax.containers:
+        ax.bar_label(container, fmt='%.1f', padding=3)
+
+    fig.tight_layout()
+    return fig
+
+
+def feature_importance(plt, sns, importances, feature_names, title, bold=False):
+    """Feature importances of a tree model, largest first."""
+    importances = np.asarray(importances)
+    indices = np.argsort(importances)[::-1]
+    label_style = {'fontsize': 12, 'fontweight': 'bold'} if bold else {}
+    title_style = {'fontsize': 14, 'fontweight': 'bold'} if bold else {}
+
+    fig = plt.figure(figsize=(10, 6))
+    plt.bar(range(len(importances)), importances[indices], color='skyblue', edgecolor='navy')
+    plt.xlabel('Features', **label_style)
+    plt.ylabel('Importance', **label_style)
+    plt.title(title, **title_style)
+    plt.xticks(range(len(importances)), [feature_names[i] for i in indices], rotation=45, ha='right')
+    fig.tight_layout()
+    return fig
+
+
+def confusion_matrix(plt, sns, matrix, labels, title):
+    """Heatmap of a confusion matrix with its ``labels`` on both axes."""
+    fig = plt.figure(figsize=(12, 10))
+    sns.heatmap(np.asarray(matrix), annot=True, fmt='d', cmap='Blues',
+                xticklabels=labels, yticklabels=labels,
+                cbar_kws={'label': 'Count'})
+    plt.title(title, fontsize=14, fontweight='bold')
+    plt.ylabel('Actual Crop', fontsize=12)
+    plt.xlabel('Predicted Crop', fontsize=12)
+    plt.xticks(rotation=45, ha='right')
+    plt.yticks(rotation=0)
+    fig.tight_layout()
+    return fig
+
+
+PLOTS = {
+    'training_comparison': training_comparison,
+    'metric_comparison': metric_comparison,
+    'feature_importance': feature_importance,
+    'confusion_matrix': confusion_matrix,
+}
+
+
+def render(kind, path, fmt='png', dpi=300, **data):
+    """Draw one chart headless and save it to ``path``; runs in a worker process."""
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+    import seaborn as sns
+
+    sns.set_style('whitegrid')
+    plt.rcParams['figure.figsize'] = (12, 8)
+    fig = PLOTS[kind](plt, sns, **data)
+    try:
+        fig.savefig(path, format=fmt, dpi=dpi, bbox_inches='tight')
+    finally:
+        plt.close(fig)
+    return path
+
+
+class PlotRenderer:
+    """Renders charts on a pool of ``jobs`` processes (-1: one per core), or nothing when disabled."""
+
+    def __init__(self, fmt='png', dpi=300, jobs=-1, enabled=True):
+        self.fmt = fmt
+        self.dpi = dpi
+        self.workers = max(1, os.cpu_count() if jobs < 1 else jobs)
+        self.enabled = enabled
+        self._pool = None
+        self._runs = []
+
+    def submit(self, kind, name, **data):
+        """Queue chart ``kind`` to be saved as ``name`` plus the format's extension; returns the path (or None)."""
+        if not self.enabled:
+            return None
+        if self._pool is None:
+            self._pool = ProcessPoolExecutor(max_workers=self.workers)
+        path = f'{name}.{self.fmt}'
+        self._runs.append(self._pool.submit(render, kind, path, self.fmt, self.dpi, **data))
+        return path
+
+    def wait(self):
+        """Wait for every queued chart and return their paths."""
+        try:
+            return [run.result() for run in self._runs]
+        finally:
+            self._runs = []
+            if self._pool is not None:
+                self._pool.shutdown()
+                self._pool = None
+
+
+def add_plot_arguments(parser):
+    parser.add_argument('--no-plots', action='store_true', help='Skip drawing the charts')
+    parser.add_argument('--plot-format', choices=PLOT_FORMATS, default='png',
+                        help='File format of the charts (default: png)')
+    parser.add_argument('--plot-dpi', type=int, default=300, help='Resolution of raster charts (default: 300)')
+
+
+def open_renderer(args):
+    """Return the PlotRenderer the arguments ask for; charts use the --jobs processes."""
+    return PlotRenderer(fmt=args.plot_format, dpi=args.plot_dpi, jobs=args.jobs, enabled=not args.no_plots)
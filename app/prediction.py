@@ -0,0 +1,307 @@
+"""
+Shared input handling and vectorized inference for crop prediction.
+
+Both the single-sample and batch endpoints validate against the same
+ranges and run the model through ``predict_matrix`` so a batch of any
+size costs at most one ``scaler.transform`` and one ``predict_proba`` call.
+Single samples go through ``predict_sample``, which consults the
+prediction cache and can optionally coalesce concurrent requests into
+micro-batches.
+"""
+
+import threading
+
+import numpy as np
+from django.conf import settings
+
+from .coalescer import RequestCoalescer
+from .latency import add_stages, collect_stages, stage
+from .model_registry import get_model_bundle
+from .prediction_cache import PredictionCache
+
+FEATURES = ('nitrogen', 'phosphorus', 'potassium', 'temperature', 'humidity', 'ph', 'rainfall')
+
+# Input validation ranges (based on dataset analysis)
+VALIDATION_RANGES = {
+    'nitrogen': (0, 140),
+    'phosphorus': (0, 145),
+    'potassium': (0, 205),
+    'temperature': (8.8, 43.7),
+    'humidity': (14.3, 99.98),
+    'ph': (3.5, 9.9),
+    'rainfall': (20.2, 298.6)
+}
+
+# Up to this many rows the flat-array forest beats sklearn; above it sklearn's
+# compiled traversal wins (see app/flat_forest.py).
+FLAT_ENGINE_MAX_ROWS = 64
+
+_LOWER = np.array([VALIDATION_RANGES[f][0] for f in FEATURES], dtype=np.float64)
+_UPPER = np.array([VALIDATION_RANGES[f][1] for f in FEATURES], dtype=np.float64)
+
+
+def range_error(field):
+    """Return the message used when ``field`` is outside its valid range."""
+    min_val, max_val = VALIDATION_RANGES[field]
+    return f'{field.capitalize()} must be between {min_val} and {max_val}'
+
+
+class InvalidInput(ValueError):
+    """Raised with the message returned to API clients for an unusable request body."""
+
+
+def parse_sample(data):
+    """
+    Return the FEATURES-ordered values of one JSON sample.
+
+    Raises InvalidInput for a missing or non-numeric field or a value outside
+    VALIDATION_RANGES.
+    """
+    if not isinstance(data, dict):
+        raise InvalidInput('Request body must be a JSON object')
+    values = []
+    for field in FEATURES:
+        if field not in data:
+            raise InvalidInput(f'Missing required field: {field}')
+        try:
+            values.append(float(data[field]))
+        except (ValueError, TypeError):
+            raise InvalidInput(f'Invalid value for {field}: must be a number')
+    for field, value in zip(FEATURES, values):
+        min_val, max_val = VALIDATION_RANGES[field]
+        if not (min_val <= value <= max_val):
+            raise InvalidInput(range_error(field))
+    return values
+
+
+def parse_top_k(value):
+    """Return the requested number of ranked crops, or None when ``value`` is empty."""
+    if value in (None, ''):
+        return None
+    try:
+        top_k = int(value)
+    except (ValueError, TypeError):
+        top_k = 0
+    if top_k < 1:
+        raise InvalidInput('top_k must be a positive integer')
+    return top_k
+
+
+def top_k_classes(probabilities, k):
+    """
+    Return the column indexes of the ``k`` most probable classes of every row,
+    best first, shape (n, k).
+
+    Only the k-th largest value is located (a partial selection) and only the
+    k chosen columns are sorted. Ties are broken by class order, as argmax
+    does, so the first column is always the predicted class.
+    """
+    probabilities = np.atleast_2d(probabilities)
+    n_rows, n_classes = probabilities.shape
+    k = min(k, n_classes)
+    cutoff = -np.partition(-probabilities, k - 1, axis=1)[:, k - 1:k]
+    above = probabilities > cutoff
+    at = probabilities == cutoff
+    # Fill the places left after the strictly larger values with the first ties.
+    need = k - above.sum(axis=1, keepdims=True)
+    chosen = above | (at & (np.cumsum(at, axis=1) <= need))
+    top = np.nonzero(chosen)[1].reshape(n_rows, k)
+    order = np.argsort(-np.take_along_axis(probabilities, top, axis=1), axis=1, kind='stable')
+    return np.take_along_axis(top, order, axis=1)
+
+
+def ranked_crops(classes, probabilities, top):
+    """List ``{'crop', 'probability'}`` for the columns ``top`` of one probability row."""
+    return [{'crop': str(classes[j]), 'probability': float(probabilities[j])} for j in top]
+
+
+def parse_records(records):
+    """
+    Convert a list of samples into a float matrix.
+
+    Each sample is either a dict keyed by FEATURES or a list of seven numbers
+    in FEATURES order. Returns ``(matrix, errors)`` where rows that could not
+    be parsed are NaN and ``errors`` maps their index to a message.
+    """
+    matrix = np.full((len(records), len(FEATURES)), np.nan)
+    errors = {}
+    for i, record in enumerate(records):
+        try:
+            if isinstance(record, dict):
+                missing = [f for f in FEATURES if f not in record]
+                if missing:
+                    errors[i] = f'Missing required field: {missing[0]}'
+                    continue
+                values = [record[f] for f in FEATURES]
+            elif isinstance(record, (list, tuple)) and len(record) == len(FEATURES):
+                values = record
+            else:
+                errors[i] = f'Sample must be an object or a list of {len(FEATURES)} numbers'
+                continue
+            matrix[i] = [float(v) for v in values]
+        except (ValueError, TypeError):
+            errors[i] = 'Invalid value: all fields must be numbers'
+            matrix[i] = np.nan
+    return matrix, errors
+
+
+def validate_matrix(matrix, errors=None):
+    """
+    Check every row of ``matrix`` against VALIDATION_RANGES in one pass.
+
+    Returns ``(valid, errors)`` where ``valid`` is a boolean mask over rows and
+    ``errors`` maps each invalid row index to the message for its first bad
+    field. Rows already present in ``errors`` are kept as they are.
+    """
+    errors = dict(errors or {})
+    in_range = (matrix >= _LOWER) & (matrix <= _UPPER)
+    valid = in_range.all(axis=1)
+    for i in np.flatnonzero(~valid):
+        if i not in errors:
+            errors[int(i)] = range_error(FEATURES[int(np.argmin(in_range[i]))])
+    return valid, errors
+
+
+def parse_batch(data):
+    """
+    Validate a batch request body in one vectorized pass.
+
+    Accepts ``{"samples": [...]}`` or a bare list. Returns ``(matrix, valid,
+    errors)`` as from ``validate_matrix``; raises InvalidInput when there is
+    no list of samples or it is longer than ML_BATCH_MAX_SAMPLES.
+    """
+    samples = data.get('samples') if isinstance(data, dict) else data
+    if not isinstance(samples, list):
+        raise InvalidInput('Request must contain a list of samples')
+    if len(samples) > settings.ML_BATCH_MAX_SAMPLES:
+        raise InvalidInput(f'Batch is limited to {settings.ML_BATCH_MAX_SAMPLES} samples')
+    matrix, errors = parse_records(samples)
+    valid, errors = validate_matrix(matrix, errors)
+    return matrix, valid, errors
+
+
+def predict_batch(matrix, valid):
+    """
+    Predict the valid rows of ``matrix`` with the current model in one call.
+
+    Returns ``(bundle, rows, labels, probabilities)`` where ``rows`` are the
+    indexes of the valid rows.
+    """
+    with stage('load'):
+        bundle = get_model_bundle()
+    rows = np.flatnonzero(valid)
+    labels = probabilities = None
+    if len(rows):
+        labels, probabilities = predict_matrix(bundle, matrix[rows])
+    return bundle, rows, labels, probabilities
+
+
+def predict_matrix(bundle, matrix):
+    """
+    Scale and classify every row of ``matrix`` with one model call.
+
+    Returns ``(labels, probabilities)``; labels are taken from the argmax of
+    the probabilities, which is exactly what ``RandomForestClassifier.predict``
+    does internally. Small inputs use the flat-array forest when one is loaded;
+    when its thresholds have the scaler folded in, raw values go straight to it.
+    Both engines give identical results. A compact flat model loaded as the
+    model itself serves every input.
+    """
+    flat = bundle.flat
+    model = flat if flat is not None and (flat is bundle.model or len(matrix) <= FLAT_ENGINE_MAX_ROWS) else bundle.model
+    if model is flat and flat.folded:
+        X = matrix
+    else:
+        with stage('scale'):
+            X = bundle.scaler.transform(matrix)
+    with stage('predict_proba'):
+        probabilities = model.predict_proba(X)
+    labels = bundle.classes.take(np.argmax(probabilities, axis=1))
+    return labels, probabilities
+
+
+def predict_rows(matrix):
+    """Predict ``matrix`` with the current model; one ``(bundle, label, probabilities)`` per row."""
+    with stage('load'):
+        bundle = get_model_bundle()
+    labels, probabilities = predict_matrix(bundle, matrix)
+    return [(bundle, label, row) for label, row in zip(labels, probabilities)]
+
+
+def _predict_coalesced(matrix):
+    """``predict_rows`` on the coalescer's thread; every row carries the stage durations of its batch."""
+    rows, durations = collect_stages(predict_rows, matrix)
+    return [(row, durations) for row in rows]
+
+
+_coalescer = None
+_coalescer_lock = threading.Lock()
+
+
+def get_coalescer():
+    """Return this process's coalescer, or None when ML_COALESCE_ENABLED is off."""
+    global _coalescer
+    if not settings.ML_COALESCE_ENABLED:
+        return None
+    if _coalescer is None:
+        with _coalescer_lock:
+            if _coalescer is None:
+                _coalescer = RequestCoalescer(
+                    _predict_coalesced,
+                    window=settings.ML_COALESCE_WINDOW_MS / 1000.0,
+                    max_batch_size=settings.ML_COALESCE_MAX_BATCH,
+                )
+    return _coalescer
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_prediction_cache():
+    """Return this process's prediction cache, or None when ML_PREDICTION_CACHE_SIZE is 0."""
+    global _cache
+    if settings.ML_PREDICTION_CACHE_SIZE <= 0:
+        return None
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = PredictionCache(
+                    settings.ML_PREDICTION_CACHE_SIZE,
+                    ttl=settings.ML_PREDICTION_CACHE_TTL,
+                    decimals=[settings.ML_PREDICTION_CACHE_DECIMALS[f] for f in FEATURES],
+                )
+    return _cache
+
+
+def predict_sample(values):
+    """
+    Predict one sample given as FEATURES-ordered values.
+
+    Returns ``(bundle, label, probabilities)``. Raises FileNotFoundError when
+    the model artifacts are missing. With the prediction cache on, the
+    sample is predicted from its quantized cache key, so every input that
+    shares an entry gets the same answer whatever the order of requests.
+    """
+    cache = get_prediction_cache()
+    if cache is not None:
+        with stage('cache'):
+            version = get_model_bundle().version
+            key = cache.key(values)
+            result = cache.get(version, key)
+        if result is not None:
+            return result
+        values = list(key)
+
+    coalescer = get_coalescer()
+    if coalescer is not None:
+        result, durations = coalescer.predict(values)
+        add_stages(durations)
+    else:
+        result = predict_rows(np.array([values], dtype=np.float64))[0]
+
+    if cache is not None:
+        # Cached rows are shared between requests; make sure nobody edits them.
+        result[2].setflags(write=False)
+        cache.put(result[0].version, key, result)
+    return result
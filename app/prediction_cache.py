@@ -0,0 +1,86 @@
+"""
+Bounded LRU/TTL cache for single-sample predictions.
+
+Inputs are quantized to a per-feature number of decimals before they are
+used as a key, so near-identical soil readings share one entry. Every
+entry belongs to a model version; when the registry swaps in a new model
+the whole cache is dropped.
+"""
+
+import threading
+import time
+from collections import OrderedDict
+
+
+class PredictionCache:
+    """Thread-safe LRU cache with optional expiry and hit/miss counters."""
+
+    def __init__(self, maxsize, ttl=None, decimals=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.decimals = tuple(decimals or ())
+        self._entries = OrderedDict()
+        self._version = None
+        self._lock = threading.Lock()
+        self.hits = self.misses = self.evictions = self.expirations = self.invalidations = 0
+
+    def key(self, values):
+        """Quantize ``values`` to the configured decimals."""
+        if not self.decimals:
+            return tuple(float(v) for v in values)
+        return tuple(round(float(v), d) for v, d in zip(values, self.decimals))
+
+    def _check_version(self, version):
+        if version != self._version:
+            if self._entries:
+                self.invalidations += 1
+            self._entries.clear()
+            self._version = version
+
+    def get(self, version, key):
+        """Return the cached value for ``key`` under model ``version``, or None."""
+        with self._lock:
+            self._check_version(version)
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            value, expires = entry
+            if expires is not None and expires < time.monotonic():
+                del self._entries[key]
+                self.expirations += 1
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, version, key, value):
+        with self._lock:
+            self._check_version(version)
+            expires = time.monotonic() + self.ttl if self.ttl else None
+            self._entries[key] = (value, expires)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'size': len(self._entries),
+                'maxsize': self.maxsize,
+                'ttl': self.ttl,
+                'model_version': self._version,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+                'evictions': self.evictions,
+                'expirations': self.expirations,
+                'invalidations': self.invalidations,
+            }
@@ -0,0 +1,97 @@
+"""
+Model warm-up and the state reported by the readiness endpoint.
+
+A worker is ready once the current model bundle is loaded and a warm-up
+prediction has gone through both engines the views use (the flat forest
+for small inputs, sklearn for large batches), so the first real request
+pays no loading or first-call costs. ``warm_up`` runs when the WSGI or
+ASGI application is imported with ``ML_MODEL_PRELOAD`` (see ``preload``);
+otherwise the first readiness check starts it in a background thread and
+reports not ready until it has finished. A hot-swapped model makes the
+worker unready until the new version is warm.
+"""
+
+import logging
+import threading
+import time
+
+import numpy as np
+from django.conf import settings
+
+from .model_registry import get_model_bundle, get_registry
+from .prediction import FEATURES, FLAT_ENGINE_MAX_ROWS, VALIDATION_RANGES, predict_matrix
+
+logger = logging.getLogger(__name__)
+
+# Mid-range samples; one row more than the flat engine takes, so the batch runs through sklearn.
+WARMUP_ROWS = np.tile([sum(VALIDATION_RANGES[f]) / 2 for f in FEATURES], (FLAT_ENGINE_MAX_ROWS + 1, 1))
+
+_warmed = None  # (model version, warm-up seconds)
+_error = None
+_thread = None
+_lock = threading.Lock()
+
+
+def warm_up():
+    """Load the model if needed and run warm-up predictions on it; returns the bundle."""
+    global _warmed, _error
+    bundle = get_model_bundle()
+    if _warmed is None or _warmed[0] != bundle.version:
+        started = time.perf_counter()
+        predict_matrix(bundle, WARMUP_ROWS[:1])
+        predict_matrix(bundle, WARMUP_ROWS)
+        _warmed = (bundle.version, time.perf_counter() - started)
+        _error = None
+        logger.info('Warmed up crop model version %s in %.3fs', bundle.version, _warmed[1])
+    return bundle
+
+
+def preload():
+    """Load and warm up the model and the URLconf when ML_MODEL_PRELOAD is on; called by wsgi.py and asgi.py."""
+    if not settings.ML_MODEL_PRELOAD:
+        return
+    # Under ``gunicorn --preload`` this runs once in the master process and the
+    # forked workers share the loaded, warmed-up model, and the views with
+    # everything they import, copy-on-write. Without it every worker does this
+    # before taking requests, so workers only serve once they are ready.
+    from django.urls import get_resolver
+    get_resolver().url_patterns
+    warm_up()
+
+
+def _warm_up_in_background():
+    global _error, _thread
+    try:
+        warm_up()
+    except Exception as e:
+        logger.exception('Model warm-up failed')
+        _error = str(e)
+    finally:
+        _thread = None
+
+
+def readiness():
+    """
+    Return ``(ready, details)`` for this worker without blocking on the model.
+
+    Starts a background warm-up when the current model is not warm yet.
+    """
+    global _thread
+    bundle = get_registry().current
+    warmed = _warmed
+    if bundle is not None and warmed is not None and warmed[0] == bundle.version:
+        return True, {
+            'status': 'ready',
+            'model_version': bundle.version,
+            'loaded_at': bundle.loaded_at,
+            'load_seconds': bundle.load_seconds,
+            'warmup_seconds': warmed[1],
+        }
+    with _lock:
+        if _thread is None:
+            _thread = threading.Thread(target=_warm_up_in_background, name='model-warmup', daemon=True)
+            _thread.start()
+    details = {'status': 'warming up'}
+    if _error is not None:
+        details['error'] = _error
+    return False, details
@@ -0,0 +1,20 @@
+"""
+Process memory measurement for the training scripts and management commands.
+
+This module must not import Django: the training scripts use it too.
+"""
+
+import os
+import resource
+import sys
+
+
+def rss_bytes():
+    """Return the resident set size of this process in bytes."""
+    try:
+        with open('/proc/self/statm') as fh:
+            return int(fh.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        # No procfs (e.g. macOS): fall back to the peak RSS.
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == 'darwin' else peak * 1024
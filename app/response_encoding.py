@@ -0,0 +1,123 @@
+"""
+JSON encoding of prediction responses.
+
+A ``ResponseEncoder`` is built once per model version: it encodes the
+class names and the fixed parts of each result ahead of time into
+``%``-format templates, so encoding a row is a single string formatting
+call on ``probabilities.tolist()`` instead of a dict per row and a walk
+of the generic JSON encoder. Probabilities are rounded to
+``ML_RESPONSE_DECIMALS`` decimals for the whole matrix at once.
+
+Two layouts are available through ``?format=``:
+
+- ``object`` (default): ``"probabilities": {"apple": 0.01, ...}`` per
+  result, as the API has always returned.
+- ``array``: the class names are listed once in ``"classes"`` and each
+  result carries a plain list of probabilities in that order, with
+  ``input_data`` in FEATURES order and ``top_k`` as ``[crop, probability]``
+  pairs. Much smaller for batches.
+"""
+
+import json
+import threading
+
+import numpy as np
+from django.conf import settings
+
+from .prediction import FEATURES, InvalidInput, top_k_classes
+
+RESPONSE_FORMATS = ('object', 'array')
+
+_dumps = json.JSONEncoder(ensure_ascii=False, separators=(',', ':')).encode
+
+
+def parse_response_format(value):
+    """Return the requested response layout (``object`` when not given)."""
+    if not value:
+        return 'object'
+    if value not in RESPONSE_FORMATS:
+        raise InvalidInput(f'format must be one of: {", ".join(RESPONSE_FORMATS)}')
+    return value
+
+
+class ResponseEncoder:
+    """Encodes prediction results for one set of class names."""
+
+    def __init__(self, classes, decimals=6):
+        self.decimals = decimals
+        names = [_dumps(str(c)) for c in classes]
+        self.names = dict(zip((str(c) for c in classes), names))
+        self.name_list = names
+        number = f'%.{decimals}g'
+        # Rounded to ``decimals`` places, every probability fits in ``decimals``
+        # significant digits, so %g prints it exactly and without trailing zeros.
+        self.object_template = '{' + ','.join(f'{name}:{number}' for name in names) + '}'
+        self.array_template = '[' + ','.join([number] * len(names)) + ']'
+        self.pair_template = f'[%s,{number}]'
+        self.ranked_template = '{"crop":%s,"probability":' + number + '}'
+        self.classes_json = '[' + ','.join(names) + ']'
+
+    def round(self, probabilities):
+        return np.round(probabilities, self.decimals).tolist()
+
+    def probabilities(self, row, form):
+        return (self.object_template if form == 'object' else self.array_template) % tuple(row)
+
+    def ranked(self, row, top, form):
+        template = self.ranked_template if form == 'object' else self.pair_template
+        return '[' + ','.join(template % (self.name_list[c], row[c]) for c in top) + ']'
+
+    def sample(self, values, label, probabilities, top_k=None, form='object'):
+        """Encode the predict_crop_api response body for one sample."""
+        if form == 'object':
+            input_data = _dumps(dict(zip(FEATURES, values)))
+        else:
+            input_data = _dumps(list(values))
+        parts = ['{"prediction":', self.names[str(label)], ',"input_data":', input_data]
+        row = self.round(probabilities)
+        if top_k is None:
+            if form == 'array':
+                parts += [',"classes":', self.classes_json]
+            parts += [',"probabilities":', self.probabilities(row, form)]
+        else:
+            top = top_k_classes(probabilities, top_k)[0].tolist()
+            parts += [',"top_k":', self.ranked(row, top, form)]
+        parts.append('}')
+        return ''.join(parts)
+
+    def batch(self, n_samples, errors, rows, labels, probabilities, top_k=None, form='object'):
+        """Encode the predict_crop_batch_api response body; ``top_k`` and ``form`` as for ``sample``."""
+        results = [None] * n_samples
+        for i, error in errors.items():
+            results[i] = _dumps({'index': i, 'error': error})
+        if len(rows):
+            names = [self.names[str(label)] for label in labels]
+            matrix = self.round(probabilities)
+            if top_k is None:
+                template = (self.object_template if form == 'object' else self.array_template)
+                for i, name, row in zip(rows.tolist(), names, matrix):
+                    results[i] = f'{{"index":{i},"prediction":{name},"probabilities":{template % tuple(row)}}}'
+            else:
+                # Rank every row in one vectorized pass.
+                top = top_k_classes(probabilities, top_k).tolist()
+                for i, name, row, best in zip(rows.tolist(), names, matrix, top):
+                    results[i] = f'{{"index":{i},"prediction":{name},"top_k":{self.ranked(row, best, form)}}}'
+        classes = f'"classes":{self.classes_json},' if form == 'array' and top_k is None else ''
+        return f'{{"count":{n_samples},"errors":{len(errors)},{classes}"results":[{",".join(results)}]}}'
+
+
+_encoder = None
+_encoder_lock = threading.Lock()
+
+
+def get_encoder(bundle):
+    """Return the encoder for ``bundle``'s classes, built once per model version."""
+    global _encoder
+    encoder = _encoder
+    key = (bundle.version, settings.ML_RESPONSE_DECIMALS)
+    if encoder is None or encoder[0] != key:
+        with _encoder_lock:
+            encoder = _encoder
+            if encoder is None or encoder[0] != key:
+                encoder = _encoder = (key, ResponseEncoder(bundle.classes, settings.ML_RESPONSE_DECIMALS))
+    return encoder[1]
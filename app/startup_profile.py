@@ -0,0 +1,114 @@
+"""
+Import time and memory profile of a worker boot.
+
+Run as ``python -m app.startup_profile`` in a fresh interpreter (the
+``profile_startup`` management command does this). It times every module
+body as it executes and reads the RSS before and after, then boots the app
+in the same stages as a gunicorn worker: ``django.setup()``, the URLconf
+(which imports the views) and optionally the model. Time and memory spent
+in nested imports are subtracted from the importing module, so each
+module's figures are its own. The result is printed as JSON.
+
+Only the standard library and ``app.resource_usage`` are imported before
+the profiler is installed.
+"""
+
+import importlib.machinery
+import json
+import os
+import sys
+import time
+
+from app.resource_usage import rss_bytes
+
+STAGES = ('setup', 'urls', 'model')
+
+
+class ImportProfiler:
+    """Records own time and RSS growth of each module executed while installed."""
+
+    def __init__(self):
+        self.modules = {}
+        self._stack = []
+        self._originals = []
+
+    def install(self):
+        # Source and extension modules cover everything in site-packages.
+        for cls in (importlib.machinery.SourceFileLoader, importlib.machinery.ExtensionFileLoader):
+            original = cls.exec_module
+            self._originals.append((cls, original))
+            cls.exec_module = self._wrap(original)
+
+    def uninstall(self):
+        for cls, original in self._originals:
+            cls.exec_module = original
+        self._originals.clear()
+
+    def _wrap(self, exec_module):
+        profiler = self
+
+        def timed_exec_module(loader, module):
+            frame = [0.0, 0]  # time and RSS of nested imports
+            profiler._stack.append(frame)
+            started, rss = time.perf_counter(), rss_bytes()
+            try:
+                exec_module(loader, module)
+            finally:
+                seconds, grown = time.perf_counter() - started, rss_bytes() - rss
+                profiler._stack.pop()
+                if profiler._stack:
+                    profiler._stack[-1][0] += seconds
+                    profiler._stack[-1][1] += grown
+                profiler.modules[module.__name__] = (seconds - frame[0], grown - frame[1])
+        return timed_exec_module
+
+    def by_package(self):
+        """Sum the modules' own figures per top-level package."""
+        packages = {}
+        for name, (seconds, grown) in self.modules.items():
+            package = packages.setdefault(name.partition('.')[0], [0.0, 0, 0])
+            package[0] += seconds
+            package[1] += grown
+            package[2] += 1
+        return {name: {'seconds': s, 'rss_bytes': r, 'modules': n} for name, (s, r, n) in packages.items()}
+
+
+def boot(stage):
+    if stage == 'setup':
+        import django
+        django.setup()
+    elif stage == 'urls':
+        from django.urls import get_resolver
+        get_resolver().url_patterns
+    elif stage == 'model':
+        from app.model_registry import get_model_bundle
+        get_model_bundle()
+
+
+def profile(stages=STAGES):
+    """Boot through ``stages`` and return the profile."""
+    profiler = ImportProfiler()
+    started_rss = rss_bytes()
+    profiler.install()
+    results = []
+    try:
+        for stage in stages:
+            started, rss = time.perf_counter(), rss_bytes()
+            boot(stage)
+            results.append({'stage': stage, 'seconds': time.perf_counter() - started,
+                            'rss_bytes': rss_bytes() - rss})
+    finally:
+        profiler.uninstall()
+    return {
+        'python': sys.version.split()[0],
+        'interpreter_rss_bytes': started_rss,
+        'rss_bytes': rss_bytes(),
+        'stages': results,
+        'packages': profiler.by_package(),
+        'modules': {name: {'seconds': s, 'rss_bytes': r} for name, (s, r) in profiler.modules.items()},
+    }
+
+
+if __name__ == '__main__':
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'project2.settings')
+    json.dump(profile(sys.argv[1:] or STAGES), sys.stdout)
@@ -1,3 +1,905 @@
-from django.test import TestCase
+import io
+import json
+import os
+import shutil
+import tempfile
+import threading
+from unittest import mock
 
-# Create your tests here.
+import joblib
+import numpy as np
+import pandas as pd
+from django.conf import settings
+from django.core.management import CommandError, call_command
+from django.contrib.auth.models import Group, User
+from django.http import HttpResponse
+from django.test import LiveServerTestCase, TestCase, override_settings
+
+from .benchmark import compare
+from .bulk_scoring import iter_lines
+from .coalescer import RequestCoalescer
+from .flat_forest import FlatForest
+from .latency import Histogram, recorder
+from .lookup_grid import LookupGrid, agreement_report, build_grid
+from .model_registry import ModelRegistry
+from .models import Visitor
+from .prediction import predict_matrix, predict_rows, predict_sample, top_k_classes, validate_matrix
+from . import readiness
+from .prediction_cache import PredictionCache
+from .response_encoding import ResponseEncoder
+
+
+def load_dataset():
+    df = pd.read_csv(os.path.join(settings.BASE_DIR, 'Machine Learning', 'Crop_recommendation.csv'))
+    return df[['N', 'P', 'K', 'temperature', 'humidity', 'ph', 'rainfall']].to_numpy(dtype=float)
+
+
+class ModelRegistryTests(TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmpdir)
+        self.model_path = os.path.join(self.tmpdir, 'crop_model.joblib')
+        self.scaler_path = os.path.join(self.tmpdir, 'scaler.joblib')
+        self.flat_path = os.path.join(self.tmpdir, 'crop_model_flat.npz')
+        shutil.copy(settings.ML_MODEL_PATH, self.model_path)
+        shutil.copy(settings.ML_SCALER_PATH, self.scaler_path)
+        shutil.copy(settings.ML_FLAT_MODEL_PATH, self.flat_path)
+
+    def registry(self, **kwargs):
+        return ModelRegistry(self.model_path, self.scaler_path, self.flat_path, check_interval=0, **kwargs)
+
+    def test_loads_once_per_process(self):
+        registry = self.registry()
+        first = registry.get()
+        self.assertIs(registry.get(), first)
+        self.assertEqual(set(first.checksums), {'model', 'scaler', 'flat'})
+        self.assertIsNotNone(first.flat)
+
+    def test_hot_swaps_when_artifacts_change(self):
+        registry = self.registry()
+        old = registry.get()
+        with open(self.scaler_path, 'ab') as fh:
+            fh.write(b'\0')
+        new = registry.get()
+        self.assertIsNot(new, old)
+        self.assertNotEqual(new.version, old.version)
+        # Requests holding the old bundle still have a complete model.
+        self.assertIsNotNone(old.model)
+
+    def test_keeps_serving_when_reload_fails(self):
+        registry = self.registry()
+        old = registry.get()
+        with open(self.model_path, 'wb') as fh:
+            fh.write(b'partial')
+        with self.assertLogs('app.model_registry', 'ERROR'):
+            self.assertIs(registry.get(), old)
+
+    def test_waits_for_both_halves_of_a_model_update(self):
+        from sklearn.ensemble import RandomForestClassifier
+
+        registry = self.registry()
+        old = registry.get()
+        df = pd.read_csv(os.path.join(settings.BASE_DIR, 'Machine Learning', 'Crop_recommendation.csv'))
+        model = RandomForestClassifier(n_estimators=3, random_state=0).fit(old.scaler.transform(load_dataset()),
+                                                                           df['label'].to_numpy())
+        FlatForest.from_sklearn(model).fold_scaler(old.scaler).save(self.flat_path)
+        with self.assertLogs('app.model_registry', 'ERROR'):
+            self.assertIs(registry.get(), old)
+        joblib.dump(model, self.model_path)
+        self.assertEqual(registry.get().model.n_estimators, 3)
+
+    def test_first_load_waits_for_a_model_update_to_finish(self):
+        from sklearn.ensemble import RandomForestClassifier
+        from .model_registry import ModelMismatchError
+
+        scaler = joblib.load(self.scaler_path)
+        df = pd.read_csv(os.path.join(settings.BASE_DIR, 'Machine Learning', 'Crop_recommendation.csv'))
+        model = RandomForestClassifier(n_estimators=3, random_state=0).fit(scaler.transform(load_dataset()),
+                                                                           df['label'].to_numpy())
+        # Half-published: the new flat export next to the old model.
+        FlatForest.from_sklearn(model).fold_scaler(scaler).save(self.flat_path)
+        with mock.patch('app.model_registry.MISMATCH_DELAY', 0), self.assertLogs('app.model_registry', 'WARNING'):
+            with self.assertRaises(ModelMismatchError):
+                self.registry().get()
+        joblib.dump(model, self.model_path + '.new')
+        publish = threading.Timer(0.1, os.replace, (self.model_path + '.new', self.model_path))
+        publish.start()
+        self.addCleanup(publish.cancel)
+        with self.assertLogs('app.model_registry', 'WARNING'):
+            self.assertEqual(self.registry().get().model.n_estimators, 3)
+
+    def test_missing_artifacts_raise(self):
+        registry = ModelRegistry(os.path.join(self.tmpdir, 'missing.joblib'), self.scaler_path, self.flat_path)
+        with self.assertRaises(FileNotFoundError):
+            registry.get()
+
+    def wait_for_warm_up(self):
+        thread = readiness._thread
+        if thread is not None:
+            thread.join()
+
+    def test_readiness_waits_for_warm_up_of_each_version(self):
+        registry = self.registry()
+        with mock.patch.object(readiness, 'get_registry', return_value=registry), \
+                mock.patch.object(readiness, 'get_model_bundle', registry.get), \
+                mock.patch.object(readiness, '_warmed', None):
+            self.assertEqual(self.client.get('/health/').json(), {'status': 'ok'})
+            self.assertEqual(self.client.get('/health/ready/').status_code, 503)
+            self.wait_for_warm_up()
+            body = self.client.get('/health/ready/').json()
+            self.assertEqual(body['model_version'], registry.current.version)
+            self.assertGreater(body['load_seconds'], 0)
+            with open(self.scaler_path, 'ab') as fh:
+                fh.write(b'\0')
+            registry.get()
+            self.assertEqual(self.client.get('/health/ready/').status_code, 503)
+            self.wait_for_warm_up()
+            self.assertEqual(self.client.get('/health/ready/').status_code, 200)
+
+
+SAMPLE = {
+    'nitrogen': 90, 'phosphorus': 42, 'potassium': 43, 'temperature': 20.88,
+    'humidity': 82.0, 'ph': 6.5, 'rainfall': 202.9,
+}
+
+
+class PredictCropBatchApiTests(TestCase):
+    url = '/api/predict-crop/batch/'
+
+    def post(self, payload):
+        return self.client.post(self.url, json.dumps(payload), content_type='application/json')
+
+    def test_matches_single_endpoint(self):
+        single = self.client.post('/api/predict-crop/', json.dumps(SAMPLE), content_type='application/json').json()
+        row = list(SAMPLE.values())
+        batch = self.post({'samples': [SAMPLE, row]}).json()
+        self.assertEqual(batch['count'], 2)
+        self.assertEqual(batch['errors'], 0)
+        for result in batch['results']:
+            self.assertEqual(result['prediction'], single['prediction'])
+            for crop, probability in single['probabilities'].items():
+                self.assertAlmostEqual(result['probabilities'][crop], probability)
+
+    def test_invalid_rows_do_not_fail_the_batch(self):
+        samples = [SAMPLE, dict(SAMPLE, ph=12), {'nitrogen': 1}, dict(SAMPLE, rainfall='lots')]
+        response = self.post(samples)
+        self.assertEqual(response.status_code, 200)
+        results = response.json()['results']
+        self.assertIn('prediction', results[0])
+        self.assertEqual(results[1]['error'], 'Ph must be between 3.5 and 9.9')
+        self.assertEqual(results[2]['error'], 'Missing required field: phosphorus')
+        self.assertIn('error', results[3])
+        self.assertEqual(response.json()['errors'], 3)
+
+    def test_rejects_non_list_payload(self):
+        self.assertEqual(self.post({'samples': 'nope'}).status_code, 400)
+
+
+class RequestCoalescerTests(TestCase):
+    def test_concurrent_rows_share_a_batch(self):
+        coalescer = RequestCoalescer(predict_rows, window=0.2, max_batch_size=8)
+        samples = [dict(SAMPLE, nitrogen=n) for n in range(0, 80, 10)]
+        results = [None] * len(samples)
+
+        def worker(i):
+            results[i] = coalescer.predict(list(samples[i].values()))
+
+        threads = [threading.Thread(target=worker, args=(i,)) for i in range(len(samples))]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+        self.assertLess(coalescer.stats()['batches'], len(samples))
+        expected = predict_rows(np.array([list(s.values()) for s in samples], dtype=float))
+        for (_, label, probabilities), (_, want_label, want_probabilities) in zip(results, expected):
+            self.assertEqual(label, want_label)
+            np.testing.assert_allclose(probabilities, want_probabilities)
+
+    def test_errors_reach_every_caller(self):
+        def broken(matrix):
+            raise FileNotFoundError('crop_model.joblib')
+
+        coalescer = RequestCoalescer(broken, window=0)
+        with self.assertRaises(FileNotFoundError):
+            coalescer.predict(list(SAMPLE.values()))
+
+    @override_settings(ML_COALESCE_ENABLED=True)
+    def test_api_contract_unchanged_when_enabled(self):
+        response = self.client.post('/api/predict-crop/', json.dumps(SAMPLE), content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['prediction'], 'rice')
+
+
+class FlatForestTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.model = joblib.load(settings.ML_MODEL_PATH)
+        cls.scaler = joblib.load(settings.ML_SCALER_PATH)
+        cls.raw = load_dataset()
+        cls.X = cls.scaler.transform(cls.raw)
+
+    def assert_equivalent(self, flat, X, scaled=None):
+        scaled = X if scaled is None else scaled
+        np.testing.assert_array_equal(flat.predict_proba(X), self.model.predict_proba(scaled))
+        np.testing.assert_array_equal(flat.predict(X), self.model.predict(scaled))
+
+    def test_exported_artifact_matches_sklearn_on_full_dataset(self):
+        flat = FlatForest.load(settings.ML_FLAT_MODEL_PATH)
+        self.assertTrue(flat.folded)
+        self.assert_equivalent(flat, self.raw, self.X)
+
+    def test_single_rows_match_sklearn(self):
+        flat = FlatForest.from_sklearn(self.model)
+        for row in self.X[::100]:
+            self.assert_equivalent(flat, row.reshape(1, -1))
+
+    def test_save_and_load_round_trip(self):
+        flat = FlatForest.from_sklearn(self.model)
+        path = os.path.join(tempfile.mkdtemp(), 'flat.npz')
+        self.addCleanup(shutil.rmtree, os.path.dirname(path))
+        flat.save(path)
+        self.assert_equivalent(FlatForest.load(path), self.X[:500])
+
+    def test_memory_mapped_load_matches(self):
+        flat = FlatForest.load(settings.ML_FLAT_MODEL_PATH, mmap=True)
+        self.assertIsInstance(flat.value.base, np.memmap)
+        self.assertFalse(flat.value.flags.writeable)
+        self.assert_equivalent(flat, self.raw, self.X)
+        bundle = ModelRegistry(model_path=settings.ML_FLAT_MODEL_PATH, check_interval=-1, mmap=True).get()
+        np.testing.assert_array_equal(predict_matrix(bundle, self.raw)[0], self.model.predict(self.X))
+
+    def test_folded_scaler_is_exact_at_split_boundaries(self):
+        folded = FlatForest.from_sklearn(self.model).fold_scaler(self.scaler)
+        rows = np.arange(len(folded.threshold))
+        base = self.raw[rows % len(self.raw)]
+        for direction in (-np.inf, None, np.inf):
+            values = folded.threshold if direction is None else np.nextafter(folded.threshold, direction)
+            X = base.copy()
+            X[rows, folded.feature] = values
+            self.assert_equivalent(folded, X, self.scaler.transform(X))
+
+    def test_quantized_thresholds_route_float32_inputs_exactly(self):
+        # Every leaf of this forest is pure, so unpruned quantization changes nothing.
+        compact = FlatForest.from_sklearn(self.model).quantize()
+        self.assertEqual(compact.threshold.dtype, np.float32)
+        self.assertEqual(compact.value.dtype, np.uint8)
+        self.assert_equivalent(compact, self.X)
+
+    def test_pruning_shrinks_the_forest(self):
+        full = FlatForest.from_sklearn(self.model)
+        pruned = FlatForest.from_sklearn(self.model, purity=0.8)
+        self.assertLess(len(pruned.value), len(full.value))
+        probabilities = pruned.predict_proba(self.X)
+        np.testing.assert_allclose(probabilities.sum(axis=1), 1.0)
+        self.assertGreater((pruned.predict(self.X) == self.model.predict(self.X)).mean(), 0.99)
+
+    def test_registry_serves_a_compact_model(self):
+        tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmpdir)
+        path = os.path.join(tmpdir, 'compact.npz')
+        FlatForest.from_sklearn(self.model, purity=0.9).fold_scaler(self.scaler).quantize().save(path)
+        bundle = ModelRegistry(model_path=path, check_interval=-1).get()
+        self.assertIsNone(bundle.scaler)
+        labels, _ = predict_matrix(bundle, self.raw)
+        np.testing.assert_array_equal(labels, bundle.flat.predict(self.raw))
+        self.assertGreater((labels == self.model.predict(self.X)).mean(), 0.99)
+
+
+class PredictionCacheTests(TestCase):
+    def test_quantized_keys_share_an_entry(self):
+        cache = PredictionCache(10, decimals=[0, 1])
+        cache.put('v1', cache.key([90.2, 20.84]), 'rice')
+        self.assertEqual(cache.get('v1', cache.key([89.9, 20.81])), 'rice')
+        self.assertIsNone(cache.get('v1', cache.key([91, 20.8])))
+        self.assertEqual((cache.hits, cache.misses), (1, 1))
+
+    def test_lru_eviction(self):
+        cache = PredictionCache(2)
+        for i in range(3):
+            cache.put('v1', (i,), i)
+        self.assertIsNone(cache.get('v1', (0,)))
+        self.assertEqual(cache.get('v1', (2,)), 2)
+        self.assertEqual(cache.evictions, 1)
+
+    def test_new_model_version_invalidates(self):
+        cache = PredictionCache(10)
+        cache.put('v1', (1,), 'rice')
+        self.assertIsNone(cache.get('v2', (1,)))
+        self.assertEqual(cache.stats()['invalidations'], 1)
+
+    def test_entries_expire(self):
+        cache = PredictionCache(10, ttl=-1)
+        cache.put('v1', (1,), 'rice')
+        self.assertIsNone(cache.get('v1', (1,)))
+        self.assertEqual(cache.expirations, 1)
+
+    @override_settings(ML_PREDICTION_CACHE_SIZE=100)
+    def test_cached_answer_does_not_depend_on_request_order(self):
+        first, second = [90.2, 42, 43, 20.84, 82.0, 6.5, 202.9], [89.9, 42, 43, 20.81, 82.0, 6.5, 202.9]
+        answers = []
+        for order in ([first, second], [second, first]):
+            with mock.patch('app.prediction._cache', None):
+                answers.append([predict_sample(values)[2] for values in order])
+        expected = predict_rows(np.array([[90, 42, 43, 20.8, 82.0, 6.5, 202.9]]))[0][2]
+        for probabilities in answers[0] + answers[1]:
+            np.testing.assert_array_equal(probabilities, expected)
+
+    @override_settings(ML_PREDICTION_CACHE_SIZE=100)
+    def test_stats_are_admin_only(self):
+        url = '/api/prediction-cache/'
+        self.assertEqual(self.client.get(url).status_code, 302)
+        admin = User.objects.create_user('cacheadmin', password='x')
+        Group.objects.get_or_create(name='ADMIN')[0].user_set.add(admin)
+        self.client.force_login(admin)
+        self.client.post('/api/predict-crop/', json.dumps(SAMPLE), content_type='application/json')
+        self.client.post('/api/predict-crop/', json.dumps(SAMPLE), content_type='application/json')
+        stats = self.client.get(url).json()
+        self.assertTrue(stats['enabled'])
+        self.assertGreaterEqual(stats['hits'], 1)
+
+
+class LookupGridTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.bundle = ModelRegistry(check_interval=-1).get()
+        cls.cells = build_grid(cls.bundle, [3] * 7)
+
+    def test_report_counts_grid_answers(self):
+        grid = LookupGrid(self.cells, self.bundle.classes, self.bundle.version)
+        report = agreement_report(grid, self.bundle, load_dataset())
+        self.assertEqual(report['samples'], 2200)
+        self.assertGreater(report['grid_hit_rate'], 0)
+        self.assertGreaterEqual(report['agreement_with_fallback'], report['agreement_on_hits'] * report['grid_hit_rate'])
+
+    def test_ambiguous_cells_fall_back_to_the_model(self):
+        cells = build_grid(self.bundle, [2] * 7, min_confidence=1.1)
+        grid = LookupGrid(cells, self.bundle.classes, self.bundle.version)
+        self.assertIsNone(grid.lookup(load_dataset()[0]))
+        report = agreement_report(grid, self.bundle, load_dataset())
+        self.assertEqual((report['grid_hit_rate'], report['agreement_with_fallback']), (0.0, 1.0))
+
+    def test_save_and_memory_map(self):
+        path = os.path.join(tempfile.mkdtemp(), 'grid')
+        self.addCleanup(shutil.rmtree, os.path.dirname(path))
+        LookupGrid.save(path, self.cells, self.bundle.classes, self.bundle.version)
+        grid = LookupGrid.load(path)
+        self.assertIsInstance(grid.cells, np.memmap)
+        np.testing.assert_array_equal(grid.cells, self.cells)
+
+    def test_out_of_range_values_are_clipped_to_the_edge_cells(self):
+        grid = LookupGrid(self.cells, self.bundle.classes, self.bundle.version)
+        np.testing.assert_array_equal(grid.cell_index([[-5] * 7, [1e6] * 7]), [[0] * 7, [2] * 7])
+
+
+class PredictCropBulkApiTests(TestCase):
+    url = '/api/predict-crop/bulk/'
+
+    def stream(self, body, content_type, query=''):
+        response = self.client.post(self.url + query, body, content_type=content_type)
+        return response, b''.join(response.streaming_content).decode()
+
+    def test_scores_the_dataset_csv(self):
+        with open(settings.ML_DATASET_PATH, 'rb') as fh:
+            body = fh.read()
+        response, output = self.stream(body, 'text/csv', '?format=csv')
+        self.assertEqual(response['Content-Type'], 'text/csv')
+        lines = output.splitlines()
+        self.assertEqual(lines[0], 'row,prediction,probability,error')
+        self.assertEqual(len(lines), 2201)
+        # A few dataset rows sit just outside the validation ranges and come back as errors.
+        bundle = ModelRegistry(check_interval=-1).get()
+        dataset = load_dataset()
+        valid, _ = validate_matrix(dataset)
+        expected = np.where(valid, bundle.model.predict(bundle.scaler.transform(dataset)), '')
+        self.assertEqual([line.split(',')[1] for line in lines[1:]], list(expected))
+
+    def test_ndjson_rows_fail_independently(self):
+        body = '\n'.join([json.dumps(SAMPLE), '{"nitrogen": 1}', 'not json', json.dumps(list(SAMPLE.values()))])
+        _, output = self.stream(body, 'application/x-ndjson')
+        results = [json.loads(line) for line in output.splitlines()]
+        self.assertEqual([r['row'] for r in results], [0, 1, 2, 3])
+        self.assertEqual(results[0]['prediction'], 'rice')
+        self.assertEqual(results[1]['error'], 'Missing required field: phosphorus')
+        self.assertEqual(results[2]['error'], 'Invalid record')
+        self.assertEqual(results[3]['prediction'], 'rice')
+
+    def test_rejects_csv_without_feature_columns(self):
+        response = self.client.post(self.url, 'a,b\n1,2\n', content_type='text/csv')
+        self.assertEqual(response.status_code, 400)
+
+    def test_lines_split_across_read_chunks(self):
+        text = 'N,P\r\n1,2\n\u00e9,3'
+        lines = list(iter_lines(io.BytesIO(text.encode()), chunk_size=3))
+        self.assertEqual(lines, ['N,P', '1,2', '\u00e9,3'])
+
+
+class AsyncPredictionApiTests(TestCase):
+    async def post(self, url, payload):
+        return await self.async_client.post(url, json.dumps(payload), content_type='application/json')
+
+    async def test_single_matches_sync_endpoint(self):
+        response = await self.post('/api/async/predict-crop/', SAMPLE)
+        self.assertEqual(response.status_code, 200)
+        sync = await self.post('/api/predict-crop/', SAMPLE)
+        self.assertEqual(response.json(), sync.json())
+
+    async def test_batch_matches_sync_endpoint(self):
+        samples = [SAMPLE, dict(SAMPLE, ph=12), list(SAMPLE.values()), {'nitrogen': 1}]
+        response = await self.post('/api/async/predict-crop/batch/', samples)
+        sync = await self.post('/api/predict-crop/batch/', samples)
+        self.assertEqual(response.json(), sync.json())
+
+    async def test_errors_match_sync_endpoint(self):
+        for payload in (dict(SAMPLE, ph=12), {'nitrogen': 1}, dict(SAMPLE, rainfall='lots'), [SAMPLE]):
+            response = await self.post('/api/async/predict-crop/', payload)
+            sync = await self.post('/api/predict-crop/', payload)
+            self.assertEqual(response.status_code, 400)
+            self.assertEqual(response.json(), sync.json())
+
+    async def test_only_post_is_allowed(self):
+        response = await self.async_client.get('/api/async/predict-crop/')
+        self.assertEqual(response.status_code, 405)
+
+
+class TopKTests(TestCase):
+    def test_matches_a_stable_full_sort(self):
+        rng = np.random.default_rng(0)
+        # Rounded so that ties, including at the cut-off, are common.
+        probabilities = np.round(rng.dirichlet(np.full(22, 0.3), size=500), 2)
+        for k in (1, 3, 22, 30):
+            expected = np.argsort(-probabilities, axis=1, kind='stable')[:, :k]
+            np.testing.assert_array_equal(top_k_classes(probabilities, k), expected)
+        np.testing.assert_array_equal(top_k_classes(probabilities, 1)[:, 0], probabilities.argmax(axis=1))
+
+    def test_single_endpoint_returns_ranked_crops(self):
+        full = self.client.post('/api/predict-crop/', json.dumps(SAMPLE), content_type='application/json').json()
+        response = self.client.post('/api/predict-crop/?top_k=3', json.dumps(SAMPLE), content_type='application/json')
+        body = response.json()
+        self.assertNotIn('probabilities', body)
+        self.assertEqual(len(body['top_k']), 3)
+        self.assertEqual(body['top_k'][0]['crop'], body['prediction'])
+        expected = sorted(full['probabilities'].items(), key=lambda item: -item[1])[:3]
+        self.assertEqual([c['probability'] for c in body['top_k']], [p for _, p in expected])
+
+    def test_batch_endpoint_ranks_every_row(self):
+        samples = [SAMPLE, dict(SAMPLE, ph=12), dict(SAMPLE, rainfall=60, humidity=60)]
+        body = self.client.post('/api/predict-crop/batch/?top_k=2', json.dumps(samples),
+                                content_type='application/json').json()
+        for result in (body['results'][0], body['results'][2]):
+            self.assertEqual([c['crop'] for c in result['top_k']][:1], [result['prediction']])
+            self.assertGreaterEqual(result['top_k'][0]['probability'], result['top_k'][1]['probability'])
+        self.assertIn('error', body['results'][1])
+
+    def test_rejects_invalid_top_k(self):
+        for value in ('0', 'many'):
+            response = self.client.post(f'/api/predict-crop/?top_k={value}', json.dumps(SAMPLE),
+                                        content_type='application/json')
+            self.assertEqual(response.status_code, 400)
+
+    def test_visitor_page_lists_recommendations(self):
+        visitor = User.objects.create_user('topkvisitor', password='x')
+        Group.objects.get_or_create(name='VISITOR')[0].user_set.add(visitor)
+        self.client.force_login(visitor)
+        # visitor_home.html links to pages this tree does not have, so check the context only.
+        with mock.patch('app.views.render', return_value=HttpResponse()) as render:
+            self.client.post('/visitor_find_crop', dict(SAMPLE, top_k=3))
+        context = render.call_args[0][2]
+        self.assertEqual(context['result'], 'The predicted crop is rice')
+        self.assertEqual([c['crop'] for c in context['recommendations']][:1], ['rice'])
+        self.assertEqual(len(context['recommendations']), 3)
+
+
+class ResponseEncodingTests(TestCase):
+    def test_matches_the_generic_encoder_after_rounding(self):
+        classes = np.array(['apple', 'banana', 'caf\u00e9 "bean"'])
+        probabilities = np.array([[0.123456789, 0.876543211, 0.0], [1 / 3, 1 / 3, 1 / 3]])
+        encoder = ResponseEncoder(classes, decimals=4)
+        body = json.loads(encoder.batch(3, {1: 'bad row'}, np.array([0, 2]), ['banana', 'apple'], probabilities))
+        self.assertEqual(body['results'][1], {'index': 1, 'error': 'bad row'})
+        self.assertEqual(body['results'][0]['probabilities'], {'apple': 0.1235, 'banana': 0.8765, 'caf\u00e9 "bean"': 0})
+        self.assertEqual(body['results'][2]['probabilities']['apple'], 0.3333)
+        compact = json.loads(encoder.batch(3, {}, np.array([0, 1, 2]), ['banana'] * 3, probabilities[[0, 1, 1]],
+                                           form='array'))
+        self.assertEqual(compact['classes'], classes.tolist())
+        self.assertEqual(compact['results'][0]['probabilities'], [0.1235, 0.8765, 0])
+
+    def test_array_format_of_the_api(self):
+        full = self.client.post('/api/predict-crop/', json.dumps(SAMPLE), content_type='application/json').json()
+        body = self.client.post('/api/predict-crop/?format=array', json.dumps(SAMPLE),
+                                content_type='application/json').json()
+        self.assertEqual(body['input_data'], list(full['input_data'].values()))
+        self.assertEqual(dict(zip(body['classes'], body['probabilities'])), full['probabilities'])
+        ranked = self.client.post('/api/predict-crop/batch/?format=array&top_k=2', json.dumps([SAMPLE]),
+                                  content_type='application/json').json()
+        self.assertEqual(ranked['results'][0]['top_k'][0][0], full['prediction'])
+        response = self.client.post('/api/predict-crop/?format=xml', json.dumps(SAMPLE), content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+
+
+class LatencyTests(TestCase):
+    def setUp(self):
+        recorder.clear()
+        self.addCleanup(recorder.clear)
+
+    def predict(self, url='/api/predict-crop/', payload=SAMPLE):
+        return self.client.post(url, json.dumps(payload), content_type='application/json')
+
+    @override_settings(ML_LATENCY_ENABLED=True, ML_LATENCY_SERVER_TIMING=True, ML_PREDICTION_CACHE_SIZE=0)
+    def test_stages_are_recorded_and_sent(self):
+        response = self.predict()
+        stages = [part.split(';')[0] for part in response['Server-Timing'].split(', ')]
+        for name in ('parse', 'validate', 'load', 'predict_proba', 'predict', 'serialize', 'total'):
+            self.assertIn(name, stages)
+        self.predict('/api/predict-crop/batch/', [SAMPLE] * 100)
+        stats = recorder.stats()
+        self.assertEqual(stats['total']['count'], 2)
+        self.assertEqual(stats['scale']['count'], 1)
+        self.assertEqual(sum(count for _, count in stats['parse']['buckets']), 2)
+
+    @override_settings(ML_LATENCY_ENABLED=True, ML_COALESCE_ENABLED=True)
+    def test_coalesced_stages_are_recorded(self):
+        self.predict()
+        stats = recorder.stats()
+        for name in ('load', 'predict_proba', 'total'):
+            self.assertEqual(stats[name]['count'], 1)
+
+    @override_settings(ML_LATENCY_ENABLED=True)
+    def test_server_timing_header_is_optional(self):
+        self.assertNotIn('Server-Timing', self.predict())
+        self.assertEqual(recorder.stats()['total']['count'], 1)
+
+    def test_nothing_is_recorded_when_disabled(self):
+        self.assertNotIn('Server-Timing', self.predict())
+        self.assertEqual(recorder.stats(), {})
+
+    @override_settings(ML_LATENCY_ENABLED=True)
+    def test_stats_are_admin_only(self):
+        url = '/api/latency/'
+        self.assertEqual(self.client.get(url).status_code, 302)
+        admin = User.objects.create_user('latencyadmin', password='x')
+        Group.objects.get_or_create(name='ADMIN')[0].user_set.add(admin)
+        self.client.force_login(admin)
+        self.predict()
+        self.assertEqual(self.client.get(url).json()['stages']['total']['count'], 1)
+
+    def test_histogram_quantiles(self):
+        histogram = Histogram(bounds=(1, 10, 100))
+        for ms in (0.5, 0.7, 5, 50, 500):
+            histogram.add(ms)
+        self.assertEqual(histogram.counts, [2, 1, 1, 1])
+        self.assertEqual(histogram.quantile(0.4), 1)
+        self.assertEqual(histogram.quantile(0.5), 10)
+        self.assertEqual(histogram.quantile(1.0), 500)
+
+
+class BenchmarkTests(TestCase):
+    def test_compare_flags_only_regressions_beyond_tolerance(self):
+        baseline = {'flat/1': {'p50_ms': 1.0, 'peak_bytes': 1000}, 'flat/32': {'p50_ms': 2.0}}
+        cases = {'flat/1': {'p50_ms': 1.2, 'peak_bytes': 2000}, 'flat/32': {'p50_ms': 1.0}, 'new/1': {'p50_ms': 9.0}}
+        regressions = compare(cases, baseline, tolerance=0.25)
+        self.assertEqual(len(regressions), 1)
+        self.assertTrue(regressions[0].startswith('flat/1 peak_bytes'))
+
+    def test_command_saves_and_checks_a_baseline(self):
+        tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmpdir)
+        output, baseline = os.path.join(tmpdir, 'results.json'), os.path.join(tmpdir, 'baseline.json')
+        options = dict(engines=['flat', 'serving'], sizes=[1, 32], threads=2, min_time=0.01,
+                       output=output, baseline=baseline, stdout=io.StringIO(), stderr=io.StringIO())
+        call_command('benchmark_inference', save_baseline=True, **options)
+        with open(baseline) as fh:
+            stored = json.load(fh)
+        self.assertEqual(set(stored['cases']), {'flat/1', 'flat/32', 'flat/concurrent-2',
+                                                'serving/1', 'serving/32', 'serving/concurrent-2'})
+        call_command('benchmark_inference', tolerance=100, **options)
+        for case in stored['cases'].values():
+            case['p50_ms'] /= 1000
+        with open(baseline, 'w') as fh:
+            json.dump(stored, fh)
+        with self.assertRaises(CommandError):
+            call_command('benchmark_inference', **options)
+
+
+class LoadTestTests(LiveServerTestCase):
+    def test_harness_logs_in_and_predicts_against_a_live_server(self):
+        call_command('create_visitors', count=2, password='secret-pass', stdout=io.StringIO())
+        self.assertEqual(Visitor.objects.filter(status=True, user__groups__name='VISITOR').count(), 2)
+        output = os.path.join(tempfile.mkdtemp(), 'load_test.json')
+        self.addCleanup(shutil.rmtree, os.path.dirname(output))
+        call_command('load_test', url=self.live_server_url, concurrency=[1], duration=1, warmup=0,
+                     mix='api=3,login=1', password='secret-pass', output=output, stdout=io.StringIO())
+        with open(output) as fh:
+            endpoints = json.load(fh)['levels'][0]['endpoints']
+        self.assertGreater(endpoints['login']['requests'], 0)
+        self.assertEqual(endpoints['login']['errors'], 0)
+        self.assertEqual(endpoints['api']['errors'], 0)
+        self.assertEqual(sum(count for _, count in endpoints['api']['histogram']), endpoints['api']['requests'])
+
+    def test_rejects_unknown_endpoints_in_the_mix(self):
+        with self.assertRaises(CommandError):
+            call_command('load_test', url=self.live_server_url, mix='api=1,checkout=2')
+
+
+class StartupProfileTests(TestCase):
+    def test_worker_boot_does_not_import_the_ml_stack(self):
+        out = io.StringIO()
+        call_command('profile_startup', json=True, stdout=out)
+        profile = json.loads(out.getvalue())
+        self.assertEqual([stage['stage'] for stage in profile['stages']], ['setup', 'urls'])
+        self.assertIn('app.views', profile['modules'])
+        for package in ('pandas', 'sklearn', 'scipy', 'joblib'):
+            self.assertNotIn(package, profile['packages'])
+
+
+class TrainingCacheTests(TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        X = load_dataset()
+        self.X, self.y = X[:600], np.array(['a', 'b', 'c'] * 200)
+
+    def test_reuses_fits_until_anything_in_the_key_changes(self):
+        from sklearn.tree import DecisionTreeClassifier
+        from .training_cache import TrainingCache, fit_and_evaluate
+
+        cache = TrainingCache(self.directory, context={'features': ['N']})
+        model = DecisionTreeClassifier(random_state=0)
+        first = fit_and_evaluate(model, self.X[:500], self.y[:500], self.X[500:], self.y[500:], cache=cache)
+        again = fit_and_evaluate(model, self.X[:500], self.y[:500], self.X[500:], self.y[500:], cache=cache)
+        self.assertFalse(first['cached'])
+        self.assertTrue(again['cached'])
+        np.testing.assert_array_equal(again['predictions'], first['predictions'])
+        np.testing.assert_array_equal(again['model'].predict(self.X), first['model'].predict(self.X))
+        self.assertIsNotNone(cache.source(again['model']))
+        base = cache.key(model, self.X, self.y)
+        self.assertNotEqual(cache.key(DecisionTreeClassifier(random_state=1), self.X, self.y), base)
+        self.assertNotEqual(cache.key(model, self.X, self.y[::-1]), base)
+        self.assertNotEqual(TrainingCache(self.directory, context={'features': ['P']}).key(model, self.X, self.y), base)
+
+    def test_evicts_by_age_then_least_recently_used(self):
+        from .training_cache import TrainingCache
+
+        cache = TrainingCache(self.directory)
+        for i in range(4):
+            cache.put(f'{i:064x}', predictions=np.zeros(10000), accuracy=1.0)
+            os.utime(cache.path(f'{i:064x}'), (1000 + i, 1000 + i))
+        os.utime(cache.path(f'{3:064x}'))  # used just now
+        cache.get(f'{2:064x}')
+        self.assertEqual(cache.evict(max_age=3600)[0], 2)
+        size = next(cache.entries())[2]
+        self.assertEqual(cache.evict(max_bytes=size)[0], 1)
+        self.assertEqual([os.path.basename(path) for path, _, _ in cache.entries()], [f'{3:064x}'])
+
+
+class ModelSearchTests(TestCase):
+    def test_schedule_ends_with_one_candidate_on_every_row(self):
+        from .model_search import rung_schedule, sample_candidates
+
+        self.assertEqual(rung_schedule(27, 3, 1408, 88), [(27, 88), (9, 156), (3, 469), (1, 1408)])
+        candidates = sample_candidates(10)
+        self.assertEqual(len({tuple(c.items()) for c in candidates}), 10)
+        self.assertEqual(candidates, sample_candidates(10))
+
+    def test_costly_candidates_lose_to_an_equally_accurate_small_one(self):
+        from sklearn.model_selection import StratifiedKFold
+        from .model_search import successive_halving
+
+        df = pd.read_csv(os.path.join(settings.BASE_DIR, 'Machine Learning', 'Crop_recommendation.csv'))
+        X, y = load_dataset(), df['label'].to_numpy()
+        folds = list(StratifiedKFold(n_splits=3).split(X, y))
+        candidates = [{'n_estimators': 60, 'max_depth': None}, {'n_estimators': 5, 'max_depth': None},
+                      {'n_estimators': 5, 'max_depth': 1}]
+        rungs = successive_halving(X, y, folds, candidates, factor=2, size_weight=1.0, log=lambda message: None)
+        self.assertEqual([len(rung) for rung in rungs], [3, 2, 1])
+        self.assertEqual(rungs[-1][0]['params'], {'n_estimators': 5, 'max_depth': None})
+        self.assertGreater(rungs[-1][0]['accuracy'], 0.9)
+        for result in rungs[0]:
+            self.assertNotIn('flat', result)
+            self.assertGreater(result['latency_ms'], 0)
+
+
+class DatasetStoreTests(TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        self.csv = os.path.join(self.directory, 'crops.csv')
+        self.store = os.path.join(self.directory, 'store')
+        with open(self.csv, 'w') as fh:
+            fh.write('N,ph,rainfall,label\n90,6.5,202.9355362,rice\n-5,7.25,226.6555374,maize\n85,6.0,,rice\n')
+
+    def test_reads_the_csv_in_compact_dtypes(self):
+        from .dataset_store import read_dataset
+
+        df = read_dataset(self.csv, self.store)
+        expected = pd.read_csv(self.csv)
+        self.assertEqual([str(dtype) for dtype in df.dtypes], ['int8', 'float32', 'float64', 'category'])
+        self.assertEqual(list(df['label'].cat.categories), ['rice', 'maize'])
+        pd.testing.assert_frame_equal(df.astype({'N': 'int64', 'ph': 'float64', 'label': expected['label'].dtype}),
+                                      expected)
+
+    def test_rebuilds_only_when_the_csv_changes(self):
+        from .dataset_store import open_store, read_dataset
+
+        self.assertTrue(open_store(self.csv, self.store)[2])
+        os.utime(self.csv, (1000, 1000))
+        self.assertFalse(open_store(self.csv, self.store)[2])
+        self.assertFalse(open_store(self.csv, self.store)[2])
+        with open(self.csv, 'a') as fh:
+            fh.write('40,5.5,100.0,apple\n')
+        self.assertTrue(open_store(self.csv, self.store)[2])
+        self.assertEqual(read_dataset(self.csv, self.store)['label'].tolist(), ['rice', 'maize', 'rice', 'apple'])
+
+    def test_appended_rows_extend_the_store_once(self):
+        from .dataset_store import append_rows, read_dataset
+
+        read_dataset(self.csv, self.store)
+        rows = pd.DataFrame({'N': [7.5], 'ph': [6.0], 'rainfall': [90.0], 'label': ['lentil'], 'extra': [1]})
+        self.assertEqual(append_rows(self.csv, rows, self.store), 1)
+        self.assertEqual(append_rows(self.csv, rows, self.store), 0)
+        rebuilt = read_dataset(self.csv, os.path.join(self.directory, 'rebuilt'))
+        pd.testing.assert_frame_equal(read_dataset(self.csv, self.store), rebuilt)
+        self.assertEqual(rebuilt['N'].tolist(), [90, -5, 85, 7.5])
+        with self.assertRaises(ValueError):
+            append_rows(self.csv, rows.drop(columns='ph'), self.store)
+
+    def test_appended_batches_are_remembered_beside_the_csv(self):
+        from .dataset_store import append_rows, appended_path, appended_row_count, read_dataset
+
+        rows = pd.DataFrame({'N': [3], 'ph': [6.0], 'rainfall': [90.0], 'label': ['x']})
+        self.assertEqual(append_rows(self.csv, rows, self.store), 1)
+        shutil.rmtree(self.store)
+        self.assertEqual(append_rows(self.csv, rows, self.store), 0)
+        # Stopped after the CSV was written but before the batch was recorded.
+        os.remove(appended_path(self.csv))
+        self.assertEqual(append_rows(self.csv, rows, self.store), 0)
+        self.assertEqual(append_rows(self.csv, rows, self.store), 0)
+        self.assertEqual(read_dataset(self.csv, self.store)['N'].tolist(), [90, -5, 85, 3])
+        self.assertEqual(appended_row_count(self.csv), 1)
+
+
+class ExperimentTests(TestCase):
+    def test_every_metric_comes_from_one_fit_per_split(self):
+        from sklearn.naive_bayes import GaussianNB
+        from sklearn.tree import DecisionTreeClassifier
+        from .experiments import build_report, run_experiments, split_dataset
+        from .training_cache import TrainingCache
+
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        df = pd.read_csv(os.path.join(settings.BASE_DIR, 'Machine Learning', 'Crop_recommendation.csv'))
+        X_train, X_test, y_train, y_test = split_dataset(load_dataset(), df['label'])
+        models = {'Tree': DecisionTreeClassifier(random_state=0), 'Bayes': GaussianNB()}
+        cache = TrainingCache(directory)
+        refit = lambda model: type(model)(**model.get_params())
+        with mock.patch('app.training_cache.clone', side_effect=refit) as fits:
+            results = run_experiments(X_train, X_test, y_train, y_test, models, cv=3, cache=cache, log=lambda m: None)
+            self.assertEqual(fits.call_count, 2 * (1 + 3))
+            again = run_experiments(X_train, X_test, y_train, y_test, models, cv=3, cache=cache, log=lambda m: None)
+            self.assertEqual(fits.call_count, 2 * (1 + 3))
+        self.assertEqual(again['Tree']['reused'], 4)
+
+        tree = results['Tree']
+        self.assertEqual(tree['metrics']['accuracy'], np.mean(tree['predictions'] == np.asarray(y_test)))
+        correct = int((tree['predictions'] == np.asarray(y_test)).sum())
+        self.assertEqual(int(tree['metrics']['confusion_matrix'].trace()), correct)
+        self.assertEqual(len(tree['cv_scores']), 3)
+        self.assertIsNone(results['Bayes']['feature_importances'])
+
+        features = ['N', 'P', 'K', 'temperature', 'humidity', 'ph', 'rainfall']
+        report = json.loads(json.dumps(build_report(results, features)))
+        self.assertEqual(report['models']['Tree']['cv']['scores'], tree['cv_scores'].tolist())
+        self.assertEqual(len(report['models']['Tree']['test']['confusion_matrix']), 22)
+        self.assertAlmostEqual(sum(report['models']['Tree']['feature_importances'].values()), 1)
+
+
+class PlotRendererTests(TestCase):
+    def test_renders_in_the_background_or_not_at_all(self):
+        from .plots import PlotRenderer
+
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        name = os.path.join(directory, 'importance')
+        disabled = PlotRenderer(enabled=False)
+        self.assertIsNone(disabled.submit('feature_importance', name, importances=[0.5], feature_names=['N'],
+                                          title='t'))
+        self.assertEqual(disabled.wait(), [])
+
+        plots = PlotRenderer(fmt='svg', jobs=1)
+        path = plots.submit('feature_importance', name, importances=[0.2, 0.8], feature_names=['N', 'P'], title='t')
+        self.assertEqual(plots.wait(), [name + '.svg'])
+        with open(path) as fh:
+            self.assertIn('<svg', fh.read())
+
+
+class IncrementalUpdateTests(TestCase):
+    def setUp(self):
+        from sklearn.ensemble import RandomForestClassifier
+
+        df = pd.read_csv(os.path.join(settings.BASE_DIR, 'Machine Learning', 'Crop_recommendation.csv'))
+        self.X, self.y = load_dataset(), df['label'].to_numpy(dtype=object)
+        self.model = RandomForestClassifier(n_estimators=10, random_state=0).fit(self.X, self.y)
+
+    def test_grow_and_refresh_keep_the_other_trees(self):
+        from .incremental import update_forest, validation_gate
+
+        grown = update_forest(self.model, self.X, self.y, mode='grow', n_trees=4, window=300, max_trees=12)
+        self.assertEqual(len(grown.estimators_), 12)
+        self.assertEqual(len(self.model.estimators_), 10)
+        np.testing.assert_array_equal(grown.estimators_[0].tree_.threshold, self.model.estimators_[2].tree_.threshold)
+        refreshed = update_forest(self.model, self.X, self.y, mode='refresh', n_trees=3)
+        self.assertEqual(len(refreshed.estimators_), 10)
+        np.testing.assert_array_equal(refreshed.estimators_[0].tree_.threshold,
+                                      self.model.estimators_[3].tree_.threshold)
+        np.testing.assert_allclose(refreshed.predict_proba(self.X[:50]).sum(axis=1), 1)
+        passed, current, candidate = validation_gate(self.model, refreshed, self.X, self.y, max_accuracy_loss=0.01)
+        self.assertTrue(passed)
+        self.assertGreater(candidate, 0.95)
+
+    def test_repeated_updates_fit_new_trees(self):
+        from .incremental import update_forest
+
+        for mode in ('grow', 'refresh'):
+            once = update_forest(self.model, self.X, self.y, mode=mode, n_trees=3, window=300)
+            twice = update_forest(once, self.X, self.y, mode=mode, n_trees=3, window=300)
+            for old, new in zip(once.estimators_[-3:], twice.estimators_[-3:]):
+                self.assertFalse(np.array_equal(old.tree_.threshold, new.tree_.threshold))
+            again = update_forest(self.model, self.X, self.y, mode=mode, n_trees=3, window=300)
+            np.testing.assert_array_equal(again.estimators_[-1].tree_.threshold, once.estimators_[-1].tree_.threshold)
+
+    def test_rejects_rows_that_do_not_match_the_classes(self):
+        from .incremental import IncrementalUpdateError, update_forest
+
+        y = self.y.copy()
+        y[-1] = 'quinoa'
+        with self.assertRaises(IncrementalUpdateError):
+            update_forest(self.model, self.X, y, mode='refresh', n_trees=2)
+        with self.assertRaises(IncrementalUpdateError):
+            update_forest(self.model, self.X[self.y != 'rice'], self.y[self.y != 'rice'], mode='refresh', n_trees=2)
+
+
+class UpdateModelRowsTests(TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        self.dataset = os.path.join(self.directory, 'crops.csv')
+        shutil.copy(os.path.join(settings.BASE_DIR, 'Machine Learning', 'Crop_recommendation.csv'), self.dataset)
+        with open(self.dataset, 'rb') as fh:
+            self.original = fh.read()
+
+    def update(self, text):
+        import update_model
+
+        rows = os.path.join(self.directory, 'rows.csv')
+        with open(rows, 'w') as fh:
+            fh.write(text)
+        output = io.StringIO()
+        with mock.patch.object(update_model, 'DATASET_PATH', self.dataset), \
+                mock.patch('sys.stdout', output):
+            status = update_model.main(['--rows', rows, '--dry-run', '--model', settings.ML_MODEL_PATH,
+                                        '--scaler', settings.ML_SCALER_PATH])
+        return status, output.getvalue()
+
+    def assert_rejected(self, text, reason):
+        status, output = self.update(text)
+        self.assertEqual(status, 2)
+        self.assertIn(reason, output)
+        with open(self.dataset, 'rb') as fh:
+            self.assertEqual(fh.read(), self.original)
+        self.assertFalse(os.path.exists(self.dataset + '.appended'))
+
+    def test_rejects_rows_that_are_not_valid_samples(self):
+        header = 'N,P,K,temperature,humidity,ph,rainfall,label\n'
+        self.assert_rejected(header + 'abc,42,43,20.8,82,6.5,202.9,rice\n', 'line 2: N is missing or not a number')
+        self.assert_rejected(header + '90,42,43,20.8,,6.5,202.9,rice\n', 'humidity is missing or not a number')
+        self.assert_rejected(header + '90,42,43,20.8,82,12,202.9,rice\n', 'Ph must be between 3.5 and 9.9')
+        self.assert_rejected(header + '90,42,43,20.8,82,6.5,202.9,\n', 'label is missing')
+        self.assert_rejected(header + '90,42,43,20.8,82,6.5,202.9,quinoa\n', 'never seen: quinoa')
+
+    def test_rejects_files_without_the_dataset_columns(self):
+        self.assert_rejected('N,P,K,temperature,humidity,ph,rainfall\n90,42,43,20.8,82,6.5,202.9\n',
+                             'Missing required column(s): label')
+        self.assert_rejected('N,P,temperature,humidity,ph,rainfall,label\n90,42,20.8,82,6.5,202.9,rice\n',
+                             'Missing required column(s): K')
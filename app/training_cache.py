@@ -0,0 +1,257 @@
+"""
+Content-addressed cache of model fits for the training scripts.
+
+An entry is keyed by a hash of the estimator class and parameters, the
+library versions, the rows it is fitted and evaluated on and the cache's
+context (the dataset file digest and feature columns), so a
+change to any of them is a different key and stale entries are never
+read. Each entry holds the predictions and accuracy on the evaluation
+rows and, when asked for, the fitted estimator, written exactly as
+``save_estimator`` writes model artifacts. Entries unused for
+``max_age`` seconds, and the least recently used ones beyond
+``max_bytes``, are removed by ``evict``.
+
+``fit_and_evaluate`` is the cached fit used by ``train_model.py``,
+``evaluate_model.py`` and ``app.model_search``; the scripts share the
+command-line options added by ``add_cache_arguments``. This module must
+not import Django.
+"""
+
+import hashlib
+import os
+import platform
+import shutil
+import tempfile
+import time
+import weakref
+from concurrent.futures import Future
+
+import joblib
+import numpy as np
+import sklearn
+from sklearn.base import clone
+from sklearn.metrics import accuracy_score
+
+DEFAULT_DIR = '.training_cache'
+
+
+def dataset_digest(path, chunk_size=1 << 20):
+    """Return the SHA-256 hex digest of a dataset file."""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as fh:
+        for chunk in iter(lambda: fh.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def clear_tree_padding(model):
+    """
+    Zero the padding bytes in the node records of every tree in ``model``.
+
+    sklearn leaves them uninitialised, so the same forest pickles differently
+    depending on what the process's memory held before, e.g. when it was fitted
+    in a worker process. With them zeroed the saved file depends only on the model.
+    """
+    for estimator in getattr(model, 'estimators_', None) or [model]:
+        tree = getattr(estimator, 'tree_', None)
+        if tree is None:
+            continue
+        state = tree.__getstate__()
+        nodes = np.zeros(state['nodes'].shape, state['nodes'].dtype)
+        for field in nodes.dtype.names:
+            nodes[field] = state['nodes'][field]
+        state['nodes'] = nodes
+        tree.__setstate__(state)
+
+
+def save_estimator(model, path):
+    """Write a fitted estimator the way model artifacts are written."""
+    clear_tree_padding(model)
+    joblib.dump(model, path)
+
+
+def _hash_array(digest, array):
+    array = np.asarray(array)
+    digest.update(f'{array.dtype.str}{array.shape}'.encode())
+    if array.dtype == object:
+        # Object arrays (string labels) hold pointers; hash the values instead.
+        digest.update('\x1f'.join(map(str, array.ravel())).encode())
+    else:
+        digest.update(np.ascontiguousarray(array).tobytes())
+
+
+class TrainingCache:
+    """Fitted estimators, predictions and scores stored under ``directory``."""
+
+    def __init__(self, directory=DEFAULT_DIR, enabled=True, context=None):
+        self.directory = directory
+        self.enabled = enabled
+        self.context = dict(context or {})
+        # Estimators read from the cache -> the artifact file they were read from.
+        self._sources = weakref.WeakKeyDictionary()
+
+    def __getstate__(self):
+        # Sent to worker processes without the estimators read here.
+        return {'directory': self.directory, 'enabled': self.enabled, 'context': self.context}
+
+    def __setstate__(self, state):
+        self.__init__(**state)
+
+    def key(self, model, *arrays, **context):
+        """Hash everything that determines the result of fitting ``model``."""
+        digest = hashlib.sha256()
+        versions = (platform.python_version(), np.__version__, sklearn.__version__, joblib.__version__)
+        params = sorted((name, repr(value)) for name, value in model.get_params().items())
+        digest.update(repr((type(model).__module__, type(model).__qualname__, params, versions)).encode())
+        digest.update(repr(sorted({**self.context, **context}.items())).encode())
+        for array in arrays:
+            _hash_array(digest, array)
+        return digest.hexdigest()
+
+    def path(self, key):
+        return os.path.join(self.directory, key[:2], key)
+
+    def get(self, key, with_model=False):
+        """Return the entry for ``key`` (a dict), or None; ``with_model`` also requires the estimator."""
+        if not self.enabled:
+            return None
+        path = self.path(key)
+        try:
+            entry = joblib.load(os.path.join(path, 'result.joblib'))
+            if with_model:
+                model_path = os.path.join(path, 'model.joblib')
+                entry['model'] = joblib.load(model_path)
+                self._sources[entry['model']] = model_path
+            os.utime(path)  # last use, for eviction
+        except (OSError, EOFError, ValueError, KeyError):
+            return None
+        return entry
+
+    def put(self, key, model=None, **result):
+        """Store ``result`` (and the fitted ``model``, if given) under ``key``."""
+        if not self.enabled:
+            return
+        path = self.path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Write into a temporary directory and rename it, so readers (and other
+        # processes storing the same key) never see a half-written entry.
+        staging = tempfile.mkdtemp(prefix=f'.{key[:8]}-', dir=os.path.dirname(path))
+        try:
+            joblib.dump(result, os.path.join(staging, 'result.joblib'))
+            if model is not None:
+                save_estimator(model, os.path.join(staging, 'model.joblib'))
+            if os.path.isdir(path):
+                shutil.rmtree(path, ignore_errors=True)
+            os.rename(staging, path)
+        except OSError:
+            shutil.rmtree(staging, ignore_errors=True)
+
+    def source(self, model):
+        """The cached artifact file ``model`` was read from, if any (copy it to save the model byte for byte)."""
+        return self._sources.get(model)
+
+    def entries(self):
+        """Yield ``(path, last used, size in bytes)`` for every entry."""
+        if not os.path.isdir(self.directory):
+            return
+        for prefix in os.listdir(self.directory):
+            prefix_dir = os.path.join(self.directory, prefix)
+            if not os.path.isdir(prefix_dir):
+                continue
+            for name in os.listdir(prefix_dir):
+                if name.startswith('.'):
+                    continue
+                path = os.path.join(prefix_dir, name)
+                try:
+                    size = sum(entry.stat().st_size for entry in os.scandir(path))
+                    yield path, os.stat(path).st_mtime, size
+                except OSError:
+                    continue
+
+    def evict(self, max_bytes=None, max_age=None):
+        """Remove entries unused for ``max_age`` seconds, then the least recently used beyond ``max_bytes``."""
+        entries = sorted(self.entries(), key=lambda entry: entry[1])
+        now = time.time()
+        removed = []
+        if max_age is not None:
+            removed += [entry for entry in entries if now - entry[1] > max_age]
+            entries = [entry for entry in entries if now - entry[1] <= max_age]
+        if max_bytes is not None:
+            total = sum(size for _, _, size in entries)
+            while entries and total > max_bytes:
+                entry = entries.pop(0)
+                total -= entry[2]
+                removed.append(entry)
+        for path, _, _ in removed:
+            shutil.rmtree(path, ignore_errors=True)
+        return len(removed), sum(size for _, _, size in removed)
+
+    def clear(self):
+        """Remove every entry."""
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def summary(self):
+        entries = list(self.entries())
+        return f'{len(entries)} entries, {sum(size for _, _, size in entries) / 2**20:.1f} MB in {self.directory}'
+
+
+def fit_and_evaluate(model, X_fit, y_fit, X_eval, y_eval, keep_model=True, cache=None):
+    """
+    Fit a fresh copy of ``model``, or reuse the cached fit, and evaluate it.
+
+    Returns a dict with the fitted ``model`` (None unless ``keep_model``), its
+    ``predictions`` and ``accuracy`` on the evaluation rows and whether it was
+    ``cached``.
+    """
+    key = cache.key(model, X_fit, y_fit, X_eval, y_eval) if cache is not None else None
+    entry = cache.get(key, with_model=keep_model) if cache is not None else None
+    if entry is not None:
+        return {'model': entry.get('model'), 'predictions': entry['predictions'], 'accuracy': entry['accuracy'],
+                'cached': True}
+    fitted = clone(model)
+    fitted.fit(X_fit, y_fit)
+    predictions = fitted.predict(X_eval)
+    accuracy = accuracy_score(y_eval, predictions)
+    if cache is not None:
+        cache.put(key, fitted if keep_model else None, predictions=predictions, accuracy=accuracy)
+    return {'model': fitted if keep_model else None, 'predictions': predictions, 'accuracy': accuracy, 'cached': False}
+
+
+def submit(pool, func, *args, **kwargs):
+    """Run ``func`` on ``pool``, or right away when there is no pool; returns a Future either way."""
+    if pool is not None:
+        return pool.submit(func, *args, **kwargs)
+    future = Future()
+    future.set_result(func(*args, **kwargs))
+    return future
+
+
+def add_cache_arguments(parser):
+    parser.add_argument('--cache-dir', default=DEFAULT_DIR,
+                        help=f'Where fitted models, predictions and CV scores are cached (default: {DEFAULT_DIR})')
+    parser.add_argument('--no-cache', action='store_true', help='Fit everything from scratch and cache nothing')
+    parser.add_argument('--clear-cache', action='store_true', help='Empty the cache first')
+    parser.add_argument('--cache-max-mb', type=float, default=500,
+                        help='Evict the least recently used entries beyond this size (default: 500)')
+    parser.add_argument('--cache-max-age-days', type=float, default=30,
+                        help='Evict entries unused for this many days (default: 30)')
+
+
+def open_cache(args, dataset_path, feature_columns):
+    """Return the TrainingCache the arguments ask for, or None with --no-cache."""
+    cache = TrainingCache(args.cache_dir, context={'dataset': dataset_digest(dataset_path),
+                                                   'features': list(feature_columns)})
+    if args.clear_cache:
+        cache.clear()
+        print(f"Cleared the training cache in {args.cache_dir}")
+    return None if args.no_cache else cache
+
+
+def close_cache(cache, args):
+    """Apply the eviction limits and report what the cache holds."""
+    if cache is None:
+        return
+    count, size = cache.evict(max_bytes=args.cache_max_mb * 2**20, max_age=args.cache_max_age_days * 86400)
+    if count:
+        print(f"Evicted {count} cache entries ({size / 2**20:.1f} MB)")
+    print(f"Training cache: {cache.summary()}")
@@ -1,7 +1,5 @@
-from unicodedata import category
 from django.shortcuts import render, redirect, reverse, get_object_or_404
 from django.http import HttpResponse
-from pyparsing import empty
 from .models import *
 from .forms import *
 from django.contrib.auth.models import Group
@@ -12,13 +10,19 @@ from django.contrib import messages
 from django.contrib.auth import update_session_auth_hash
 from django.contrib.auth.forms import PasswordChangeForm
 from django.views.decorators.http import require_http_methods
-from django.http import JsonResponse
+from django.http import JsonResponse, StreamingHttpResponse
 from django.views.decorators.csrf import csrf_exempt
+from django.conf import settings
 import json
-import pandas as pd
-import numpy as np
-import joblib
-from sklearn.preprocessing import StandardScaler
+from .bulk_scoring import (CONTENT_TYPES, OUTPUT_FORMATS, iter_csv_records, iter_lines, iter_ndjson_records,
+                           read_csv_header, render_csv, render_ndjson, score_records)
+from .latency import latency_stats, stage, timed_view
+from .lookup_grid import predict_label
+from .model_registry import get_model_bundle
+from .prediction import (InvalidInput, get_prediction_cache, parse_batch, parse_sample, parse_top_k, predict_batch,
+                         predict_sample, ranked_crops, top_k_classes)
+from .readiness import readiness
+from .response_encoding import get_encoder, parse_response_format
 
 # Create your views here.
 
@@ -260,14 +264,18 @@ def change_password_visitor(request):
 #<-----Find Crop for Visitor----->#
 @login_required(login_url='visitor_login')
 @user_passes_test(is_visitor)
+@timed_view
 def visitor_find_crop(request):
     result = ''
     error_message = ''
+    recommendations = []
 
     if request.method == 'POST':
         form = FindCropForm(request.POST)
 
-        if form.is_valid():
+        with stage('validate'):
+            is_valid = form.is_valid()
+        if is_valid:
             try:
                 # Extract validated data
                 nitrogen = form.cleaned_data['nitrogen']
@@ -294,24 +302,26 @@ def visitor_find_crop(request):
                 elif not (20.2 <= rainfall <= 298.6):
                     error_message = "Rainfall must be between 20.2 cm and 298.6 cm"
                 else:
-                    # Load pre-trained model and scaler
+                    # Prepare input data
+                    input_data = [nitrogen, phosphorus, potassium, temperature, humidity, ph, rainfall]
+
+                    top_k = form.cleaned_data.get('top_k')
+
+                    # Make prediction with the model loaded by this process
                     try:
-                        model = joblib.load('crop_model.joblib')
-                        scaler = joblib.load('scaler.joblib')
+                        with stage('predict'):
+                            if top_k:
+                                bundle, predicted_crop, probabilities = predict_sample(input_data)
+                                recommendations = ranked_crops(bundle.classes, probabilities,
+                                                               top_k_classes(probabilities, top_k)[0])
+                                for crop in recommendations:
+                                    crop['percent'] = round(crop['probability'] * 100, 1)
+                            else:
+                                predicted_crop = predict_label(input_data)
                     except FileNotFoundError:
                         error_message = "Model files not found. Please contact administrator."
                         return render(request, 'visitor/visitor_find_crop.html', {'form': form, 'error_message': error_message})
 
-                    # Prepare input data
-                    input_data = np.array([[nitrogen, phosphorus, potassium, temperature, humidity, ph, rainfall]])
-
-                    # Scale the input
-                    input_scaled = scaler.transform(input_data)
-
-                    # Make prediction
-                    prediction = model.predict(input_scaled)
-                    predicted_crop = prediction[0]
-
                     result = f"The predicted crop is {predicted_crop}"
 
             except Exception as e:
@@ -321,106 +331,103 @@ def visitor_find_crop(request):
     else:
         form = FindCropForm()
 
-    return render(request, 'visitor/visitor_find_crop.html', {
-        'form': form,
-        'result': result,
-        'error_message': error_message
-    })
+    with stage('render'):
+        return render(request, 'visitor/visitor_find_crop.html', {
+            'form': form,
+            'result': result,
+            'recommendations': recommendations,
+            'error_message': error_message
+        })
 
 
 
 #<-----API Endpoint for Crop Prediction----->#
 @csrf_exempt
 @require_http_methods(["POST"])
+@timed_view
 def predict_crop_api(request):
     """
     API endpoint for crop prediction.
     Accepts JSON with: nitrogen, phosphorus, potassium, temperature, humidity, ph, rainfall
-    Returns JSON with prediction or error.
+    Returns JSON with prediction or error. With ?top_k=N only the N most
+    probable crops are returned, best first, instead of every probability.
+    ?format=array lists the classes once and the probabilities as an array.
     """
     try:
-        # Parse JSON data
-        data = json.loads(request.body)
-
-        # Extract parameters
-        required_fields = ['nitrogen', 'phosphorus', 'potassium', 'temperature', 'humidity', 'ph', 'rainfall']
-        input_data = []
-
-        for field in required_fields:
-            if field not in data:
-                return JsonResponse({
-                    'error': f'Missing required field: {field}'
-                }, status=400)
-            try:
-                value = float(data[field])
-                input_data.append(value)
-            except (ValueError, TypeError):
-                return JsonResponse({
-                    'error': f'Invalid value for {field}: must be a number'
-                }, status=400)
-
-        nitrogen, phosphorus, potassium, temperature, humidity, ph, rainfall = input_data
-
-        # Input validation ranges
-        validations = {
-            'nitrogen': (0, 140),
-            'phosphorus': (0, 145),
-            'potassium': (0, 205),
-            'temperature': (8.8, 43.7),
-            'humidity': (14.3, 99.98),
-            'ph': (3.5, 9.9),
-            'rainfall': (20.2, 298.6)
-        }
-
-        for field, (min_val, max_val) in validations.items():
-            value = locals()[field]
-            if not (min_val <= value <= max_val):
-                return JsonResponse({
-                    'error': f'{field.capitalize()} must be between {min_val} and {max_val}'
-                }, status=400)
-
-        # Load model and scaler
+        # Parse and validate JSON data
+        with stage('parse'):
+            data = json.loads(request.body)
         try:
-            model = joblib.load('crop_model.joblib')
-            scaler = joblib.load('scaler.joblib')
+            with stage('validate'):
+                input_data = parse_sample(data)
+                top_k = parse_top_k(request.GET.get('top_k'))
+                response_format = parse_response_format(request.GET.get('format'))
+        except InvalidInput as e:
+            return JsonResponse({
+                'error': str(e)
+            }, status=400)
+
+        # Make prediction with the model loaded by this process
+        try:
+            with stage('predict'):
+                bundle, predicted_crop, probabilities = predict_sample(input_data)
         except FileNotFoundError:
             return JsonResponse({
                 'error': 'Model files not found. Please contact administrator.'
             }, status=500)
 
-        # Prepare and scale input
-        input_array = np.array([input_data])
-        input_scaled = scaler.transform(input_array)
+        with stage('serialize'):
+            body = get_encoder(bundle).sample(input_data, predicted_crop, probabilities, top_k, response_format)
+            return HttpResponse(body, content_type='application/json')
 
-        # Make prediction
-        prediction = model.predict(input_scaled)
-        predicted_crop = prediction[0]
+    except json.JSONDecodeError:
+        return JsonResponse({
+            'error': 'Invalid JSON format'
+        }, status=400)
+    except Exception as e:
+        return JsonResponse({
+            'error': f'Internal server error: {str(e)}'
+        }, status=500)
+
+
+#<-----API Endpoint for Batch Crop Prediction----->#
+@csrf_exempt
+@require_http_methods(["POST"])
+@timed_view
+def predict_crop_batch_api(request):
+    """
+    API endpoint for predicting many samples in one request.
+    Accepts JSON {"samples": [...]} (or a bare list) where each sample is an object
+    with the same fields as predict_crop_api or a list of the seven values in order.
+    Returns one result per sample; invalid samples get an error without failing the batch.
+    Accepts ?top_k=N and ?format=array like predict_crop_api.
+    """
+    try:
+        # Validate every sample in one vectorized pass
+        with stage('parse'):
+            data = json.loads(request.body)
+        try:
+            with stage('validate'):
+                matrix, valid, errors = parse_batch(data)
+                top_k = parse_top_k(request.GET.get('top_k'))
+                response_format = parse_response_format(request.GET.get('format'))
+        except InvalidInput as e:
+            return JsonResponse({
+                'error': str(e)
+            }, status=400)
 
-        # Get prediction probabilities if available
+        # Scale and predict all valid rows at once
         try:
-            probabilities = model.predict_proba(input_scaled)[0]
-            crop_classes = model.classes_
-            prob_dict = dict(zip(crop_classes, probabilities))
-        except:
-            prob_dict = None
-
-        response = {
-            'prediction': predicted_crop,
-            'input_data': {
-                'nitrogen': nitrogen,
-                'phosphorus': phosphorus,
-                'potassium': potassium,
-                'temperature': temperature,
-                'humidity': humidity,
-                'ph': ph,
-                'rainfall': rainfall
-            }
-        }
-
-        if prob_dict:
-            response['probabilities'] = prob_dict
-
-        return JsonResponse(response)
+            with stage('predict'):
+                bundle, rows, labels, probabilities = predict_batch(matrix, valid)
+        except FileNotFoundError:
+            return JsonResponse({
+                'error': 'Model files not found. Please contact administrator.'
+            }, status=500)
+
+        with stage('serialize'):
+            body = get_encoder(bundle).batch(len(matrix), errors, rows, labels, probabilities, top_k, response_format)
+            return HttpResponse(body, content_type='application/json')
 
     except json.JSONDecodeError:
         return JsonResponse({
@@ -432,6 +439,82 @@ def predict_crop_api(request):
         }, status=500)
 
 
+#<-----API Endpoint for Streaming Bulk Scoring----->#
+@csrf_exempt
+@require_http_methods(["POST"])
+def predict_crop_bulk_api(request):
+    """
+    API endpoint for scoring large uploads.
+    Accepts a text/csv body in the layout of Crop_recommendation.csv (header required)
+    or an application/x-ndjson body with one sample per line.
+    Streams back one result per row as NDJSON (default) or CSV (?format=csv).
+    """
+    output_format = request.GET.get('format', 'ndjson')
+    if output_format not in OUTPUT_FORMATS:
+        return JsonResponse({
+            'error': f'format must be one of: {", ".join(OUTPUT_FORMATS)}'
+        }, status=400)
+
+    try:
+        bundle = get_model_bundle()
+    except FileNotFoundError:
+        return JsonResponse({
+            'error': 'Model files not found. Please contact administrator.'
+        }, status=500)
+
+    # Read the body incrementally; never touch request.body
+    lines = iter_lines(request, settings.ML_BULK_READ_CHUNK_BYTES)
+    if request.content_type == 'text/csv':
+        try:
+            records = iter_csv_records(lines, read_csv_header(lines))
+        except ValueError as e:
+            return JsonResponse({'error': str(e)}, status=400)
+    elif request.content_type in ('application/x-ndjson', 'application/jsonl'):
+        records = iter_ndjson_records(lines)
+    else:
+        return JsonResponse({
+            'error': 'Content-Type must be text/csv or application/x-ndjson'
+        }, status=415)
+
+    chunks = score_records(records, bundle, settings.ML_BULK_CHUNK_ROWS)
+    render = render_csv if output_format == 'csv' else render_ndjson
+    response = StreamingHttpResponse(render(chunks), content_type=CONTENT_TYPES[output_format])
+    response['X-Model-Version'] = bundle.version
+    return response
+
+
+#<-----Prediction Cache Statistics (Admin only)----->#
+@login_required(login_url='admin_login')
+@user_passes_test(is_admin)
+def prediction_cache_stats(request):
+    cache = get_prediction_cache()
+    if cache is None:
+        return JsonResponse({'enabled': False})
+    return JsonResponse({'enabled': True, **cache.stats()})
+
+
+#<-----Health Checks----->#
+def health(request):
+    """Liveness: the process is up and serving requests."""
+    return JsonResponse({'status': 'ok'})
+
+
+def health_ready(request):
+    """
+    Readiness: 200 once this worker has loaded the model and run a warm-up
+    prediction, with the model version and load times; 503 until then.
+    """
+    is_ready, details = readiness()
+    return JsonResponse(details, status=200 if is_ready else 503)
+
+
+#<-----Prediction Latency Histograms (Admin only)----->#
+@login_required(login_url='admin_login')
+@user_passes_test(is_admin)
+def prediction_latency_stats(request):
+    return JsonResponse(latency_stats())
+
+
 #<-----Signup For Admin (Protected - Only accessible by existing admins)----->#
 @login_required(login_url='admin_login')
 @user_passes_test(is_admin)
@@ -5,27 +5,22 @@ This script evaluates the ML-based crop recommendation model and generates metri
 """
 
 # Import required libraries
-from sklearn.metrics import accuracy_score, precision_score, recall_score, f1_score
-from sklearn.metrics import classification_report, confusion_matrix
-from sklearn.model_selection import train_test_split, cross_val_score
-from sklearn.ensemble import RandomForestClassifier
-from sklearn.tree import DecisionTreeClassifier
-from sklearn.naive_bayes import GaussianNB
-import pandas as pd
+from sklearn.metrics import classification_report
+from sklearn.preprocessing import StandardScaler
+import argparse
 import numpy as np
-import matplotlib.pyplot as plt
-import seaborn as sns
+from app.dataset_store import read_dataset
+from app.experiments import (REPORT_PATH, build_report, classification_metrics, experiment_models,
+                             run_experiments, split_dataset, write_report)
+from app.plots import add_plot_arguments, open_renderer
+from app.training_cache import add_cache_arguments, close_cache, open_cache
 import warnings
 warnings.filterwarnings('ignore')
 
-# Set style for better visualizations
-sns.set_style('whitegrid')
-plt.rcParams['figure.figsize'] = (12, 8)
 
-
-def evaluate_crop_model(y_test, y_pred, model_name="Crop Recommendation Model"):
+def evaluate_crop_model(y_test, y_pred, model_name="Crop Recommendation Model", metrics=None, plots=None):
     """
-    Calculate all metrics for crop recommendation model
+    Report all metrics for crop recommendation model
     
     Parameters:
     -----------
@@ -35,6 +30,11 @@ def evaluate_crop_model(y_test, y_pred, model_name="Crop Recommendation Model"):
         Predicted labels
     model_name : str
         Name of the model for display
+    metrics : dict or None
+        The metrics of these predictions from the experiment run (computed
+        here when not given)
+    plots : PlotRenderer or None
+        Where to queue the confusion matrix chart
     
     Returns:
     --------
@@ -43,15 +43,17 @@ def evaluate_crop_model(y_test, y_pred, model_name="Crop Recommendation Model"):
     print("="*70)
     print(f"AGROSMART - {model_name.upper()} EVALUATION")
     print("="*70)
+    if metrics is None:
+        metrics = classification_metrics(y_test, y_pred)
     
     # 1. Accuracy
-    accuracy = accuracy_score(y_test, y_pred)
+    accuracy = metrics['accuracy']
     print(f"\nAccuracy: {accuracy * 100:.2f}%")
 
     # 2. Precision, Recall, F1-Score (weighted for multi-class)
-    precision = precision_score(y_test, y_pred, average='weighted', zero_division=0)
-    recall = recall_score(y_test, y_pred, average='weighted', zero_division=0)
-    f1 = f1_score(y_test, y_pred, average='weighted', zero_division=0)
+    precision = metrics['precision']
+    recall = metrics['recall']
+    f1 = metrics['f1_score']
 
     print(f"Precision: {precision * 100:.2f}%")
     print(f"Recall: {recall * 100:.2f}%")
@@ -64,65 +66,40 @@ def evaluate_crop_model(y_test, y_pred, model_name="Crop Recommendation Model"):
     print(classification_report(y_test, y_pred, zero_division=0))
     
     # 4. Confusion Matrix
-    cm = confusion_matrix(y_test, y_pred)
+    cm = metrics['confusion_matrix']
     print("\nConfusion Matrix:")
     print(cm)
     
-    # Visualize confusion matrix
-    plt.figure(figsize=(12, 10))
-    
-    # Get unique labels
-    labels = sorted(y_test.unique())
-    
-    sns.heatmap(cm, annot=True, fmt='d', cmap='Blues', 
-                xticklabels=labels, yticklabels=labels,
-                cbar_kws={'label': 'Count'})
-    plt.title(f'{model_name} - Confusion Matrix\nAccuracy: {accuracy*100:.2f}%', 
-              fontsize=14, fontweight='bold')
-    plt.ylabel('Actual Crop', fontsize=12)
-    plt.xlabel('Predicted Crop', fontsize=12)
-    plt.xticks(rotation=45, ha='right')
-    plt.yticks(rotation=0)
-    plt.tight_layout()
-    
-    filename = f'agrosmart_confusion_matrix_{model_name.lower().replace(" ", "_")}.png'
-    plt.savefig(filename, dpi=300, bbox_inches='tight')
-    print(f"\nConfusion matrix saved as '{filename}'")
-    plt.close()
+    # Visualize confusion matrix (rendered in the background)
+    if plots is not None:
+        plots.submit('confusion_matrix', f'agrosmart_confusion_matrix_{model_name.lower().replace(" ", "_")}',
+                     matrix=cm, labels=metrics['labels'],
+                     title=f'{model_name} - Confusion Matrix\nAccuracy: {accuracy*100:.2f}%')
     
-    return {
-        'accuracy': accuracy,
-        'precision': precision,
-        'recall': recall,
-        'f1_score': f1,
-        'confusion_matrix': cm
-    }
+    return metrics
 
 
-def cross_validate_model(model, X, y, cv=5):
+def cross_validate_model(cv_scores):
     """
-    Perform k-fold cross-validation
+    Report k-fold cross-validation scores
+    
+    The folds are fitted once by the experiment run (see app/experiments.py),
+    on the training split.
     
     Parameters:
     -----------
-    model : estimator object
-        The machine learning model to evaluate
-    X : array-like
-        Feature matrix
-    y : array-like
-        Target labels
-    cv : int
-        Number of folds for cross-validation
+    cv_scores : array
+        Accuracy of each fold
     
     Returns:
     --------
     array : Cross-validation scores
     """
     print("\n" + "="*70)
-    print(f"CROSS-VALIDATION ({cv}-FOLD)")
+    print(f"CROSS-VALIDATION ({len(cv_scores)}-FOLD)")
     print("="*70)
     
-    scores = cross_val_score(model, X, y, cv=cv, scoring='accuracy')
+    scores = np.asarray(cv_scores)
     
     print(f"\nIndividual fold scores: {[f'{score*100:.2f}%' for score in scores]}")
     print(f"\nMean Accuracy: {scores.mean() * 100:.2f}%")
@@ -133,16 +110,20 @@ def cross_validate_model(model, X, y, cv=5):
     return scores
 
 
-def compare_models(X_train, X_test, y_train, y_test):
+def compare_models(results, y_test, reported=(), plots=None):
     """
     Compare multiple ML models for crop recommendation
     
     Parameters:
     -----------
-    X_train, X_test : array-like
-        Training and test features
-    y_train, y_test : array-like
-        Training and test labels
+    results : dict
+        The experiment run's results for every model
+    y_test : array-like
+        Test labels
+    reported : collection
+        Models whose evaluation was already printed
+    plots : PlotRenderer or None
+        Where to queue the charts
     
     Returns:
     --------
@@ -152,81 +133,46 @@ def compare_models(X_train, X_test, y_train, y_test):
     print("MODEL COMPARISON")
     print("="*70)
     
-    models = {
-        'Random Forest': RandomForestClassifier(n_estimators=100, random_state=42),
-        'Decision Tree': DecisionTreeClassifier(random_state=42),
-        'Naive Bayes': GaussianNB()
-    }
-    
-    results = {}
+    comparison = {}
     
-    for name, model in models.items():
-        print(f"\n{'='*70}")
-        print(f"Training {name}...")
-        print('='*70)
-        
-        # Train
-        model.fit(X_train, y_train)
-        
-        # Predict
-        y_pred = model.predict(X_test)
-        
-        # Evaluate
-        metrics = evaluate_crop_model(y_test, y_pred, name)
+    for name, result in results.items():
+        if name not in reported:
+            print(f"\n{'='*70}")
+            print(f"{name}")
+            print('='*70)
+            
+            # Evaluate the shared predictions
+            evaluate_crop_model(y_test, result['predictions'], name, result['metrics'], plots)
         
-        results[name] = metrics
+        comparison[name] = result['metrics']
     
     # Visualize comparison
-    plot_model_comparison(results)
+    if plots is not None:
+        plot_model_comparison(comparison, plots)
     
-    return results
+    return comparison
 
 
-def plot_model_comparison(results):
+def plot_model_comparison(results, plots):
     """
-    Create visualization comparing different models
+    Queue the chart comparing different models
     
     Parameters:
     -----------
     results : dict
         Dictionary containing metrics for each model
+    plots : PlotRenderer
+        Where to queue the chart
     """
-    models = list(results.keys())
     metrics_names = ['accuracy', 'precision', 'recall', 'f1_score']
-    
-    fig, ax = plt.subplots(figsize=(12, 6))
-    
-    x = np.arange(len(models))
-    width = 0.2
-    
-    colors = ['#2E86AB', '#A23B72', '#F18F01', '#C73E1D']
-    
-    for i, metric in enumerate(metrics_names):
-        values = [results[model][metric] * 100 for model in models]
-        ax.bar(x + i * width, values, width, label=metric.capitalize(), color=colors[i])
-    
-    ax.set_xlabel('Models', fontsize=12, fontweight='bold')
-    ax.set_ylabel('Score (%)', fontsize=12, fontweight='bold')
-    ax.set_title('AgroSmart - Model Performance Comparison', fontsize=14, fontweight='bold')
-    ax.set_xticks(x + width * 1.5)
-    ax.set_xticklabels(models)
-    ax.legend()
-    ax.grid(axis='y', alpha=0.3)
-    ax.set_ylim([0, 105])
-    
-    # Add value labels on bars
-    for container in ax.containers:
-        ax.bar_label(container, fmt='%.1f', padding=3)
-    
-    plt.tight_layout()
-    plt.savefig('agrosmart_model_comparison.png', dpi=300, bbox_inches='tight')
-    print("\nModel comparison chart saved as 'agrosmart_model_comparison.png'")
-    plt.close()
+    plots.submit('metric_comparison', 'agrosmart_model_comparison',
+                 results={model: {metric: metrics[metric] for metric in metrics_names}
+                          for model, metrics in results.items()})
 
 
-def plot_feature_importance(model, feature_names, model_name="Random Forest"):
+def plot_feature_importance(model, feature_names, model_name="Random Forest", plots=None):
     """
-    Plot feature importance for tree-based models
+    Report feature importance for tree-based models
     
     Parameters:
     -----------
@@ -236,6 +182,8 @@ def plot_feature_importance(model, feature_names, model_name="Random Forest"):
         List of feature names
     model_name : str
         Name of the model
+    plots : PlotRenderer or None
+        Where to queue the chart
     """
     if hasattr(model, 'feature_importances_'):
         print("\n" + "="*70)
@@ -249,23 +197,31 @@ def plot_feature_importance(model, feature_names, model_name="Random Forest"):
         for i, idx in enumerate(indices):
             print(f"{i+1}. {feature_names[idx]}: {importances[idx]*100:.2f}%")
         
-        # Plot
-        plt.figure(figsize=(10, 6))
-        plt.bar(range(len(importances)), importances[indices], color='skyblue', edgecolor='navy')
-        plt.xlabel('Features', fontsize=12, fontweight='bold')
-        plt.ylabel('Importance', fontsize=12, fontweight='bold')
-        plt.title(f'{model_name} - Feature Importance', fontsize=14, fontweight='bold')
-        plt.xticks(range(len(importances)), [feature_names[i] for i in indices], rotation=45, ha='right')
-        plt.tight_layout()
-        plt.savefig('agrosmart_feature_importance.png', dpi=300, bbox_inches='tight')
-        print("\nFeature importance chart saved as 'agrosmart_feature_importance.png'")
-        plt.close()
+        # Plot (rendered in the background)
+        if plots is not None:
+            plots.submit('feature_importance', 'agrosmart_feature_importance', importances=importances,
+                         feature_names=feature_names, title=f'{model_name} - Feature Importance', bold=True)
+
+
+DATASET_PATH = 'Machine Learning/Crop_recommendation.csv'
 
 
-def main():
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Evaluate the crop recommendation model.')
+    parser.add_argument('--jobs', type=int, default=-1,
+                        help='Processes for the cross-validation folds and charts; -1 uses every core (default: -1)')
+    parser.add_argument('--report', default=REPORT_PATH,
+                        help=f'Where to write the metrics of every model as JSON (default: {REPORT_PATH})')
+    add_cache_arguments(parser)
+    add_plot_arguments(parser)
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
     """
     Main execution function
     """
+    args = parse_args(argv)
     print("\n" + "="*70)
     print("AGROSMART - CROP RECOMMENDATION MODEL EVALUATION")
     print("Author: Varshasri R V")
@@ -278,7 +234,7 @@ def main():
         print("\n[Step 1/5] Loading dataset...")
         
         # Update this path to your actual dataset location
-        df = pd.read_csv('Machine Learning/Crop_recommendation.csv')
+        df = read_dataset(DATASET_PATH)
         
         print(f"Dataset loaded successfully!")
         print(f"  - Total samples: {len(df)}")
@@ -301,6 +257,7 @@ def main():
         
         X = df[feature_columns]
         y = df[target_column]
+        cache = open_cache(args, DATASET_PATH, feature_columns)
         
         print(f"Features (X): {X.shape}")
         print(f"Target (y): {y.shape}")
@@ -312,9 +269,9 @@ def main():
         # ===========================
         print("\n[Step 3/5] Splitting data (80% train, 20% test)...")
         
-        X_train, X_test, y_train, y_test = train_test_split(
-            X, y, test_size=0.2, random_state=42, stratify=y
-        )
+        # Standardized as train_model.py does, so both scripts share their fits
+        X_scaled = StandardScaler().fit_transform(X)
+        X_train, X_test, y_train, y_test = split_dataset(X_scaled, y)
         
         print(f"Training set: {X_train.shape[0]} samples")
         print(f"Test set: {X_test.shape[0]} samples")
@@ -322,35 +279,37 @@ def main():
         # ===========================
         # 4. TRAIN AND EVALUATE MODEL
         # ===========================
-        print("\n[Step 4/5] Training Random Forest model...")
-        
-        model = RandomForestClassifier(
-            n_estimators=100,
-            max_depth=10,
-            random_state=42,
-            n_jobs=-1
-        )
+        print("\n[Step 4/5] Training models...")
         
-        model.fit(X_train, y_train)
-        print("Model trained successfully!")
+        # Every model is fitted once per split (or reused from the cache)
+        results = run_experiments(X_train, X_test, y_train, y_test, experiment_models(), jobs=args.jobs, cache=cache)
+        forest = results['Random Forest']
+        print("Models trained successfully!")
+        write_report(build_report(results, feature_columns, dataset=DATASET_PATH, n_train=len(X_train),
+                                  n_test=len(X_test)), args.report)
+        print(f"Experiment report saved as '{args.report}'")
         
-        # Make predictions
-        y_pred = model.predict(X_test)
+        # Charts render in the background from here on
+        plots = open_renderer(args)
         
         # Evaluate
-        metrics = evaluate_crop_model(y_test, y_pred, "Random Forest")
+        metrics = evaluate_crop_model(y_test, forest['predictions'], "Random Forest", forest['metrics'], plots)
         
         # Cross-validation
-        cv_scores = cross_validate_model(model, X, y, cv=5)
+        cv_scores = cross_validate_model(forest['cv_scores'])
         
         # Feature importance
-        plot_feature_importance(model, feature_columns, "Random Forest")
+        plot_feature_importance(forest['model'], feature_columns, "Random Forest", plots)
         
         # ===========================
         # 5. COMPARE MODELS (OPTIONAL)
         # ===========================
         print("\n[Step 5/5] Comparing multiple models...")
-        comparison_results = compare_models(X_train, X_test, y_train, y_test)
+        comparison_results = compare_models(results, y_test, reported=['Random Forest'], plots=plots)
+        close_cache(cache, args)
+        charts = plots.wait()
+        if charts:
+            print(f"\nCharts saved: {', '.join(charts)}")
         
         # ===========================
         # FINAL SUMMARY
@@ -369,15 +328,14 @@ def main():
         print("EVALUATION COMPLETED SUCCESSFULLY!")
         print("="*70)
         print("\nGenerated files:")
-        print("  1. agrosmart_confusion_matrix_random_forest.png")
-        print("  2. agrosmart_feature_importance.png")
-        print("  3. agrosmart_model_comparison.png")
+        for i, path in enumerate([args.report] + charts, 1):
+            print(f"  {i}. {path}")
         print("\n")
         
     except FileNotFoundError:
         print("\nERROR: Dataset file not found!")
         print("Please update the file path in the script:")
-        print("  df = pd.read_csv('YOUR_DATASET_PATH.csv')")
+        print("  DATASET_PATH = 'YOUR_DATASET_PATH.csv'")
         
     except KeyError as e:
         print(f"\n❌ ERROR: Column not found: {e}")
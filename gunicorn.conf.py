@@ -0,0 +1,15 @@
+"""
+Gunicorn hooks, read automatically from the working directory.
+
+Command-line flags (see the Dockerfile and docker-compose.yml) still set
+the bind address, worker count and timeout.
+"""
+
+import gc
+
+
+def pre_fork(server, worker):
+    # With --preload the model is already loaded here. Moving everything
+    # allocated so far out of the collector's reach stops gc passes in the
+    # workers from writing to those objects and so copying their pages.
+    gc.freeze()
@@ -0,0 +1,20 @@
+"""
+ASGI config for project2 project.
+
+It exposes the ASGI callable as a module-level variable named ``application``.
+
+For more information on this file, see
+https://docs.djangoproject.com/en/3.2/howto/deployment/asgi/
+"""
+
+import os
+
+from django.core.asgi import get_asgi_application
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'project2.settings')
+
+application = get_asgi_application()
+
+from app.readiness import preload  # noqa: E402
+
+preload()
@@ -68,22 +68,32 @@ TEMPLATES = [
 ]
 
 WSGI_APPLICATION = 'project2.wsgi.application'
+ASGI_APPLICATION = 'project2.asgi.application'
 
 
-DATABASES = {
-    'default': {
-        'ENGINE': 'django.db.backends.mysql',
-        'NAME': os.environ.get('DATABASE_NAME', 'Algosmart'),
-        'USER': os.environ.get('DATABASE_USER', 'root'),
-        'PASSWORD': os.environ.get('DATABASE_PASSWORD', '9854'),
-        'HOST': os.environ.get('DATABASE_HOST', 'localhost'),
-        'PORT': os.environ.get('DATABASE_PORT', '3306'),
-        'OPTIONS': {
-            'init_command': "SET sql_mode='STRICT_TRANS_TABLES'",
-            'charset': 'utf8mb4',
-        },
+# DATABASE_ENGINE=sqlite runs against a local SQLite file (e.g. for `manage.py load_test`)
+if os.environ.get('DATABASE_ENGINE', 'mysql') == 'sqlite':
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': os.environ.get('DATABASE_NAME', os.path.join(BASE_DIR, 'db.sqlite3')),
+        }
+    }
+else:
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.mysql',
+            'NAME': os.environ.get('DATABASE_NAME', 'Algosmart'),
+            'USER': os.environ.get('DATABASE_USER', 'root'),
+            'PASSWORD': os.environ.get('DATABASE_PASSWORD', '9854'),
+            'HOST': os.environ.get('DATABASE_HOST', 'localhost'),
+            'PORT': os.environ.get('DATABASE_PORT', '3306'),
+            'OPTIONS': {
+                'init_command': "SET sql_mode='STRICT_TRANS_TABLES'",
+                'charset': 'utf8mb4',
+            },
+        }
     }
-}
 
 DEFAULT_AUTO_FIELD = 'django.db.models.AutoField'
 
@@ -127,6 +137,54 @@ CRISPY_TEMPLATE_PACK = 'bootstrap4'
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 
+# Crop recommendation model artifacts (the model may also be a compact .npz from train_model.py --compact)
+ML_MODEL_PATH = os.environ.get('ML_MODEL_PATH', os.path.join(BASE_DIR, 'crop_model.joblib'))
+ML_SCALER_PATH = os.environ.get('ML_SCALER_PATH', os.path.join(BASE_DIR, 'scaler.joblib'))
+# Flattened forest exported by train_model.py; used for small inputs when present
+ML_FLAT_MODEL_PATH = os.environ.get('ML_FLAT_MODEL_PATH', os.path.join(BASE_DIR, 'crop_model_flat.npz'))
+# Labeled training data
+ML_DATASET_PATH = os.environ.get('ML_DATASET_PATH', os.path.join(BASE_DIR, 'Machine Learning', 'Crop_recommendation.csv'))
+# Load the model when the WSGI/ASGI app is imported; with `gunicorn --preload` the workers share it
+ML_MODEL_PRELOAD = os.environ.get('ML_MODEL_PRELOAD', 'False') == 'True'
+# Memory-map flat .npz forests so every worker maps the same pages
+ML_MODEL_MMAP = os.environ.get('ML_MODEL_MMAP', 'False') == 'True'
+# Seconds between checks for new artifacts on disk (negative disables hot-swapping)
+ML_MODEL_RELOAD_INTERVAL = float(os.environ.get('ML_MODEL_RELOAD_INTERVAL', '5'))
+# Largest number of samples accepted by the batch prediction endpoint
+ML_BATCH_MAX_SAMPLES = int(os.environ.get('ML_BATCH_MAX_SAMPLES', '5000'))
+# Streaming bulk scoring: bytes read from the upload at a time and rows scored per chunk
+ML_BULK_READ_CHUNK_BYTES = int(os.environ.get('ML_BULK_READ_CHUNK_BYTES', str(64 * 1024)))
+ML_BULK_CHUNK_ROWS = int(os.environ.get('ML_BULK_CHUNK_ROWS', '1024'))
+# Micro-batch concurrent single-sample predictions (needs threaded workers, e.g. gunicorn --threads)
+ML_COALESCE_ENABLED = os.environ.get('ML_COALESCE_ENABLED', 'False') == 'True'
+ML_COALESCE_WINDOW_MS = float(os.environ.get('ML_COALESCE_WINDOW_MS', '2'))
+ML_COALESCE_MAX_BATCH = int(os.environ.get('ML_COALESCE_MAX_BATCH', '64'))
+# LRU cache of single-sample predictions (0 disables it); entries expire after TTL seconds.
+# Cached samples are predicted from their rounded values (see ML_PREDICTION_CACHE_DECIMALS)
+ML_PREDICTION_CACHE_SIZE = int(os.environ.get('ML_PREDICTION_CACHE_SIZE', '0'))
+ML_PREDICTION_CACHE_TTL = float(os.environ.get('ML_PREDICTION_CACHE_TTL', '3600'))
+# Decimals each input is rounded to when building the cache key, and before predicting it
+ML_PREDICTION_CACHE_DECIMALS = {
+    'nitrogen': 0,
+    'phosphorus': 0,
+    'potassium': 0,
+    'temperature': 1,
+    'humidity': 1,
+    'ph': 2,
+    'rainfall': 1,
+}
+# Precomputed decision grid (see `manage.py build_lookup_grid`); used by the visitor page when enabled
+ML_LOOKUP_GRID_ENABLED = os.environ.get('ML_LOOKUP_GRID_ENABLED', 'False') == 'True'
+ML_LOOKUP_GRID_PATH = os.environ.get('ML_LOOKUP_GRID_PATH', os.path.join(BASE_DIR, 'crop_model_grid'))
+# Per-stage latency histograms for the prediction views (admin-only at /api/latency/),
+# optionally also sent to clients as a Server-Timing header
+ML_LATENCY_ENABLED = os.environ.get('ML_LATENCY_ENABLED', 'False') == 'True'
+ML_LATENCY_SERVER_TIMING = os.environ.get('ML_LATENCY_SERVER_TIMING', 'False') == 'True'
+# Threads running model calls for the async API views under ASGI
+ML_INFERENCE_THREADS = int(os.environ.get('ML_INFERENCE_THREADS', '4'))
+# Decimal places of the probabilities in prediction API responses
+ML_RESPONSE_DECIMALS = int(os.environ.get('ML_RESPONSE_DECIMALS', '6'))
+
 # Security Settings (for production)
 if not DEBUG:
     SECURE_SSL_REDIRECT = False  # Set to True when using HTTPS
@@ -20,6 +20,7 @@ from django.contrib.auth.views import LogoutView
 from django.conf import settings
 from django.conf.urls.static import static
 from app import views
+from app import async_views
 
 urlpatterns = [
     path('admin/', admin.site.urls),
@@ -57,6 +58,14 @@ urlpatterns = [
     path('visitor_find_crop',visitor_find_crop, name='visitor_find_crop'),
 
     path('api/predict-crop/', predict_crop_api, name='predict_crop_api'),
+    path('api/predict-crop/batch/', predict_crop_batch_api, name='predict_crop_batch_api'),
+    path('api/predict-crop/bulk/', predict_crop_bulk_api, name='predict_crop_bulk_api'),
+    path('api/async/predict-crop/', async_views.predict_crop_api_async, name='predict_crop_api_async'),
+    path('api/async/predict-crop/batch/', async_views.predict_crop_batch_api_async, name='predict_crop_batch_api_async'),
+    path('api/prediction-cache/', prediction_cache_stats, name='prediction_cache_stats'),
+    path('api/latency/', prediction_latency_stats, name='prediction_latency_stats'),
+    path('health/', health, name='health'),
+    path('health/ready/', health_ready, name='health_ready'),
 
     path('admin-signup/', views.admin_signup, name='admin_signup'),
 ]
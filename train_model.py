@@ -3,28 +3,37 @@ AgroSmart - Crop Recommendation Model Training Script
 Trains and saves the ML model for production use.
 """
 
-import pandas as pd
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
 import numpy as np
-from sklearn.model_selection import train_test_split, cross_val_score
-from sklearn.ensemble import RandomForestClassifier
-from sklearn.svm import SVC
-from sklearn.linear_model import LogisticRegression
+from sklearn.model_selection import StratifiedKFold
 from sklearn.preprocessing import StandardScaler
 from sklearn.metrics import accuracy_score, classification_report
 import joblib
-import matplotlib.pyplot as plt
-import seaborn as sns
+from app.dataset_store import read_dataset
+from app.flat_forest import FlatForest
+from app.experiments import (CV_FOLDS, DEFAULT_FOREST_PARAMS, REPORT_PATH, build_report, experiment_models,
+                             run_experiments, split_dataset, write_report)
+from app.model_search import (SEARCH_SPACE, describe, evaluate_candidate, objective, sample_candidates,
+                              successive_halving, time_candidates)
+from app.training_cache import add_cache_arguments, close_cache, open_cache, save_estimator
+from app.plots import add_plot_arguments, open_renderer
 import warnings
 warnings.filterwarnings('ignore')
 
-# Set style for plots
-sns.set_style('whitegrid')
-plt.rcParams['figure.figsize'] = (12, 8)
+DATASET_PATH = 'Machine Learning/Crop_recommendation.csv'
 
-def load_and_preprocess_data(filepath='Machine Learning/Crop_recommendation.csv'):
+def load_and_preprocess_data(filepath=DATASET_PATH):
     """Load and preprocess the dataset."""
     print("Loading dataset...")
-    df = pd.read_csv(filepath)
+    df = read_dataset(filepath)
 
     # Features and target
     feature_columns = ['N', 'P', 'K', 'temperature', 'humidity', 'ph', 'rainfall']
@@ -43,80 +52,98 @@ def load_and_preprocess_data(filepath='Machine Learning/Crop_recommendation.csv'
 
     return X_scaled, y, feature_columns, scaler
 
-def train_and_compare_models(X_train, X_test, y_train, y_test):
-    """Train and compare different models."""
-    models = {
-        'Random Forest': RandomForestClassifier(n_estimators=100, random_state=42),
-        'SVM': SVC(kernel='rbf', random_state=42),
-        'Logistic Regression': LogisticRegression(random_state=42, max_iter=1000)
-    }
+def train_and_compare_models(X_train, X_test, y_train, y_test, jobs=1, cache=None, forest_params=None):
+    """
+    Train and compare different models.
 
-    results = {}
+    Runs the experiment shared with evaluate_model.py (see app/experiments.py):
+    every model is fitted once on the training split and once per
+    cross-validation fold, the folds on a pool of ``jobs`` processes (-1: one
+    per core). Every estimator is seeded, so scores and saved models are the
+    same for any ``jobs``. Fits already in ``cache`` (a TrainingCache) are reused.
+    """
+    models = experiment_models(forest_params)
 
     print("\n" + "="*60)
     print("MODEL TRAINING AND COMPARISON")
     print("="*60)
 
-    for name, model in models.items():
-        print(f"\nTraining {name}...")
-
-        # Train
-        model.fit(X_train, y_train)
-
-        # Predict
-        y_pred = model.predict(X_test)
+    results = run_experiments(X_train, X_test, y_train, y_test, models, jobs=jobs, cache=cache)
+    for name, result in results.items():
+        print(f"\n{name}: test accuracy {result['accuracy']:.4f}, "
+              f"CV accuracy {result['cv_mean']:.4f} (+/- {result['cv_std']:.4f})")
 
-        # Evaluate
-        accuracy = accuracy_score(y_test, y_pred)
-        print(".2f")
+    return results
 
-        # Cross-validation
-        cv_scores = cross_val_score(model, X_train, y_train, cv=5, scoring='accuracy')
-        print(".2f")
+def search_forest(X_train, y_train, args, cache=None):
+    """
+    Pick the Random Forest's parameters by successive halving (see app/model_search.py).
 
-        results[name] = {
-            'model': model,
-            'accuracy': accuracy,
-            'cv_mean': cv_scores.mean(),
-            'cv_std': cv_scores.std()
-        }
+    The candidates are scored on the same cross-validation folds as the
+    model comparison, on a pool of ``args.jobs`` processes. The winner and
+    the default parameters are reported side by side and every rung is
+    written to ``args.search_output``. Returns the winner's parameters.
+    """
+    folds = list(StratifiedKFold(n_splits=CV_FOLDS).split(X_train, y_train))
+    y_train_array = np.asarray(y_train)
+    candidates = sample_candidates(args.search_candidates)
+    workers = os.cpu_count() if args.jobs < 1 else args.jobs
 
-    return results
-
-def plot_model_comparison(results):
-    """Plot model comparison."""
+    print("\n" + "="*60)
+    print("HYPERPARAMETER SEARCH")
+    print("="*60)
+    print(f"\nSearching {len(candidates)} Random Forest candidates (keeping 1/{args.search_factor} per rung) "
+          f"on {workers} process(es)...")
+    print(f"Score = accuracy - {args.latency_weight} x single-row latency (ms) - {args.size_weight} x size (MB)")
+
+    started = time.perf_counter()
+    pool = ProcessPoolExecutor(max_workers=workers) if workers > 1 else None
+    try:
+        rungs = successive_halving(X_train, y_train_array, folds, candidates, factor=args.search_factor,
+                                   latency_weight=args.latency_weight, size_weight=args.size_weight,
+                                   pool=pool, cache=cache)
+    finally:
+        if pool is not None:
+            pool.shutdown()
+    best = rungs[-1][0]
+    # The current parameters on the same footing, for comparison.
+    baseline = search_result(X_train, y_train_array, folds, DEFAULT_FOREST_PARAMS, args, cache)
+
+    print(f"\nSearched in {time.perf_counter() - started:.1f}s")
+    print(f"\n{'':<10}{'CV accuracy':>13}{'Latency (ms)':>14}{'Size (KB)':>11}{'Score':>9}  Parameters")
+    for label, result in (('Best', best), ('Default', baseline)):
+        print(f"{label:<10}{result['accuracy']:>13.4f}{result['latency_ms']:>14.3f}"
+              f"{result['size_bytes'] / 1024:>11.0f}{result['score']:>9.4f}  {describe(result['params'])}")
+
+    with open(args.search_output, 'w') as fh:
+        json.dump({
+            'space': SEARCH_SPACE,
+            'factor': args.search_factor,
+            'latency_weight': args.latency_weight,
+            'size_weight': args.size_weight,
+            'best': best,
+            'default': baseline,
+            'rungs': rungs,
+        }, fh, indent=2)
+    print(f"Search results saved to {args.search_output}")
+    return best['params']
+
+def search_result(X, y, folds, params, args, cache=None):
+    """Score ``params`` on the full folds the way the search's last rung does."""
+    result = evaluate_candidate(params, X, y, folds, min(len(fit_rows) for fit_rows, _ in folds), cache=cache)
+    time_candidates([result], X[folds[0][1]])
+    result['score'] = objective(result, args.latency_weight, args.size_weight)
+    return result
+
+def plot_model_comparison(results, plots):
+    """Queue the model comparison chart on ``plots`` (a PlotRenderer)."""
     models = list(results.keys())
-    accuracies = [results[m]['accuracy'] for m in models]
-    cv_means = [results[m]['cv_mean'] for m in models]
-
-    x = np.arange(len(models))
-    width = 0.35
-
-    fig, ax = plt.subplots(figsize=(10, 6))
-    ax.bar(x - width/2, accuracies, width, label='Test Accuracy', alpha=0.8)
-    ax.bar(x + width/2, cv_means, width, label='CV Mean Accuracy', alpha=0.8)
-
-    ax.set_xlabel('Models')
-    ax.set_ylabel('Accuracy')
-    ax.set_title('Model Performance Comparison')
-    ax.set_xticks(x)
-    ax.set_xticklabels(models)
-    ax.legend()
-    ax.grid(axis='y', alpha=0.3)
-
-    # Add value labels
-    for i, v in enumerate(accuracies):
-        ax.text(i - width/2, v + 0.01, '.3f', ha='center')
-    for i, v in enumerate(cv_means):
-        ax.text(i + width/2, v + 0.01, '.3f', ha='center')
-
-    plt.tight_layout()
-    plt.savefig('model_comparison.png', dpi=300, bbox_inches='tight')
-    plt.close()
-    print("Model comparison plot saved as 'model_comparison.png'")
-
-def plot_feature_importance(model, feature_names):
-    """Plot feature importance for Random Forest."""
+    return plots.submit('training_comparison', 'model_comparison', models=models,
+                        accuracies=[results[m]['accuracy'] for m in models],
+                        cv_means=[results[m]['cv_mean'] for m in models])
+
+def plot_feature_importance(model, feature_names, plots):
+    """Report feature importance for Random Forest and queue its chart on ``plots``."""
     if hasattr(model, 'feature_importances_'):
         importances = model.feature_importances_
         indices = np.argsort(importances)[::-1]
@@ -128,46 +155,149 @@ def plot_feature_importance(model, feature_names):
         for i, idx in enumerate(indices):
             print("2d")
 
-        plt.figure(figsize=(10, 6))
-        plt.bar(range(len(importances)), importances[indices], color='skyblue', edgecolor='navy')
-        plt.xlabel('Features')
-        plt.ylabel('Importance')
-        plt.title('Random Forest - Feature Importance')
-        plt.xticks(range(len(importances)), [feature_names[i] for i in indices], rotation=45, ha='right')
-        plt.tight_layout()
-        plt.savefig('feature_importance.png', dpi=300, bbox_inches='tight')
-        plt.close()
-        print("Feature importance plot saved as 'feature_importance.png'")
-
-def save_model_and_scaler(model, scaler, model_path='crop_model.joblib', scaler_path='scaler.joblib'):
+        return plots.submit('feature_importance', 'feature_importance', importances=importances,
+                            feature_names=feature_names, title='Random Forest - Feature Importance')
+
+def save_model_and_scaler(model, scaler, model_path='crop_model.joblib', scaler_path='scaler.joblib', cache=None):
     """Save the trained model and scaler."""
-    joblib.dump(model, model_path)
+    source = cache.source(model) if cache is not None else None
+    if source is not None:
+        # Reloaded estimators pickle to different (equivalent) bytes; keep the file as first written.
+        shutil.copyfile(source, model_path)
+    else:
+        save_estimator(model, model_path)
     joblib.dump(scaler, scaler_path)
     print(f"\nModel saved to {model_path}")
     print(f"Scaler saved to {scaler_path}")
 
-def main():
+def export_flat_forest(model, scaler, path='crop_model_flat.npz'):
+    """Flatten the Random Forest into contiguous arrays with the scaler folded into its thresholds."""
+    flat = FlatForest.from_sklearn(model).fold_scaler(scaler)
+    flat.save(path)
+    print(f"Flat forest exported to {path} ({flat.nbytes / 1024:.0f} KB of arrays)")
+    return flat
+
+# Pruning levels tried by the compact export, mildest first (see FlatForest.from_sklearn).
+COMPACT_PURITY_LEVELS = (1.0, 0.99, 0.95, 0.9, 0.8, 0.7, 0.6)
+
+# Loads one artifact in a fresh interpreter so earlier allocations don't skew the numbers.
+LOAD_PROBE = """
+import json, sys, time
+import joblib, sklearn.ensemble
+from app.flat_forest import FlatForest
+from app.resource_usage import rss_bytes
+path = sys.argv[1]
+before = rss_bytes()
+started = time.perf_counter()
+model = FlatForest.load(path) if path.endswith('.npz') else joblib.load(path)
+print(json.dumps({'seconds': time.perf_counter() - started, 'rss': rss_bytes() - before}))
+"""
+
+def measure_artifact(path):
+    """Return the file size, load time and RSS growth of loading an artifact."""
+    probe = subprocess.run([sys.executable, '-c', LOAD_PROBE, path], capture_output=True, text=True, check=True,
+                           cwd=os.path.dirname(os.path.abspath(__file__)))
+    stats = json.loads(probe.stdout)
+    stats['bytes'] = os.path.getsize(path)
+    return stats
+
+def report_artifacts(paths):
+    """Print size, load time and RSS for each artifact."""
+    print(f"\n{'Artifact':<28}{'Size (KB)':>12}{'Load (ms)':>12}{'RSS (MB)':>12}")
+    for path in paths:
+        stats = measure_artifact(path)
+        print(f"{path:<28}{stats['bytes'] / 1024:>12.0f}{stats['seconds'] * 1000:>12.1f}{stats['rss'] / 2**20:>12.2f}")
+
+def export_compact_forest(model, scaler, X_test, y_test, max_accuracy_loss, path='crop_model_compact.npz'):
+    """
+    Prune and quantize the Random Forest as far as the accuracy budget allows.
+
+    Every level in COMPACT_PURITY_LEVELS is evaluated on the held-out split; the
+    smallest candidate at most ``max_accuracy_loss`` below the full model is saved.
+    """
+    print("\n" + "="*60)
+    print("COMPACT MODEL EXPORT")
+    print("="*60)
+
+    X_raw = scaler.inverse_transform(X_test)
+    baseline = accuracy_score(y_test, model.predict(X_test))
+    print(f"Full model accuracy: {baseline:.4f} (budget: -{max_accuracy_loss:.4f})")
+
+    best = None
+    for purity in COMPACT_PURITY_LEVELS:
+        candidate = FlatForest.from_sklearn(model, purity=purity).fold_scaler(scaler).quantize()
+        accuracy = accuracy_score(y_test, candidate.predict(X_raw))
+        within = baseline - accuracy <= max_accuracy_loss
+        print(f"  purity {purity:.2f}: {len(candidate.value)} leaves, {candidate.nbytes / 1024:.0f} KB, "
+              f"accuracy {accuracy:.4f}{'' if within else ' (over budget)'}")
+        if within and (best is None or candidate.nbytes < best.nbytes):
+            best = candidate
+
+    if best is None:
+        print("No compact model stays within the accuracy budget; nothing exported")
+        return None
+    best.save(path)
+    print(f"Compact model exported to {path}")
+    return best
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Train the crop recommendation model.')
+    parser.add_argument('--compact', action='store_true',
+                        help='Also export a pruned, quantized model to crop_model_compact.npz')
+    parser.add_argument('--max-accuracy-loss', type=float, default=0.005,
+                        help='Largest held-out accuracy drop allowed for the compact model (default: 0.005)')
+    parser.add_argument('--jobs', type=int, default=-1,
+                        help='Processes for the cross-validation folds and charts; -1 uses every core (default: -1)')
+    parser.add_argument('--report', default=REPORT_PATH,
+                        help=f'Where to write the metrics of every model as JSON (default: {REPORT_PATH})')
+    parser.add_argument('--search', action='store_true',
+                        help='Pick the Random Forest parameters by successive halving before training')
+    parser.add_argument('--search-candidates', type=int, default=27,
+                        help='Parameter combinations sampled for the search (default: 27)')
+    parser.add_argument('--search-factor', type=int, default=3,
+                        help='Share of candidates kept, and growth in rows, per rung (default: 3)')
+    parser.add_argument('--latency-weight', type=float, default=0.005,
+                        help='Accuracy given up per ms of single-row latency (default: 0.005)')
+    parser.add_argument('--size-weight', type=float, default=0.002,
+                        help='Accuracy given up per MB of crop_model.joblib (default: 0.002)')
+    parser.add_argument('--search-output', default='model_search.json',
+                        help='Where to write every candidate\'s scores (default: model_search.json)')
+    add_cache_arguments(parser)
+    add_plot_arguments(parser)
+    return parser.parse_args(argv)
+
+def main(argv=None):
     """Main training function."""
+    args = parse_args(argv)
+
     print("="*60)
     print("AGROSMART - CROP RECOMMENDATION MODEL TRAINING")
     print("="*60)
 
     # Load and preprocess data
     X, y, feature_names, scaler = load_and_preprocess_data()
+    cache = open_cache(args, DATASET_PATH, feature_names)
 
     # Split data
-    X_train, X_test, y_train, y_test = train_test_split(
-        X, y, test_size=0.2, random_state=42, stratify=y
-    )
+    X_train, X_test, y_train, y_test = split_dataset(X, y)
 
     print(f"\nTraining set: {X_train.shape[0]} samples")
     print(f"Test set: {X_test.shape[0]} samples")
 
+    # Tune the Random Forest
+    forest_params = search_forest(X_train, y_train, args, cache=cache) if args.search else None
+
     # Train and compare models
-    results = train_and_compare_models(X_train, X_test, y_train, y_test)
+    results = train_and_compare_models(X_train, X_test, y_train, y_test, jobs=args.jobs, cache=cache,
+                                       forest_params=forest_params)
+
+    write_report(build_report(results, feature_names, dataset=DATASET_PATH, n_train=len(X_train), n_test=len(X_test)),
+                 args.report)
+    print(f"Experiment report saved as '{args.report}'")
 
-    # Plot comparison
-    plot_model_comparison(results)
+    # Charts render in the background while the model is saved
+    plots = open_renderer(args)
+    plot_model_comparison(results, plots)
 
     # Select best model (Random Forest as specified)
     best_model_name = 'Random Forest'
@@ -178,10 +308,17 @@ def main():
     print(".2f")
 
     # Feature importance
-    plot_feature_importance(best_model, feature_names)
+    plot_feature_importance(best_model, feature_names, plots)
 
     # Save model and scaler
-    save_model_and_scaler(best_model, scaler)
+    save_model_and_scaler(best_model, scaler, cache=cache)
+    export_flat_forest(best_model, scaler)
+    if args.compact and export_compact_forest(best_model, scaler, X_test, y_test, args.max_accuracy_loss):
+        report_artifacts(['crop_model.joblib', 'crop_model_flat.npz', 'crop_model_compact.npz'])
+    close_cache(cache, args)
+    charts = plots.wait()
+    if charts:
+        print(f"Charts saved: {', '.join(charts)}")
 
     print("\n" + "="*60)
     print("TRAINING COMPLETED SUCCESSFULLY!")
@@ -189,8 +326,14 @@ def main():
     print("\nGenerated files:")
     print("  - crop_model.joblib")
     print("  - scaler.joblib")
-    print("  - model_comparison.png")
-    print("  - feature_importance.png")
+    print("  - crop_model_flat.npz")
+    if args.compact:
+        print("  - crop_model_compact.npz")
+    for chart in charts:
+        print(f"  - {chart}")
+    print(f"  - {args.report}")
+    if args.search:
+        print(f"  - {args.search_output}")
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -0,0 +1,181 @@
+"""
+AgroSmart - Incremental Model Update
+Adds newly labeled samples to the dataset and updates the production model
+without retraining it from scratch.
+"""
+
+import argparse
+import hashlib
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+import joblib
+from app.dataset_store import append_rows, appended_row_count, read_dataset
+from app.experiments import split_dataset
+from app.flat_forest import FlatForest
+from app.incremental import MODES, IncrementalUpdateError, update_forest, validation_gate
+from app.prediction import validate_matrix
+from app.training_cache import dataset_digest, save_estimator
+import warnings
+warnings.filterwarnings('ignore')
+
+DATASET_PATH = 'Machine Learning/Crop_recommendation.csv'
+FEATURE_COLUMNS = ['N', 'P', 'K', 'temperature', 'humidity', 'ph', 'rainfall']
+TARGET_COLUMN = 'label'
+
+def check_rows(rows):
+    """
+    Return the reasons the DataFrame ``rows`` cannot be appended to the dataset, one per bad row.
+
+    Every feature must be a finite number within the API's validation
+    ranges (app/prediction.py) and every row needs a label.
+    """
+    missing = [column for column in FEATURE_COLUMNS + [TARGET_COLUMN] if column not in rows.columns]
+    if missing:
+        return [f"Missing required column(s): {', '.join(missing)}"]
+    matrix = rows[FEATURE_COLUMNS].apply(pd.to_numeric, errors='coerce').to_numpy(dtype=np.float64)
+    errors = {}
+    for i, row in enumerate(matrix):
+        bad = [column for column, value in zip(FEATURE_COLUMNS, row) if not np.isfinite(value)]
+        if bad:
+            errors[i] = f'{bad[0]} is missing or not a number'
+    _, errors = validate_matrix(matrix, errors)
+    for i in np.flatnonzero(rows[TARGET_COLUMN].isna()):
+        errors.setdefault(int(i), f'{TARGET_COLUMN} is missing')
+    # Line numbers as in the file, after its header.
+    return [f'line {i + 2}: {errors[i]}' for i in sorted(errors)]
+
+def model_version(paths):
+    """The version the app reports for these artifact files (see app/model_registry.py)."""
+    checksums = ''.join(dataset_digest(path) for path in paths if os.path.exists(path))
+    return hashlib.sha256(checksums.encode()).hexdigest()[:12]
+
+def replace_file(path, write):
+    """Write a new ``path`` next to it with ``write(temp_path)`` and rename it over the old one."""
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, temp_path = tempfile.mkstemp(prefix='.update-', suffix=os.path.splitext(path)[1], dir=directory)
+    os.close(fd)
+    try:
+        write(temp_path)
+        os.replace(temp_path, path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+def publish(model, scaler, model_path, flat_path):
+    """
+    Swap the updated model in.
+
+    Every file is renamed into place, never rewritten, so memory-mapped
+    flat forests stay valid and running workers pick the new version up on
+    their next check (see app/model_registry.py). The flat export records
+    the forest it came from, so a worker checking between the two renames
+    keeps the old pair and retries instead of loading a mismatched one.
+    The scaler is unchanged.
+    """
+    flat = FlatForest.from_sklearn(model).fold_scaler(scaler)
+    replace_file(flat_path, flat.save)
+    replace_file(model_path, lambda path: save_estimator(model, path))
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Update the crop recommendation model with newly labeled samples.')
+    parser.add_argument('--rows', help='CSV of newly labeled samples to append to the dataset first')
+    parser.add_argument('--mode', choices=MODES, default='grow',
+                        help='grow: add trees fitted on the newest rows; refresh: refit the oldest trees on '
+                             'all of them (default: grow)')
+    parser.add_argument('--trees', type=int, default=20, help='Trees to add or refit (default: 20)')
+    parser.add_argument('--window', type=int, default=500,
+                        help='Newest training rows the added trees are fitted on (default: 500)')
+    parser.add_argument('--max-trees', type=int, default=200,
+                        help='Drop the oldest trees beyond this many when growing (default: 200)')
+    parser.add_argument('--max-accuracy-loss', type=float, default=0.0,
+                        help='Largest held-out accuracy drop allowed before the swap (default: 0)')
+    parser.add_argument('--jobs', type=int, default=-1, help='Threads fitting the new trees; -1 uses every core')
+    parser.add_argument('--dry-run', action='store_true', help='Validate the update but keep the current model')
+    parser.add_argument('--model', default='crop_model.joblib', help='Production model (default: crop_model.joblib)')
+    parser.add_argument('--scaler', default='scaler.joblib', help='Production scaler (default: scaler.joblib)')
+    parser.add_argument('--flat-model', default='crop_model_flat.npz',
+                        help='Flat export served for small inputs (default: crop_model_flat.npz)')
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    """Main update function; returns the exit status."""
+    args = parse_args(argv)
+
+    print("="*60)
+    print("AGROSMART - INCREMENTAL MODEL UPDATE")
+    print("="*60)
+
+    model = joblib.load(args.model)
+    scaler = joblib.load(args.scaler)
+    if args.rows:
+        rows = pd.read_csv(args.rows)
+        problems = check_rows(rows)
+        if problems:
+            # Nothing is written, so the dataset keeps only rows the model can use.
+            print(f"\nERROR: {args.rows} cannot be appended:")
+            for problem in problems:
+                print(f"  {problem}")
+            return 2
+        unknown = sorted(set(rows[TARGET_COLUMN].astype(str)) - set(map(str, model.classes_)))
+        if unknown:
+            # Incremental updates cannot add classes; keep the dataset as it is.
+            print(f"\nERROR: {args.rows} has crops the model has never seen: {', '.join(unknown)}")
+            print("Append them to the dataset and retrain with train_model.py")
+            return 2
+        appended = append_rows(DATASET_PATH, rows)
+        print(f"\nAppended {appended} labeled rows from {args.rows}" if appended else
+              f"\n{args.rows} was already appended; updating from the current dataset")
+
+    df = read_dataset(DATASET_PATH)
+    original = len(df) - appended_row_count(DATASET_PATH)
+    current_version = model_version([args.model, args.scaler, args.flat_model])
+    print(f"\nDataset: {len(df)} rows, {len(df) - original} of them added by updates")
+    print(f"Current model: version {current_version}, {len(model.estimators_)} trees")
+
+    # train_model.py's split of the rows it was run on; appended rows only ever train, so
+    # the held-out rows stay the same from one update to the next. Training rows stay in
+    # file order, oldest first.
+    X = scaler.transform(df[FEATURE_COLUMNS])
+    y = np.asarray(df[TARGET_COLUMN], dtype=object)
+    train_rows, holdout_rows, _, _ = split_dataset(np.arange(original), y[:original])
+    train_rows = np.concatenate([np.sort(train_rows), np.arange(original, len(df))])
+
+    started = time.perf_counter()
+    try:
+        candidate = update_forest(model, X[train_rows], y[train_rows], mode=args.mode, n_trees=args.trees,
+                                  window=args.window, max_trees=args.max_trees, n_jobs=args.jobs)
+    except IncrementalUpdateError as e:
+        print(f"\nERROR: {e}")
+        return 2
+    print(f"Candidate ({args.mode}, {args.trees} trees): {len(candidate.estimators_)} trees, "
+          f"fitted in {time.perf_counter() - started:.1f}s")
+
+    # Validation gate
+    passed, current_accuracy, candidate_accuracy = validation_gate(
+        model, candidate, X[holdout_rows], y[holdout_rows], args.max_accuracy_loss)
+    print(f"\nHeld-out accuracy on {len(holdout_rows)} rows: current {current_accuracy:.4f}, "
+          f"candidate {candidate_accuracy:.4f} (allowed loss {args.max_accuracy_loss:.4f})")
+    if not passed:
+        print("Validation gate FAILED; keeping the current model")
+        return 1
+    if args.dry_run:
+        print("Validation gate passed; dry run, keeping the current model")
+        return 0
+
+    publish(candidate, scaler, args.model, args.flat_model)
+    print(f"Validation gate passed; published version "
+          f"{model_version([args.model, args.scaler, args.flat_model])} to {args.model} and {args.flat_model}")
+
+    print("\n" + "="*60)
+    print("UPDATE COMPLETED SUCCESSFULLY!")
+    print("="*60)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())